@@ -0,0 +1,189 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+An in-memory stand-in for the parts of S3 and CloudFormation that
+CloudFormation Plus uses, so that processing and actions can be measured
+without AWS.  Use it like this:
+
+    with fake_aws.installed() as aws:
+        aws.make_bucket('my-bucket')
+        ...
+'''
+
+import contextlib
+import itertools
+import botocore
+from cfnplus import utils
+
+def _not_found(operation):
+    return botocore.exceptions.ClientError(\
+        {'Error': {'Code': '404', 'Message': 'Not Found'}}, operation)
+
+class _Version(object):
+    def __init__(self, version_id, data, metadata, is_delete_marker=False):
+        self.version_id = version_id
+        self.data = data
+        self.metadata = metadata
+        self.is_delete_marker = is_delete_marker
+
+class FakeObject(object):
+    def __init__(self, bucket, key):
+        self._bucket = bucket
+        self.key = key
+
+    def _latest(self):
+        versions = self._bucket.versions.get(self.key, [])
+        if len(versions) == 0 or versions[-1].is_delete_marker:
+            raise _not_found('HeadObject')
+        return versions[-1]
+
+    @property
+    def version_id(self):
+        return self._latest().version_id
+
+    @property
+    def metadata(self):
+        return self._latest().metadata
+
+    def reload(self):
+        self._latest()
+
+    def delete(self, VersionId=None):
+        versions = self._bucket.versions.setdefault(self.key, [])
+        if VersionId is None:
+            version_id = self._bucket.next_version_id()
+            versions.append(_Version(version_id, None, {}, True))
+            return {'VersionId': version_id}
+        versions[:] = [v for v in versions if v.version_id != VersionId]
+        return {'VersionId': VersionId}
+
+    def wait_until_exists(self, **kwargs):
+        pass
+
+    def wait_until_not_exists(self, **kwargs):
+        pass
+
+class _FakeObjectCollection(object):
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def filter(self, Prefix=''):
+        for key in sorted(self._bucket.versions.keys()):
+            versions = self._bucket.versions[key]
+            if key.startswith(Prefix) and len(versions) > 0 and \
+                not versions[-1].is_delete_marker:
+                yield FakeObject(self._bucket, key)
+
+class FakeBucket(object):
+    def __init__(self, name):
+        self.name = name
+        self.versions = {} # key -> list of _Version, oldest first
+        self.objects = _FakeObjectCollection(self)
+        self._version_ids = itertools.count(1)
+
+    def next_version_id(self):
+        return 'v{}'.format(next(self._version_ids))
+
+    def Object(self, key): # pylint: disable=invalid-name
+        return FakeObject(self, key)
+
+    def put_object(self, Key, Body=b'', Metadata=None):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        self.versions.setdefault(Key, []).append(_Version(\
+            self.next_version_id(), data, dict(Metadata or {})))
+        return FakeObject(self, Key)
+
+class _FakeS3Resource(object):
+    def __init__(self, aws):
+        self._aws = aws
+
+    def Bucket(self, name): # pylint: disable=invalid-name
+        return self._aws.buckets[name]
+
+class _FakeS3Client(object):
+    def __init__(self, aws):
+        self._aws = aws
+
+    def head_bucket(self, Bucket):
+        if Bucket not in self._aws.buckets:
+            raise botocore.exceptions.ClientError(\
+                {'Error': {'Code': '404', 'Message': 'Not Found'}}, \
+                'HeadBucket')
+        return {}
+
+class _FakeCloudFormationClient(object):
+    def __init__(self, aws):
+        self._aws = aws
+
+    def list_exports(self, NextToken=None):
+        exports = [{'Name': k, 'Value': v} for k, v in \
+            sorted(self._aws.exports.items())]
+        return {'Exports': exports}
+
+    def set_stack_policy(self, StackName, StackPolicyBody):
+        self._aws.stack_policies[StackName] = StackPolicyBody
+
+class FakeAws(object):
+    def __init__(self):
+        self.buckets = {}
+        self.exports = {}
+        self.stack_policies = {}
+
+    def make_bucket(self, name):
+        self.buckets[name] = FakeBucket(name)
+        return self.buckets[name]
+
+    def client(self, service_name, aws_region):
+        if service_name == 's3':
+            return _FakeS3Client(self)
+        if service_name == 'cloudformation':
+            return _FakeCloudFormationClient(self)
+        raise NotImplementedError(service_name)
+
+    def resource(self, service_name, aws_region):
+        if service_name == 's3':
+            return _FakeS3Resource(self)
+        raise NotImplementedError(service_name)
+
+@contextlib.contextmanager
+def installed():
+    '''
+    Make CloudFormation Plus use a new FakeAws object, instead of AWS, in the
+    body of a "with" statement.
+    '''
+
+    aws = FakeAws()
+    orig = (utils.aws_client, utils.aws_resource)
+    utils.aws_client = aws.client
+    utils.aws_resource = aws.resource
+    try:
+        yield aws
+    finally:
+        utils.aws_client, utils.aws_resource = orig
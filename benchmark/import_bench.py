@@ -0,0 +1,80 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Measure how long a fresh Python process takes to import CloudFormation Plus
+and process a template without any actions (e.g., to lint a template or to
+render new_template in a pre-commit hook), and compare it with the time taken
+just to import boto3.  Neither boto3 nor botocore should be imported.
+
+Usage: python benchmark/import_bench.py [NBR_RUNS]
+'''
+
+import sys
+import os
+import subprocess
+import time
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+_TEMPLATE_ONLY_SCRIPT = '''
+import sys
+import cfnplus
+template = '{"Resources": {"Topic": {"Type": "AWS::SNS::Topic"}}}'
+with cfnplus.process_template(template, [], 'us-west-2', \\
+    output_format='json') as result:
+    pass
+loaded = [m for m in ('boto3', 'botocore') if m in sys.modules]
+if len(loaded) > 0:
+    sys.exit('Imported: ' + ', '.join(loaded))
+'''
+
+def _time_process(script):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = _ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', script], env=env)
+    return time.time() - start
+
+def main():
+    nbr_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    cases = [
+        ('start Python', 'pass'),
+        ('import boto3', 'import boto3'),
+        ('import cfnplus', 'import cfnplus'),
+        ('process template w/o actions', _TEMPLATE_ONLY_SCRIPT),
+    ]
+
+    for name, script in cases:
+        secs = min(_time_process(script) for _ in range(nbr_runs))
+        print("{:<30} {:>8.1f} ms".format(name, secs * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Compare the speed of parsing and serializing templates with
+cfnplus.serialization against the pure-Python PyYAML path that was used
+before.
+
+Usage: python benchmark/serialization_bench.py [NBR_RESOURCES]
+'''
+
+import sys
+import os
+import timeit
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cfnplus import serialization # pylint: disable=wrong-import-position
+
+class _PurePythonDumper(yaml.SafeDumper):
+    def ignore_aliases(self, data): # override
+        return True
+
+def make_template(nbr_resources):
+    '''
+    :return: A YAML template of roughly 1 KB per resource, with anchors.
+    '''
+
+    lines = [
+        'AWSTemplateFormatVersion: 2010-09-09',
+        'Metadata:',
+        '  Policy: &policy',
+        '    Version: 2012-10-17',
+        '    Statement:',
+        '      - Effect: Allow',
+        "        Action: ['s3:GetObject', 's3:PutObject', 's3:ListBucket']",
+        "        Resource: {'Fn::Sub': 'arn:aws:s3:::${Bucket}/*'}",
+        'Resources:',
+    ]
+    for i in range(nbr_resources):
+        lines += [
+            '  Function{}:'.format(i),
+            "    Type: 'AWS::Lambda::Function'",
+            '    Properties:',
+            '      Handler: index.handler',
+            '      Runtime: python3.6',
+            '      Timeout: 30',
+            '      Environment:',
+            '        Variables:',
+            "          TABLE: {'Fn::Sub': '${Prefix}-table-" + str(i) + "'}",
+            "          QUEUE: {'Fn::ImportValue': 'queue-" + str(i) + "'}",
+            '      Tags:',
+            '        - {Key: Name, Value: function-' + str(i) + '}',
+            '        - {Key: Team, Value: platform}',
+            '  Role{}:'.format(i),
+            "    Type: 'AWS::IAM::Role'",
+            '    Properties:',
+            '      Policies:',
+            '        - PolicyName: policy-{}'.format(i),
+            '          PolicyDocument: *policy',
+        ]
+    return '\n'.join(lines) + '\n'
+
+def main():
+    nbr_resources = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    yaml_str = make_template(nbr_resources)
+    template = serialization.load_template(yaml_str)
+    json_str = serialization.dump_template(template, serialization.FORMAT_JSON)
+    nbr_runs = 3
+
+    cases = [
+        ('parse YAML (pure Python)', \
+            lambda: yaml.load(yaml_str, Loader=yaml.SafeLoader)),
+        ('parse YAML (cfnplus)', \
+            lambda: serialization.load_template(yaml_str)),
+        ('parse JSON (cfnplus)', \
+            lambda: serialization.load_template(json_str)),
+        ('dump YAML (pure Python)', \
+            lambda: yaml.dump(template, Dumper=_PurePythonDumper)),
+        ('dump YAML (cfnplus)', \
+            lambda: serialization.dump_yaml(template)),
+        ('dump JSON (cfnplus)', \
+            lambda: serialization.dump_template(template, \
+                serialization.FORMAT_JSON)),
+        ('dump minified JSON (cfnplus)', \
+            lambda: serialization.dump_template(template, \
+                serialization.FORMAT_JSON_MINIFIED)),
+    ]
+
+    print("Template: {} resources, {:.1f} KB YAML, libyaml: {}".format(\
+        nbr_resources, len(yaml_str) / 1024.0, serialization.have_libyaml()))
+    for name, func in cases:
+        secs = min(timeit.repeat(func, number=1, repeat=nbr_runs))
+        print("{:<30} {:>8.1f} ms".format(name, secs * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Compare the speed of evaluating an 'Fn::Sub' expression with a new context
+each time (format string compiled, value not memoized) against evaluating it
+repeatedly with the same context (value memoized).
+
+Usage: python benchmark/sub_bench.py [NBR_EVALS]
+'''
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cfnplus import eval_cfn_expr # pylint: disable=wrong-import-position
+from cfnplus.utils import Context # pylint: disable=wrong-import-position
+
+def main():
+    nbr_evals = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    exp = {'Fn::Sub': 'arn:aws:s3:::${Bucket}/${Prefix}/${AWS::Region}/*'}
+    symbols = {'Bucket': 'my-bucket', 'Prefix': 'my-prefix'}
+    nbr_runs = 3
+
+    def eval_cold():
+        eval_cfn_expr._compiled_subs.clear() # pylint: disable=protected-access
+        eval_cfn_expr.eval_expr(exp, Context(symbols, aws_region='us-west-2'))
+
+    def eval_compiled():
+        eval_cfn_expr.eval_expr(exp, Context(symbols, aws_region='us-west-2'))
+
+    ctx = Context(symbols, aws_region='us-west-2')
+    def eval_memoized():
+        eval_cfn_expr.eval_expr(exp, ctx)
+
+    cases = [
+        ('new context, not compiled', eval_cold),
+        ('new context, compiled', eval_compiled),
+        ('same context (memoized)', eval_memoized),
+    ]
+
+    print("Fn::Sub: {} evaluations".format(nbr_evals))
+    for name, func in cases:
+        secs = min(timeit.repeat(func, number=nbr_evals, repeat=nbr_runs))
+        print("{:<30} {:>8.2f} us".format(name, secs * 1e6 / nbr_evals))
+
+if __name__ == '__main__':
+    main()
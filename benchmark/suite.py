@@ -0,0 +1,336 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Offline benchmarks of processing templates, packaging Lambda code, and doing
+actions, against an in-memory stand-in for S3 and CloudFormation (cf.
+fake_aws).  The workloads are generated in a temporary directory.
+
+The results are compared with those in baseline.json, and a benchmark that
+takes more than (1 + TOLERANCE) times its baseline is reported as a
+regression, in which case the exit status is 1.  Baselines depend on the
+machine, so make your own with --update-baseline before comparing.
+
+By default, actions are done against fake_aws's S3.  With --storage, they
+are done against one of CloudFormation Plus's own storage backends instead.
+
+Usage: python benchmark/suite.py [--scale S] [--only NAME] [--tolerance T]
+    [--storage fake-s3|memory|local] [--update-baseline]
+'''
+
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import cfnplus # pylint: disable=wrong-import-position
+from cfnplus import storage # pylint: disable=wrong-import-position
+import fake_aws # pylint: disable=wrong-import-position
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+    'baseline.json')
+BUCKET = 'bench-bucket'
+AWS_REGION = 'us-west-2'
+
+def _write_file(path, size, seed):
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    line = 'line {} of a generated file\n'.format(seed).encode('utf-8')
+    with io.open(path, 'wb') as f:
+        f.write((line * (size // len(line) + 1))[:size])
+
+def _make_tree(root, nbr_files, file_size, files_per_dir=100):
+    for i in range(nbr_files):
+        path = os.path.join(root, 'd{}'.format(i // files_per_dir), \
+            'f{}.py'.format(i))
+        _write_file(path, file_size, i)
+
+def _lambda_resource(name, func_dir):
+    return [
+        '  {}:'.format(name),
+        '    Type: AWS::Lambda::Function',
+        '    Properties:',
+        '      Handler: f0.go',
+        '      Runtime: python3.9',
+        '      Aruba::LambdaCode:',
+        '        LocalPath: {}'.format(func_dir),
+        "        S3Dest: {'Fn::Sub': 's3://${Bucket}/lambda'}",
+    ]
+
+def _plain_resources(nbr, prefix):
+    lines = []
+    for i in range(nbr):
+        lines += [
+            '  {}{}:'.format(prefix, i),
+            '    Type: AWS::SNS::Topic',
+            '    Properties:',
+            "      TopicName: {'Fn::Sub': '${Bucket}-" + str(i) + "'}",
+        ]
+    return lines
+
+def _process(workdir, template_str, **kwargs):
+    return cfnplus.process_template(template_str, \
+        [{'ParameterKey': 'Bucket', 'ParameterValue': BUCKET}], AWS_REGION, \
+        template_path=os.path.join(workdir, 'template.yml'), **kwargs)
+
+class Benchmark(object):
+    '''
+    A workload.  setup makes its files (not timed), and run does the work
+    (timed).
+    '''
+
+    name = None
+
+    def __init__(self, workdir, scale):
+        self.workdir = workdir
+        self.scale = scale
+
+    def n(self, nbr):
+        return max(1, int(nbr * self.scale))
+
+    def setup(self, aws):
+        pass
+
+    def run(self, aws):
+        raise NotImplementedError()
+
+class LargeTemplate(Benchmark):
+    '''
+    A template with thousands of resources, some of which are Lambda
+    functions sharing a few code directories.
+    '''
+
+    name = 'process_large_template'
+
+    def setup(self, aws):
+        nbr_dirs = 10
+        for i in range(nbr_dirs):
+            _make_tree(os.path.join(self.workdir, 'func{}'.format(i)), 20, 4096)
+        lines = ['Resources:']
+        lines += _plain_resources(self.n(3000), 'Topic')
+        for i in range(self.n(200)):
+            lines += _lambda_resource('Func{}'.format(i), \
+                'func{}'.format(i % nbr_dirs))
+        self.template_str = '\n'.join(lines)
+
+    def run(self, aws):
+        _process(self.workdir, self.template_str)
+
+class NestedStacks(Benchmark):
+    '''
+    A template with many "Aruba::Stack" resources, each with its own Lambda
+    function.  (Nested templates cannot have nested templates of their own,
+    so the tree is wide rather than deep.)
+    '''
+
+    name = 'process_nested_stacks'
+
+    def setup(self, aws):
+        lines = ['Resources:']
+        for i in range(self.n(50)):
+            func_dir = 'func{}'.format(i)
+            _make_tree(os.path.join(self.workdir, func_dir), 20, 4096)
+            nested_lines = ['Parameters:', '  Bucket: {Type: String}', \
+                'Resources:']
+            nested_lines += _lambda_resource('Func', func_dir)
+            nested_lines += _plain_resources(20, 'Topic')
+            with open(os.path.join(self.workdir, \
+                'nested{}.yml'.format(i)), 'w') as f:
+                f.write('\n'.join(nested_lines))
+            lines += [
+                '  Stack{}:'.format(i),
+                '    Type: Aruba::Stack',
+                '    Properties:',
+                '      Template:',
+                '        LocalPath: nested{}.yml'.format(i),
+                "        S3Dest: {'Fn::Sub': 's3://${Bucket}/templates'}",
+                '      Parameters:',
+                "        Bucket: {'Ref': 'Bucket'}",
+            ]
+        self.template_str = '\n'.join(lines)
+
+    def run(self, aws):
+        result = _process(self.workdir, self.template_str)
+        result.do_before_creation()
+
+class LambdaPackaging(Benchmark):
+    '''
+    Hashing, zipping, and uploading one large Lambda code directory.
+    '''
+
+    name = 'lambda_packaging'
+
+    def setup(self, aws):
+        _make_tree(os.path.join(self.workdir, 'func'), self.n(2000), 16384)
+        self.template_str = '\n'.join(['Resources:'] + \
+            _lambda_resource('Func', 'func'))
+
+    def run(self, aws):
+        with _process(self.workdir, self.template_str) as result:
+            result.do_before_creation()
+            result.do_after_creation()
+
+class S3SyncTree(Benchmark):
+    '''
+    Syncing a directory of 50k small files to S3, first when S3 is empty and
+    then when nothing has changed.
+    '''
+
+    name = 's3_sync_50k_files'
+
+    def setup(self, aws):
+        _make_tree(os.path.join(self.workdir, 'site'), self.n(50000), 256)
+        self.template_str = '\n'.join([
+            'Metadata:',
+            '  Aruba::BeforeCreation:',
+            '    - S3Sync:',
+            '        LocalDir: site',
+            "        S3Dest: {'Fn::Sub': 's3://${Bucket}/site'}",
+            'Resources:',
+        ] + _plain_resources(1, 'Topic'))
+
+    def run(self, aws):
+        for _ in range(2):
+            with _process(self.workdir, self.template_str) as result:
+                result.do_before_creation()
+                result.do_after_creation()
+
+BENCHMARKS = [LargeTemplate, NestedStacks, LambdaPackaging, S3SyncTree]
+
+def _set_storage_backend(name, workdir):
+    if name == 'memory':
+        storage.set_backend(storage.MemoryBackend())
+    elif name == 'local':
+        storage.set_backend(storage.LocalBackend(\
+            os.path.join(workdir, '.storage')))
+    else:
+        storage.set_backend(storage.S3Backend())
+
+def run_benchmarks(scale, only=None, storage_name='fake-s3'):
+    '''
+    :return: A dict mapping benchmark names to seconds.
+    '''
+
+    results = {}
+    for cls in BENCHMARKS:
+        if only is not None and cls.name != only:
+            continue
+        workdir = tempfile.mkdtemp(prefix='cfnplus-bench-')
+        try:
+            with fake_aws.installed() as aws:
+                aws.make_bucket(BUCKET)
+                _set_storage_backend(storage_name, workdir)
+                bench = cls(workdir, scale)
+                bench.setup(aws)
+
+                # silence the library's progress messages
+                stdout = sys.stdout
+                sys.stdout = open(os.devnull, 'w')
+                try:
+                    start = time.time()
+                    bench.run(aws)
+                    results[cls.name] = time.time() - start
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+        finally:
+            storage.set_backend(None)
+            shutil.rmtree(workdir)
+        print("{:<30} {:>9.3f} s".format(cls.name, results[cls.name]))
+        sys.stdout.flush()
+    return results
+
+def compare(results, baseline, tolerance):
+    '''
+    :return: A list of the names of benchmarks that regressed.
+    '''
+
+    regressions = []
+    for name, secs in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = secs / base
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print("{:<30} {:>9.3f} s vs {:>9.3f} s baseline ({:+.0f}%){}".format(\
+            name, secs, base, (ratio - 1) * 100, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="CloudFormation Plus " + \
+        "benchmarks")
+    parser.add_argument('--scale', type=float, default=1.0, \
+        help="Multiply workload sizes by this")
+    parser.add_argument('--only', help="Run only the benchmark with this name")
+    parser.add_argument('--tolerance', type=float, default=0.25, \
+        help="Allowed slowdown relative to the baseline")
+    parser.add_argument('--storage', default='fake-s3', \
+        choices=['fake-s3', 'memory', 'local'], \
+        help="Where actions put objects")
+    parser.add_argument('--update-baseline', action='store_true', \
+        help="Save the results as the new baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scale, args.only, args.storage)
+
+    baseline = {'scale': args.scale, 'results': {}}
+    if os.path.isfile(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        if baseline.get('scale') != args.scale:
+            baseline = {'scale': args.scale, 'results': {}}
+        baseline['results'].update((k, round(v, 3)) for k, v in \
+            results.items())
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("Saved baseline to {}".format(BASELINE_PATH))
+        return 0
+
+    if baseline.get('scale') != args.scale:
+        print("Baseline was made with scale {}; not comparing".format(\
+            baseline.get('scale')))
+        return 0
+    print("")
+    regressions = compare(results, baseline['results'], args.tolerance)
+    return 1 if len(regressions) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -31,35 +31,55 @@
 import os
 import collections
 import itertools
-import yaml
-import boto3
-from botocore.exceptions import ClientError
+import functools
+import importlib
+from concurrent import futures
 from .utils import InvalidTemplate, Result
-from .lambda_code_tag import delete_unused_lambda_code
+from .garbage_collection import delete_unused_lambda_code, \
+    delete_unreferenced_objects
 from . import (
     utils,
-    lambda_code_tag,
-    before_creation_tag,
-    after_creation_tag,
-    bootstrap_actions_tag,
-    stack_policy_tag,
-    stack_resource,
+    serialization,
+    proc_cache,
+    tracing,
+    metrics,
+    partial_eval,
 )
 
+class _LazyEvalFunc(object):
+    '''
+    The "evaluate" function of a module in this package.  The module is
+    imported the first time the function is called, so that the modules for
+    tags that a template does not use are never imported.
+    '''
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._func = None
+
+    def __call__(self, *args, **kwargs):
+        if self._func is None:
+            module = importlib.import_module('.' + self._module_name, \
+                __name__)
+            self._func = module.evaluate
+        return self._func(*args, **kwargs)
+
 _ARUBA_TAG_EVAL_FUNCS = {
-    'Aruba::LambdaCode': lambda_code_tag.evaluate,
-    'Aruba::BeforeCreation': before_creation_tag.evaluate,
-    'Aruba::AfterCreation': after_creation_tag.evaluate,
-    'Aruba::BootstrapActions': bootstrap_actions_tag.evaluate,
-    'Aruba::StackPolicy': stack_policy_tag.evaluate,
+    'Aruba::LambdaCode': _LazyEvalFunc('lambda_code_tag'),
+    'Aruba::BeforeCreation': _LazyEvalFunc('before_creation_tag'),
+    'Aruba::AfterCreation': _LazyEvalFunc('after_creation_tag'),
+    'Aruba::BootstrapActions': _LazyEvalFunc('bootstrap_actions_tag'),
+    'Aruba::StackPolicy': _LazyEvalFunc('stack_policy_tag'),
 }
 
 _ARUBA_RESOURCE_EVAL_FUNCS = {
-    'Aruba::Stack': stack_resource.evaluate,
+    'Aruba::Stack': _LazyEvalFunc('stack_resource'),
 }
 
 def process_template(template_str, template_params, aws_region, \
-    template_path=None, stack_name=None, template_is_imported=False):
+    template_path=None, stack_name=None, template_is_imported=False, \
+    output_format=serialization.FORMAT_YAML, cache_dir=None, max_workers=8, \
+    hash_processes=0, exports_ttl=None, partial_eval=False):
     '''
     Evaluate the "Aruba::" tags in a CloudFormation template.
 
@@ -104,8 +124,8 @@ def process_template(template_str, template_params, aws_region, \
     (non-transformed) template.  CloudFormation supports rollback of failed
     stack changes; with this library, you now can roll back S3 changes as well.
 
-    :param template_str: The CloudFormation template to process (must be in
-    YAML).
+    :param template_str: The CloudFormation template to process (in YAML or
+    JSON).
     :param template_params: A list of dicts of this form:
         {
             "ParameterKey": ...,
@@ -125,6 +145,31 @@ def process_template(template_str, template_params, aws_region, \
     variable, or if template_params contains an item with "UsePreviousValue"
     set to True, or if "Aruba::StackPolicy" is used.
     :param template_is_imported: Internal use only.
+    :param output_format: (Optional) The format of the new template and of the
+    nested templates uploaded for "Aruba::Stack" resources: "yaml" (the
+    default), "json", or "json-minified".  JSON is much faster to make, and
+    minified JSON is the smallest.
+    :param cache_dir: (Optional) A directory in which to cache results.  If
+    the same template is processed again with the same parameters, region,
+    and stack name, and none of the local files and CloudFormation exports
+    it uses has changed, the cached result is returned.  The least recently
+    used results are removed when they take more than
+    proc_cache.RESULTS_MAX_BYTES.
+    :param max_workers: (Optional) Max number of "Aruba::Stack" resources'
+    templates, and max number of resources' tags, to process concurrently.
+    Each of these limits has its own pool of threads, so up to twice this
+    many threads may be working at once (not counting hash_processes).  The
+    result does not depend on this.
+    :param hash_processes: (Optional) If positive, Lambda packages are hashed
+    in a pool of this many processes.
+    :param exports_ttl: (Optional) The CloudFormation exports of each region
+    are listed once, when the first "Fn::ImportValue" is evaluated.  If this
+    is given, the list is also kept in CloudFormation Plus's local cache, and
+    later calls reuse it for this many seconds (cf. utils.ExportIndex).
+    :param partial_eval: (Optional) If True, intrinsic functions in the new
+    template whose values are known from the parameters, region, and stack
+    name are replaced by their values, and resources and outputs whose
+    conditions are false are removed (cf. partial_eval).
 
     :return: Cf. description of this function.
 
@@ -132,10 +177,148 @@ def process_template(template_str, template_params, aws_region, \
     :throw ValueError: If there is a problem with an argument.
     '''
 
+    job = {
+        'template_str': template_str,
+        'template_params': template_params,
+        'aws_region': aws_region,
+        'template_path': template_path,
+        'stack_name': stack_name,
+        'template_is_imported': template_is_imported,
+        'partial_eval': partial_eval,
+    }
+    return process_templates([job], output_format=output_format, \
+        cache_dir=cache_dir, max_workers=max_workers, \
+        hash_processes=hash_processes, exports_ttl=exports_ttl)[0]
+
+def process_templates(jobs, output_format=serialization.FORMAT_YAML, \
+    cache_dir=None, max_workers=8, hash_processes=0, exports_ttl=None):
+    '''
+    Process several templates (e.g., the same template for several regions)
+    together.  This is like calling process_template once for each of them,
+    but the templates are processed concurrently, and work that they share
+    --- e.g., processing the same nested template with the same parameters,
+    or hashing the same Lambda function's code, or checking that the same S3
+    bucket exists when their actions are done --- is done only once.
+
+    :param jobs: A list of dicts, each containing the arguments
+    "template_str", "template_params", and "aws_region", and optionally
+    "template_path", "stack_name", and "partial_eval", as for
+    process_template.
+    :param output_format: Cf. process_template.
+    :param cache_dir: Cf. process_template.
+    :param max_workers: (Optional) The max number of templates, of
+    "Aruba::Stack" resources' templates, and of resources' tags to process
+    concurrently; these limits are shared by all the jobs.  Each limit has
+    its own pool of threads, so up to three times this many threads may be
+    working at once (not counting hash_processes).  The results do not
+    depend on this.
+    :param hash_processes: Cf. process_template.
+    :param exports_ttl: Cf. process_template.  The exports are listed only
+    once for all the jobs.
+
+    :return: A list of Result objects (cf. process_template), one for each
+    job, in the same order as the jobs.
+
+    :throw InvalidTemplate: If a template is invalid.
+    :throw ValueError: If there is a problem with an argument.
+    '''
+
+    state = _SharedState(cache_dir, max_workers, hash_processes, exports_ttl)
+    try:
+        return _process_templates(jobs, output_format, state)
+    finally:
+        state.shutdown()
+
+class _SharedState(object):
+    '''
+    The caches and executors shared by all the templates processed by a call
+    to process_templates.  A long-running worker (cf. server) keeps one of
+    these for all its calls, so that they stay warm.
+    '''
+
+    def __init__(self, cache_dir=None, max_workers=8, hash_processes=0, \
+        exports_ttl=None):
+        self.proc_cache = None
+        if cache_dir is not None:
+            self.proc_cache = proc_cache.ProcessingCache(cache_dir)
+
+        # Jobs, Aruba::Stack resources, and resources' tags get separate pools
+        # of max_workers threads each, since workers in each pool wait for
+        # work in the next one (e.g., tags in nested templates are evaluated
+        # for Aruba::Stack resources' workers), and one shared pool could
+        # deadlock
+        self.job_executor = None
+        self.executor = None
+        self.tag_executor = None
+        if max_workers > 1:
+            self.job_executor = futures.ThreadPoolExecutor(\
+                max_workers=max_workers)
+            self.executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+            self.tag_executor = futures.ThreadPoolExecutor(\
+                max_workers=max_workers)
+        self.hash_executor = None
+        if hash_processes > 0:
+            self.hash_executor = futures.ProcessPoolExecutor(\
+                max_workers=hash_processes)
+
+        # Without a TTL, exports are listed again by each call, since they
+        # may have changed since the last one
+        self.export_index = None
+        if exports_ttl is not None:
+            self.export_index = utils.ExportIndex(exports_ttl)
+
+    def apply(self, ctx):
+        ctx.proc_cache = self.proc_cache
+        if self.export_index is not None:
+            ctx.export_index = self.export_index
+        ctx.executor = self.executor
+        ctx.tag_executor = self.tag_executor
+        ctx.hash_executor = self.hash_executor
+
+    def shutdown(self):
+        for executor in [self.job_executor, self.executor, \
+            self.tag_executor, self.hash_executor]:
+            if executor is not None:
+                executor.shutdown()
+
+def _process_templates(jobs, output_format, state):
+    if output_format not in serialization.OUTPUT_FORMATS:
+        raise ValueError("Unknown output format: {}".format(output_format))
+
+    ctxs = [_make_context(job, output_format) for job in jobs]
+    if len(ctxs) == 0:
+        return []
+
+    # all contexts share caches and executors with the first one
+    shared_ctx = ctxs[0]
+    state.apply(shared_ctx)
+    for ctx in ctxs[1:]:
+        ctx.share_state(shared_ctx)
+
+    if state.job_executor is None or len(jobs) < 2:
+        results = [_process_template_with_cache(job['template_str'], ctx) \
+            for job, ctx in zip(jobs, ctxs)]
+    else:
+        futs = [state.job_executor.submit(\
+            tracing.wrap(_process_template_with_cache), job['template_str'], \
+            ctx) for job, ctx in zip(jobs, ctxs)]
+        results = [fut.result() for fut in futs]
+
+    # each bucket used by the jobs' actions is checked only once
+    bucket_checks = utils.Memo()
+    for result in results:
+        result.bucket_checks = bucket_checks
+    return results
+
+def _make_context(job, output_format):
+    template_params = job['template_params']
+    aws_region = job['aws_region']
+    stack_name = job.get('stack_name')
+
     # get old stack
     old_stack = None
     if stack_name is not None:
-        cfn = boto3.resource('cloudformation', region_name=aws_region)
+        cfn = utils.aws_resource('cloudformation', aws_region)
         old_stack = cfn.Stack(stack_name)
         try:
             old_stack.reload()
@@ -168,9 +351,45 @@ def process_template(template_str, template_params, aws_region, \
             value = param['ParameterValue']
         param_dict[key] = value
 
-    ctx = utils.Context(param_dict, aws_region, template_path, \
-        stack_name, template_is_imported, _process_template)
-    return _process_template(template_str, ctx)
+    return utils.Context(param_dict, aws_region, job.get('template_path'), \
+        stack_name, job.get('template_is_imported', False), \
+        _process_template, output_format=output_format, \
+        partial_eval=job.get('partial_eval', False))
+
+def _process_template_with_cache(template_str, ctx):
+    with metrics.active(ctx.metrics), ctx.metrics.timer('process'):
+        result = _process_template_with_cache_impl(template_str, ctx)
+    result.metrics = ctx.metrics
+    return result
+
+def _process_template_with_cache_impl(template_str, ctx):
+    if ctx.proc_cache is None:
+        return _process_template(template_str, ctx)
+
+    # look in cache
+    cache = ctx.proc_cache
+    key = cache.make_key(
+        template_str=template_str,
+        params=ctx.symbols(),
+        aws_region=ctx.aws_region,
+        template_path=None if ctx.template_path is None \
+            else os.path.abspath(ctx.template_path),
+        stack_name=ctx.stack_name,
+        template_is_imported=ctx.template_is_imported,
+        output_format=ctx.output_format,
+        partial_eval=ctx.partial_eval,
+    )
+    result = cache.get(key, ctx)
+    ctx.metrics.incr('cfnplus_cache_requests', cache='template', \
+        result='miss' if result is None else 'hit')
+    if result is not None:
+        return result
+
+    # process template, and remember what it used
+    inputs = ctx.record_inputs()
+    result = _process_template(template_str, ctx)
+    cache.put(key, inputs, result, ctx)
+    return result
 
 def _process_template(template_str, ctx):
     # We process two kinds of nodes:
@@ -180,89 +399,215 @@ def _process_template(template_str, ctx):
     #   2. Resources: objects in the "Resources" section with "Type" fields
     #      beginning with "Aruba::"
     #
-    # This is done in two passes.
+    # First we walk the template once to find all of them, and then we
+    # evaluate the tags, followed by the resources.
+
+    with tracing.span('process_template', template_path=ctx.template_path, \
+        aws_region=ctx.aws_region):
+        with tracing.span('load'):
+            template = serialization.load_template(template_str)
+            index = _TemplateIndex(template)
+
+        with tracing.span('tags'):
+            result_1 = _processs_tags(template, index, ctx)
+        with tracing.span('resources'):
+            result_2 = _processs_resources(template, index, ctx)
+
+        result_2.before_creation.extend(result_1.before_creation)
+        result_2.after_creation.extend(result_1.after_creation)
+        n_coalesced = result_2.coalesce()
+        if n_coalesced > 0:
+            ctx.metrics.incr('cfnplus_actions_coalesced', n_coalesced)
+        if ctx.partial_eval and not ctx.template_is_imported:
+            # Nested templates are not folded, since their contexts also
+            # contain the symbols of the templates that import them
+            with tracing.span('partial_eval'):
+                result_2.new_template = partial_eval.partially_evaluate(\
+                    result_2.new_template, ctx)
+        with tracing.span('dump'):
+            result_2.new_template = serialization.dump_template(\
+                result_2.new_template, ctx.output_format)
+        return result_2
+
+class _TemplateIndex(object):
+    '''
+    The locations of all the "Aruba::" tags and "Aruba::" resources in a
+    template.
 
-    template = yaml.load(template_str)
+    The template is walked once, without recursion.  Tags are recorded as
+    (parent mapping, tag name) pairs in the order in which a depth-first walk
+    would reach them.  The walk goes into both mappings and sequences, but not
+    into tags' values, and it goes into a node only once even if the node is
+    reachable along several paths (which happens with YAML anchors).
 
-    # pass 1
-    result_1 = _processs_tags(template, ctx)
+    Resources that share nodes with other resources or with the "Metadata"
+    section are recorded in shared_resources.
+    '''
 
-    # pass 2
-    result_2 = _processs_resources(result_1.new_template, ctx)
+    def __init__(self, template):
+        self.metadata_tags = []
+        self.resource_tags = collections.OrderedDict() # rsrc name -> tags
+        self.aruba_resources = [] # names
+        self.shared_resources = set([])
 
-    result_2.before_creation.extend(result_1.before_creation)
-    result_2.after_creation.extend(result_1.after_creation)
-    result_2.new_template = _yaml_dump(result_2.new_template)
-    return result_2
+        self._visited = {} # node ID -> name of resource (None for metadata)
 
-def _processs_tags(template, ctx):
+        if 'Metadata' in template:
+            self._walk(template['Metadata'], self.metadata_tags, None)
+
+        resources = template.get('Resources')
+        if not isinstance(resources, collections.Mapping):
+            return
+        for rsrc_name, rsrc_node in resources.items():
+            tags = []
+            self._walk(rsrc_node, tags, rsrc_name)
+            if len(tags) > 0:
+                self.resource_tags[rsrc_name] = tags
+            if isinstance(rsrc_node, collections.Mapping) and \
+                rsrc_node.get('Type', '') in _ARUBA_RESOURCE_EVAL_FUNCS:
+                self.aruba_resources.append(rsrc_name)
+
+    def _visit(self, node, owner):
+        # :return: True if the node has not been visited before
+        try:
+            prev_owner = self._visited[id(node)]
+        except KeyError:
+            self._visited[id(node)] = owner
+            return True
+        for name in (prev_owner, owner):
+            if name is not None:
+                self.shared_resources.add(name)
+        return False
+
+    def _walk(self, root, tags, owner):
+        # Each stack item is either (node, None) or (parent, tag name).
+        stack = [(root, None)]
+        while len(stack) > 0:
+            node, tag_name = stack.pop()
+            if tag_name is not None:
+                tags.append((node, tag_name))
+                continue
+
+            if isinstance(node, collections.Mapping):
+                if not self._visit(node, owner):
+                    continue
+                for key, value in reversed(list(node.items())):
+                    if key in _ARUBA_TAG_EVAL_FUNCS:
+                        stack.append((node, key))
+                    else:
+                        stack.append((value, None))
+            elif isinstance(node, list):
+                if not self._visit(node, owner):
+                    continue
+                stack.extend((child, None) for child in reversed(node))
+
+def _eval_tag(parent, tag_name, ctx, final_result):
+    # evaluate Aruba tag
+    eval_func = _ARUBA_TAG_EVAL_FUNCS[tag_name]
+    with tracing.span(tag_name, resource=ctx.resource_name):
+        result = eval_func(parent[tag_name], ctx)
+
+    # replace tag
+    if result.new_template is not None:
+        new_tag_name, new_tag_value = result.new_template
+        parent[new_tag_name] = new_tag_value
+    del parent[tag_name]
+
+    final_result.before_creation.extend(result.before_creation)
+    final_result.after_creation.extend(result.after_creation)
+
+def _eval_resource_tags(tags, resources, rsrc_name, ctx):
+    result = Result(resources[rsrc_name])
+    ctx.resource_node = resources[rsrc_name]
+    for parent, tag_name in tags:
+        _eval_tag(parent, tag_name, ctx, result)
+    return result
+
+def _eval_aruba_resource(resources, rsrc_name, ctx):
+    resource = resources[rsrc_name]
+    eval_func = _ARUBA_RESOURCE_EVAL_FUNCS[resource['Type']]
+    return eval_func(resource, ctx)
+
+def _eval_resource(phase, index, resources, rsrc_name, ctx, eval_func):
     '''
+    Evaluate (part of) a resource, reusing an earlier result if there is a
+    processing cache.  Resources that share nodes with other parts of the
+    template are always evaluated, since their nodes cannot be replaced
+    independently.
+
     :return: Instance of Result.
     '''
 
-    final_result = Result(template)
-
-    def eval_recursive(tag_name, tag_value, parent, curr_ctx):
-        if tag_name in _ARUBA_TAG_EVAL_FUNCS:
-            # evauluate Aruba tag
-            eval_func = _ARUBA_TAG_EVAL_FUNCS[tag_name]
-            result = eval_func(tag_value, curr_ctx)
+    with metrics.active(ctx.metrics):
+        if ctx.proc_cache is None or rsrc_name in index.shared_resources:
+            return eval_func(resources, rsrc_name, ctx)
+        return ctx.proc_cache.eval_resource(phase, resources, rsrc_name, \
+            ctx, eval_func)
 
-            # replace tag
-            if result.new_template is not None:
-                new_tag_name, new_tag_value = result.new_template
-                parent[new_tag_name] = new_tag_value
-            del parent[tag_name]
-
-            final_result.before_creation.extend(result.before_creation)
-            final_result.after_creation.extend(result.after_creation)
+def _processs_tags(template, index, ctx):
+    '''
+    :return: Instance of Result.
+    '''
 
-        elif isinstance(tag_value, collections.Mapping):
-            # we may modify the tag_value dict during iteration, so make a list of its items
-            next_items = list(tag_value.items())
-            for next_tag_name, next_tag_value in next_items:
-                # recurse
-                eval_recursive(next_tag_name, next_tag_value, tag_value, \
-                    curr_ctx)
+    final_result = Result(template)
+    resources = template.get('Resources')
 
     try:
         # process "Metadata" section
-        if 'Metadata' in template:
-            eval_recursive(None, template['Metadata'], None, ctx)
-
-        # process "Resources" section
-        if 'Resources' in template:
-            for rsrc_name, rsrc_node in template['Resources'].items():
-                new_ctx = ctx.copy()
-                new_ctx.resource_name = rsrc_name
-                new_ctx.resource_node = rsrc_node
-                eval_recursive(None, rsrc_node, None, new_ctx)
+        for parent, tag_name in index.metadata_tags:
+            _eval_tag(parent, tag_name, ctx, final_result)
+
+        # process "Resources" section --- concurrently if there is an
+        # executor, except for resources that share nodes with other parts of
+        # the template; the results are used in the order in which the
+        # resources appear
+        jobs = []
+        for rsrc_name, tags in index.resource_tags.items():
+            new_ctx = ctx.copy()
+            new_ctx.resource_name = rsrc_name
+            job = functools.partial(_eval_resource, 'tags', index, \
+                resources, rsrc_name, new_ctx, \
+                functools.partial(_eval_resource_tags, tags))
+            if ctx.tag_executor is not None and \
+                rsrc_name not in index.shared_resources:
+                job = ctx.tag_executor.submit(tracing.wrap(job)).result
+            jobs.append((rsrc_name, job))
+
+        for rsrc_name, job in jobs:
+            result = job()
+            resources[rsrc_name] = result.new_template
+            final_result.before_creation.extend(result.before_creation)
+            final_result.after_creation.extend(result.after_creation)
     except InvalidTemplate as e:
-        template_fn = os.path.basename(ctx.template_path)
+        template_fn = os.path.basename(ctx.template_path or '')
         raise InvalidTemplate('{}: {}'.format(template_fn, str(e)))
 
     return final_result
 
-def _processs_resources(template, ctx):
+def _processs_resources(template, index, ctx):
     '''
     :return: Instance of Result.
     '''
 
     final_result = Result(template)
 
-    if 'Resources' not in template:
-        return final_result
-
-    resources = template['Resources']
-    for name, resource in resources.items():
-        # evauluate Aruba resource
-        typ = resource.get('Type', '')
-        try:
-            eval_func = _ARUBA_RESOURCE_EVAL_FUNCS[typ]
-        except KeyError:
-            continue
-        result = eval_func(resource, ctx)
-
+    # evaluate Aruba resources, concurrently if there is an executor; the
+    # results are used in the order in which the resources appear.  Nested
+    # templates are processed by the executor's workers, so their resources
+    # are evaluated serially; a worker waiting for others in the same pool
+    # could wait forever.
+    resources = template.get('Resources')
+    names = index.aruba_resources
+    if ctx.executor is None or len(names) < 2 or ctx.template_is_imported:
+        results = [_eval_resource('resource', index, resources, name, \
+            ctx.copy(), _eval_aruba_resource) for name in names]
+    else:
+        futs = [ctx.executor.submit(tracing.wrap(_eval_resource), 'resource', \
+            index, resources, name, ctx.copy(), _eval_aruba_resource) \
+            for name in names]
+        results = [fut.result() for fut in futs]
+
+    for name, result in zip(names, results):
         # replace resource
         if result.new_template is None:
             del resources[name]
@@ -275,23 +620,16 @@ def _processs_resources(template, ctx):
 
     return final_result
 
-class _YamlDumper(yaml.dumper.SafeDumper):
-    def ignore_aliases(self, data): # override
-        return True
-
-def _yaml_dump(s):
-    # serialize template, and do not preseve YAML anchors (CFN does not
-    # support them)
-    return yaml.dump(s, Dumper=_YamlDumper)
-
 def delete_stack(stack_name, aws_region):
     '''
     Sometimes CloudFormation cannot delete stacks containing security groups,
     for some reason.  This function doesn't have that problem.
     '''
 
-    cf = boto3.resource('cloudformation', region_name=aws_region)
-    ec2 = boto3.resource('ec2', region_name=aws_region)
+    from botocore.exceptions import ClientError
+
+    cf = utils.aws_resource('cloudformation', aws_region)
+    ec2 = utils.aws_resource('ec2', aws_region)
 
     # CloudFormation sometimes has trouble deleting security groups.  This can
     # happen when an EMR cluster was deployed into a stack's VPC --- EMR makes
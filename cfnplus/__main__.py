@@ -0,0 +1,70 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Command-line interface.
+
+Usage: cfnplus serve [--socket PATH] [--cache-dir DIR] [--max-workers N]
+    [--hash-processes N] [--exports-ttl SECS]
+'''
+
+import argparse
+
+def main(argv=None):
+    from . import server
+
+    parser = argparse.ArgumentParser(prog='cfnplus')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', \
+        help="Run a worker that processes templates for clients")
+    serve_parser.add_argument('--socket', \
+        help="Path of the Unix socket on which to listen")
+    serve_parser.add_argument('--cache-dir', \
+        help="Directory in which to cache results")
+    serve_parser.add_argument('--max-workers', type=int, default=8, \
+        help="Max number of templates, nested templates, and resources' " \
+        "tags to process concurrently (each limit has its own pool)")
+    serve_parser.add_argument('--hash-processes', type=int, default=0, \
+        help="Number of processes in which to hash Lambda packages")
+    serve_parser.add_argument('--exports-ttl', type=float, \
+        default=server.DEFAULT_EXPORTS_TTL, \
+        help="Seconds for which to reuse the lists of CloudFormation " \
+        "exports; 0 lists them for every request (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server.serve(args.socket, args.cache_dir, args.max_workers, \
+            args.hash_processes, args.exports_ttl)
+    else:
+        parser.print_usage()
+        return 2
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
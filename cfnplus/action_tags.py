@@ -30,8 +30,7 @@ import json
 import collections
 import os
 import io
-import boto3
-from . import utils, eval_cfn_expr, s3_ops
+from . import utils, eval_cfn_expr, s3_ops, metrics, storage
 
 def _do_mkdir(arg_node, ctx):
     # eval URI
@@ -40,17 +39,18 @@ def _do_mkdir(arg_node, ctx):
     if not key.endswith('/'):
         key += '/'
 
-    def action(undoers, committers):
-        # check if bucket exists
-        if not utils.bucket_exists(bucket_name, ctx.aws_region):
-            raise utils.InvalidTemplate("S3Mkdir: No such S3 bucket: {}".\
-                format(bucket_name))
-        bucket = boto3.resource('s3', region_name=ctx.aws_region).\
-            Bucket(bucket_name)
+    return utils.Action('S3Mkdir', aws_region=ctx.aws_region, \
+        bucket_name=bucket_name, key=key)
 
-        s3_ops.make_dir(bucket, key, undoers, committers)
+@utils.action_func('S3Mkdir', describe=utils.describe_s3_action)
+def _mkdir(undoers, committers, aws_region, bucket_name, key):
+    # check if bucket exists
+    bucket = storage.get_storage(bucket_name, aws_region)
+    if not bucket.exists():
+        raise utils.InvalidTemplate("S3Mkdir: No such S3 bucket: {}".\
+            format(bucket_name))
 
-    return action
+    s3_ops.make_dir(bucket, key, undoers, committers)
 
 def _do_sync(arg_node, ctx):
     # get args
@@ -71,49 +71,57 @@ def _do_sync(arg_node, ctx):
     if not dir_key.endswith('/'):
         dir_key += '/'
 
-    def action(undoers, committers):
-        # check if bucket exists
-        if not utils.bucket_exists(bucket_name, ctx.aws_region):
-            raise utils.InvalidTemplate("S3Sync: No such S3 bucket: {}".\
-                format(bucket_name))
-
-        # make abs path to local dir
-        abs_local_path = ctx.abspath(local_dir)
-        if not os.path.isdir(abs_local_path):
-            raise utils.InvalidTemplate("S3Sync: {} is not a directory".\
-                format(abs_local_path))
-
-        print("Syncing {} with s3://{}/{}".\
-            format(abs_local_path, bucket_name, dir_key))
-
-        # list existing files in S3
-        bucket = boto3.resource('s3', region_name=ctx.aws_region).\
-            Bucket(bucket_name)
-        s3_files = [os.path.relpath(obj.key, start=dir_key) for \
-            obj in bucket.objects.filter(Prefix=dir_key)]
-
-        # list local files
-        local_files = set([])
-        for dirpath, _, filenames in os.walk(abs_local_path):
-            for fn in filenames:
-                local_path = os.path.join(dirpath, fn)
-                relpath = os.path.relpath(local_path, start=abs_local_path)
-                local_files.add(relpath)
-
-        # delete unneeded S3 files
-        files_to_delete = [f for f in s3_files if f not in local_files]
-        for f in files_to_delete:
-            key = dir_key + f
-            s3_ops.delete_object(bucket, key, undoers, committers)
-
-        # upload local files
-        for fn in local_files:
-            local_path = os.path.join(abs_local_path, fn)
-            key = dir_key + fn
-            with io.open(local_path, 'rb') as f:
-                s3_ops.upload_file(f, bucket, key, undoers, committers)
-
-    return action
+    return utils.Action('S3Sync', aws_region=ctx.aws_region, \
+        abs_local_path=ctx.abspath(local_dir), bucket_name=bucket_name, \
+        dir_key=dir_key)
+
+def _describe_sync(aws_region, bucket_name, dir_key, **_):
+    # the objects in the directory are replaced by the local files
+    return utils.describe_s3_action(aws_region, bucket_name, dir_key, \
+        prefix=True)
+
+@utils.action_func('S3Sync', describe=_describe_sync)
+def _sync(undoers, committers, aws_region, abs_local_path, bucket_name, \
+    dir_key):
+    # check if bucket exists
+    bucket = storage.get_storage(bucket_name, aws_region)
+    if not bucket.exists():
+        raise utils.InvalidTemplate("S3Sync: No such S3 bucket: {}".\
+            format(bucket_name))
+
+    # check local dir
+    if not os.path.isdir(abs_local_path):
+        raise utils.InvalidTemplate("S3Sync: {} is not a directory".\
+            format(abs_local_path))
+
+    print("Syncing {} with s3://{}/{}".\
+        format(abs_local_path, bucket_name, dir_key))
+
+    # list existing files in S3
+    s3_files = [os.path.relpath(key, start=dir_key) for \
+        key in bucket.list(dir_key)]
+
+    # list local files
+    local_files = set([])
+    for dirpath, _, filenames in os.walk(abs_local_path):
+        for fn in filenames:
+            local_path = os.path.join(dirpath, fn)
+            relpath = os.path.relpath(local_path, start=abs_local_path)
+            local_files.add(relpath)
+    metrics.incr('cfnplus_sync_files', len(local_files))
+
+    # delete unneeded S3 files
+    files_to_delete = [f for f in s3_files if f not in local_files]
+    for f in files_to_delete:
+        key = dir_key + f
+        s3_ops.delete_object(bucket, key, undoers, committers)
+
+    # upload local files
+    for fn in local_files:
+        local_path = os.path.join(abs_local_path, fn)
+        key = dir_key + fn
+        with io.open(local_path, 'rb') as f:
+            s3_ops.upload_file(f, bucket, key, undoers, committers)
 
 def _do_upload(arg_node, ctx):
     # get args
@@ -134,19 +142,21 @@ def _do_upload(arg_node, ctx):
     if key.endswith('/'):
         raise utils.InvalidTemplate("S3Upload: Key must not end with '/'")
 
-    def action(undoers, committers):
-        # check if bucket exists
-        if not utils.bucket_exists(bucket_name, ctx.aws_region):
-            raise utils.InvalidTemplate("S3Upload: No such S3 bucket: {}".\
-                format(bucket_name))
-        bucket = boto3.resource('s3', region_name=ctx.aws_region).\
-            Bucket(bucket_name)
-
-        # upload
-        with io.open(ctx.abspath(local_file), 'rb') as f:
-            s3_ops.upload_file(f, bucket, key, undoers, committers)
-
-    return action
+    return utils.Action('S3Upload', aws_region=ctx.aws_region, \
+        abs_local_path=ctx.abspath(local_file), bucket_name=bucket_name, \
+        key=key)
+
+@utils.action_func('S3Upload', describe=utils.describe_s3_action)
+def _upload(undoers, committers, aws_region, abs_local_path, bucket_name, key):
+    # check if bucket exists
+    bucket = storage.get_storage(bucket_name, aws_region)
+    if not bucket.exists():
+        raise utils.InvalidTemplate("S3Upload: No such S3 bucket: {}".\
+            format(bucket_name))
+
+    # upload
+    with io.open(abs_local_path, 'rb') as f:
+        s3_ops.upload_file(f, bucket, key, undoers, committers)
 
 _ACTION_HANDLERS = {
     'S3Mkdir': _do_mkdir,
@@ -0,0 +1,236 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Accounting of the AWS API calls made by this library: for each operation,
+the number of calls, errors, retries, and throttled attempts, and a latency
+histogram.
+
+Accounting is off unless an ApiStats object is active.  While one is active
+(in a "with" statement), calls made by clients made by utils.aws_client and
+utils.aws_resource are recorded in it, whichever thread makes them --- e.g.:
+
+    with cfnplus.api_stats.ApiStats() as stats:
+        with cfnplus.process_template(...) as result:
+            ...
+
+When the "with" statement ends, a summary table is printed.
+'''
+
+import time
+import threading
+
+# upper bounds (in seconds) of the latency histogram's buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, \
+    10.0, float('inf'))
+
+_THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'SlowDown',
+    'ProvisionedThroughputExceededException',
+])
+
+_CONTEXT_START_KEY = 'cfnplus_start'
+_CONTEXT_MODEL_KEY = 'cfnplus_model'
+_CONTEXT_ATTEMPTS_KEY = 'cfnplus_attempts'
+
+_lock = threading.Lock()
+_active = []
+
+class OperationStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.latency_counts = [0] * len(LATENCY_BUCKETS)
+
+    def _add_call(self, latency, error, retries):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.retries += retries
+        self.total_time += latency
+        self.max_time = max(self.max_time, latency)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_counts[i] += 1
+                break
+
+    def percentile(self, q):
+        '''
+        :return: An upper bound of the q-th quantile (0 < q <= 1) of the
+        latency, from the histogram.
+        '''
+
+        if self.calls == 0:
+            return 0.0
+        count = 0
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            count += self.latency_counts[i]
+            if count >= q * self.calls:
+                return min(bound, self.max_time)
+        return self.max_time
+
+class ApiStats(object):
+    def __init__(self, print_summary=True):
+        self.print_summary = print_summary
+        self._lock = threading.Lock()
+        self._ops = {} # (service, operation) -> OperationStats
+
+    def __enter__(self):
+        with _lock:
+            _active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with _lock:
+            _active.remove(self)
+        if self.print_summary:
+            print(self.summary())
+
+    def _op_stats(self, model):
+        key = (model.service_model.service_name, model.name)
+        try:
+            return self._ops[key]
+        except KeyError:
+            return self._ops.setdefault(key, OperationStats())
+
+    def _record_call(self, model, latency, error, retries):
+        with self._lock:
+            self._op_stats(model)._add_call(latency, error, retries) # pylint: disable=protected-access
+
+    def _record_throttle(self, model):
+        with self._lock:
+            self._op_stats(model).throttles += 1
+
+    def operations(self):
+        '''
+        :return: A list of ((service, operation), OperationStats) pairs,
+        sorted by total time, longest first.
+        '''
+
+        with self._lock:
+            items = list(self._ops.items())
+        items.sort(key=lambda item: (-item[1].total_time, item[0]))
+        return items
+
+    def summary(self):
+        '''
+        :return: A table of the statistics of each operation, as a string.
+        '''
+
+        header = ('Operation', 'Calls', 'Errors', 'Retries', 'Throttles', \
+            'Total s', 'Mean ms', 'p50 ms', 'p90 ms', 'Max ms')
+        rows = []
+        for (service, op), stats in self.operations():
+            rows.append((
+                '{}.{}'.format(service, op),
+                str(stats.calls),
+                str(stats.errors),
+                str(stats.retries),
+                str(stats.throttles),
+                '{:.2f}'.format(stats.total_time),
+                '{:.1f}'.format(stats.total_time / stats.calls * 1000),
+                '{:.1f}'.format(stats.percentile(0.5) * 1000),
+                '{:.1f}'.format(stats.percentile(0.9) * 1000),
+                '{:.1f}'.format(stats.max_time * 1000),
+            ))
+
+        widths = [max(len(row[i]) for row in [header] + rows) \
+            for i in range(len(header))]
+        def fmt(row):
+            cells = [row[0].ljust(widths[0])]
+            cells += [c.rjust(w) for c, w in zip(row[1:], widths[1:])]
+            return '  '.join(cells)
+
+        lines = [fmt(header), '  '.join('-' * w for w in widths)]
+        lines += [fmt(row) for row in rows]
+        return '\n'.join(lines)
+
+def _active_stats():
+    with _lock:
+        return list(_active)
+
+def instrument_client(client):
+    '''
+    Record the API calls made by the given botocore client in the active
+    ApiStats objects.
+    '''
+
+    events = client.meta.events
+    events.register('before-parameter-build', _on_before_parameter_build)
+    events.register('needs-retry', _on_needs_retry)
+    events.register('after-call', _on_after_call)
+    events.register('after-call-error', _on_after_call_error)
+
+def _on_before_parameter_build(model, context, **kwargs):
+    if len(_active) > 0 and context is not None:
+        context[_CONTEXT_START_KEY] = time.time()
+        context[_CONTEXT_MODEL_KEY] = model
+
+def _on_needs_retry(operation, attempts, request_dict, response=None, \
+    caught_exception=None, **kwargs):
+    if len(_active) == 0:
+        return
+    context = request_dict.get('context', {})
+    context[_CONTEXT_ATTEMPTS_KEY] = attempts
+
+    error_code = None
+    if response is not None:
+        error_code = response[1].get('Error', {}).get('Code')
+    elif caught_exception is not None:
+        error_code = getattr(caught_exception, 'response', {}).\
+            get('Error', {}).get('Code')
+    if error_code in _THROTTLING_ERROR_CODES:
+        for stats in _active_stats():
+            stats._record_throttle(operation) # pylint: disable=protected-access
+
+def _finish_call(context, error):
+    if context is None or _CONTEXT_START_KEY not in context:
+        return
+    latency = time.time() - context.pop(_CONTEXT_START_KEY)
+    model = context.pop(_CONTEXT_MODEL_KEY)
+    retries = max(context.pop(_CONTEXT_ATTEMPTS_KEY, 1) - 1, 0)
+    for stats in _active_stats():
+        stats._record_call(model, latency, error, retries) # pylint: disable=protected-access
+
+def _on_after_call(http_response, context, **kwargs):
+    _finish_call(context, http_response.status_code >= 300)
+
+def _on_after_call_error(context, **kwargs):
+    _finish_call(context, True)
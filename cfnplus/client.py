@@ -0,0 +1,205 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+A client of a CloudFormation Plus worker (cf. server).
+
+A client does the same things as process_template and process_templates,
+but the templates are processed, and the actions done, by the worker, whose
+caches are already warm --- e.g.:
+
+    with cfnplus.client.Client() as client:
+        with client.process_template(...) as result:
+            result.do_before_creation()
+            ...
+            result.do_after_creation()
+'''
+
+import os
+import json
+import socket
+import threading
+from . import serialization
+from .utils import InvalidTemplate
+
+class WorkerError(Exception):
+    '''
+    An error in a worker (other than an invalid template or argument).
+    '''
+
+    pass
+
+class RemoteResult(object):
+    '''
+    The result of processing a template in a worker.  It is used like an
+    instance of utils.Result; the actions are done by the worker.
+
+    before_creation and after_creation are lists of descriptions of the
+    actions (cf. utils.Action.describe), rather than the actions themselves.
+    '''
+
+    def __init__(self, client, desc):
+        self._client = client
+        self.id = desc['id']
+        self.new_template = desc['new_template']
+        self.before_creation = desc['before_creation']
+        self.after_creation = desc['after_creation']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._client.request('finish', id=self.id, \
+                success=exc_type is None)
+        except:
+            pass
+
+    def do_before_creation(self):
+        self._client.request('do_before_creation', id=self.id)
+
+    def do_after_creation(self):
+        self._client.request('do_after_creation', id=self.id)
+
+class Client(object):
+    '''
+    A connection to a worker.  Requests made by several threads at once are
+    done one at a time.
+    '''
+
+    def __init__(self, socket_path=None):
+        '''
+        :param socket_path: (Optional) The path of the worker's Unix socket
+        (cf. server.default_socket_path).
+        '''
+
+        if socket_path is None:
+            # imported here so that the client does not need the server's
+            # dependencies
+            from .server import default_socket_path
+            socket_path = default_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def request(self, op, **args):
+        '''
+        Send a request to the worker, and wait for the response.
+
+        :return: The response.
+        :throw InvalidTemplate: If the worker says a template is invalid.
+        :throw ValueError: If the worker says there is a problem with an
+        argument.
+        :throw WorkerError: If the worker has some other problem.
+        '''
+
+        request = dict(args)
+        request['op'] = op
+        with self._lock:
+            self._file.write((json.dumps(request) + '\n').encode('utf-8'))
+            self._file.flush()
+            line = self._file.readline()
+        if len(line) == 0:
+            raise WorkerError("Worker closed the connection")
+        response = json.loads(line.decode('utf-8'))
+
+        if not response['ok']:
+            error = response['error']
+            if error['type'] == 'InvalidTemplate':
+                raise InvalidTemplate(error['message'])
+            elif error['type'] == 'ValueError':
+                raise ValueError(error['message'])
+            raise WorkerError("{}: {}".format(error['type'], \
+                error['message']))
+        return response
+
+    def ping(self):
+        '''
+        :return: A dict with the worker's "pid", "uptime" (in seconds), and
+        number of "requests".
+        '''
+
+        response = self.request('ping')
+        del response['ok']
+        return response
+
+    def process_template(self, template_str, template_params, aws_region, \
+        template_path=None, stack_name=None, \
+        output_format=serialization.FORMAT_YAML, partial_eval=False):
+        '''
+        Like process_template, but done by the worker.
+
+        :return: An instance of RemoteResult.
+        '''
+
+        job = {
+            'template_str': template_str,
+            'template_params': template_params,
+            'aws_region': aws_region,
+            'template_path': template_path,
+            'stack_name': stack_name,
+            'partial_eval': partial_eval,
+        }
+        return self.process_templates([job], output_format)[0]
+
+    def process_templates(self, jobs, \
+        output_format=serialization.FORMAT_YAML):
+        '''
+        Like process_templates, but done by the worker.
+
+        :return: A list of instances of RemoteResult.
+        '''
+
+        # the worker's working directory may not be ours
+        jobs = [dict(job) for job in jobs]
+        for job in jobs:
+            if job.get('template_path') is not None:
+                job['template_path'] = os.path.abspath(job['template_path'])
+
+        response = self.request('process', jobs=jobs, \
+            output_format=output_format)
+        return [RemoteResult(self, desc) for desc in response['results']]
+
+    def shutdown(self):
+        '''
+        Tell the worker to exit.
+        '''
+
+        self.request('shutdown')
@@ -31,12 +31,22 @@ import collections
 import numbers
 from . import utils
 
+_SUB_VAR_REGEX = re.compile(r'\$\{([-.:_0-9a-zA-Z]*)\}')
+
+# format string -> list of its parts (cf. _compile_sub)
+_compiled_subs = {}
+_MAX_COMPILED_SUBS = 10000
+
 def eval_expr(node, ctx):
     '''
     Evaluate CloudFormation template nodes like "{Ref: SomeItem}",
     "{'Fn::Sub': AnotherItem.SomeAttr}", and "{'Fn::ImportVaue': AnExportName}"
     that represent scalar values.
 
+    The values of expressions that depend only on the symbols they reference
+    (i.e., that do not contain "Fn::ImportValue") are remembered in the
+    context (cf. utils.Context.expr_memo).
+
     :param node: A node from a parsed CloudFormation template that represents
     a scalar value.
     :param ctx: An instance of utils.Context.  It will be used to resolve
@@ -54,18 +64,59 @@ def eval_expr(node, ctx):
         raise utils.InvalidTemplate("Invalid scalar expression: {}".\
             format(node_str))
 
-    handlers = {
-        'Fn::Sub': _eval_cfn_sub,
-        'Fn::ImportValue': _eval_cfn_importvalue,
-        'Ref': _eval_cfn_ref,
-    }
-
     func_name, func_arg = utils.dict_only_item(node)
     try:
-        h = handlers[func_name]
+        h = _HANDLERS[func_name]
     except KeyError:
         raise utils.InvalidTemplate("Unknown function: {}".format(func_name))
-    return h(func_arg, ctx)
+
+    # Refs are just lookups, so there's no point remembering them
+    if func_name != 'Fn::Sub':
+        return h(func_arg, ctx)
+    key = _pure_expr_key(func_arg)
+    if key is None:
+        return h(func_arg, ctx)
+    # built-in vars are not symbols, so they are part of the key
+    key = (ctx.aws_region, ctx.stack_name, key)
+    memo = ctx.expr_memo
+    try:
+        return memo[key]
+    except KeyError:
+        pass
+    value = h(func_arg, ctx)
+    memo[key] = value
+    return value
+
+def _pure_expr_key(node):
+    '''
+    :return: A hashable key for the given node if its value depends only on
+    the symbols and built-in vars it references, or else None.
+    '''
+
+    if isinstance(node, utils.base_str):
+        return node
+    elif isinstance(node, numbers.Number):
+        return ('#', node)
+    elif isinstance(node, collections.Mapping):
+        if 'Fn::ImportValue' in node:
+            return None
+        items = []
+        for k in sorted(node):
+            v = _pure_expr_key(node[k])
+            if v is None:
+                return None
+            items.append((k, v))
+        return ('{', tuple(items))
+    elif isinstance(node, list):
+        items = []
+        for child in node:
+            v = _pure_expr_key(child)
+            if v is None:
+                return None
+            items.append(v)
+        return ('[', tuple(items))
+    else:
+        return None
 
 def _eval_cfn_ref(node, ctx):
     '''
@@ -126,32 +177,45 @@ def _eval_cfn_sub(node, ctx):
         raise ex
 
     # eval local symbols
-    new_ctx = ctx.copy()
+    local_values = {}
     for k, v in local_symbols.items():
-        new_ctx.set_var(k, eval_expr(v, ctx))
+        local_values[k] = eval_expr(v, ctx)
 
     # make substitutions in format string
-    regex = re.compile(r'\$\{([-.:_0-9a-zA-Z]*)\}')
-    pos = 0
-    result_buff = utils.StringIO()
-    while True:
-        # look for variable ref
-        match = regex.search(format_str, pos=pos)
-        if match is None:
-            break
-
-        # resolve variable
-        var_name = match.group(1)
+    parts = _compile_sub(format_str)
+    result = list(parts)
+    for i in range(1, len(parts), 2):
+        var_name = parts[i]
         try:
-            var_value = new_ctx.resolve_var(var_name)
+            var_value = local_values[var_name]
         except KeyError:
-            raise utils.InvalidTemplate("Cannot resolve variable \"{}\"".\
-                format(var_name))
-
-        # write variable's value to result
-        result_buff.write(format_str[pos:match.start()])
-        result_buff.write(str(var_value))
-        pos = match.end()
+            try:
+                var_value = ctx.resolve_var(var_name)
+            except KeyError:
+                raise utils.InvalidTemplate("Cannot resolve variable " \
+                    "\"{}\"".format(var_name))
+        result[i] = str(var_value)
+    return ''.join(result)
+
+def _compile_sub(format_str):
+    '''
+    :return: A list of the parts of the given 'Fn::Sub' format string, in
+    which the items with even indices are literal text and the items with odd
+    indices are the names of the variables between them.
+    '''
 
-    result_buff.write(format_str[pos:])
-    return result_buff.getvalue()
+    try:
+        return _compiled_subs[format_str]
+    except KeyError:
+        pass
+    parts = _SUB_VAR_REGEX.split(format_str)
+    if len(_compiled_subs) >= _MAX_COMPILED_SUBS:
+        _compiled_subs.clear()
+    _compiled_subs[format_str] = parts
+    return parts
+
+_HANDLERS = {
+    'Fn::Sub': _eval_cfn_sub,
+    'Fn::ImportValue': _eval_cfn_importvalue,
+    'Ref': _eval_cfn_ref,
+}
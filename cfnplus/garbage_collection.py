@@ -0,0 +1,312 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+import json
+import collections
+import datetime
+from concurrent import futures
+from . import utils, serialization
+
+# DeleteObjects accepts at most this many keys per request
+_MAX_KEYS_PER_DELETE = 1000
+
+class UnresolvedReference(Exception):
+    '''
+    Raised when a template refers to an S3 object in a way that cannot be
+    resolved (e.g., with an intrinsic function).  Since it is then unknown
+    whether the object is used, nothing is deleted.
+    '''
+
+    pass
+
+class DeletionFailed(Exception):
+    '''
+    Raised when S3 fails to delete an object version.
+    '''
+
+    pass
+
+def _parse_template_body(body):
+    # boto3 gives JSON templates to us already parsed
+    if isinstance(body, collections.Mapping):
+        return body
+    return serialization.load_template(body)
+
+def _fetch_templates(stack_names, aws_region, max_workers):
+    '''
+    Get the templates of the given stacks and of all their nested stacks
+    (i.e., the templates referenced by "TemplateURL" in
+    "AWS::CloudFormation::Stack" resources).  Templates are fetched
+    concurrently.
+
+    :return: Generator of parsed templates.
+    '''
+
+    cf = utils.aws_client('cloudformation', aws_region)
+    s3 = utils.aws_client('s3', aws_region)
+
+    def get_stack_template(stack_name):
+        resp = cf.get_template(StackName=stack_name, TemplateStage='Original')
+        return _parse_template_body(resp['TemplateBody'])
+
+    def get_s3_template(bucket, key):
+        resp = s3.get_object(Bucket=bucket, Key=key)
+        return _parse_template_body(resp['Body'].read().decode('utf-8'))
+
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set(executor.submit(get_stack_template, n) \
+            for n in stack_names)
+        seen_urls = set([])
+        while len(pending) > 0:
+            done, pending = futures.wait(pending, \
+                return_when=futures.FIRST_COMPLETED)
+            for fut in done:
+                template = fut.result()
+                if not isinstance(template, collections.Mapping):
+                    raise UnresolvedReference("Invalid template: {}".\
+                        format(json.dumps(template)))
+                yield template
+
+                # look for nested stacks
+                for url in _template_urls(template):
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
+                    bucket, key = _parse_template_url(url)
+                    pending.add(executor.submit(get_s3_template, bucket, key))
+
+def _is_intrinsic(key):
+    return key == 'Ref' or key.startswith('Fn::')
+
+def _resources(template):
+    rsrcs = template.get('Resources', {})
+    if not isinstance(rsrcs, collections.Mapping):
+        raise UnresolvedReference("Invalid Resources section: {}".\
+            format(json.dumps(rsrcs)))
+    for name, rsrc in rsrcs.items():
+        if not isinstance(rsrc, collections.Mapping):
+            raise UnresolvedReference("Invalid resource {}: {}".\
+                format(name, json.dumps(rsrc)))
+        yield rsrc.get('Type'), rsrc.get('Properties', {})
+
+def _template_urls(template):
+    '''
+    :return: Generator of URLs of nested stacks' templates
+    '''
+
+    for typ, props in _resources(template):
+        if typ != 'AWS::CloudFormation::Stack':
+            continue
+        url = props.get('TemplateURL') \
+            if isinstance(props, collections.Mapping) else None
+        if not isinstance(url, utils.base_str):
+            raise UnresolvedReference("Cannot resolve nested stack's " \
+                "template: {}".format(json.dumps(props)))
+        yield url
+
+def _parse_template_url(url):
+    '''
+    :return: (bucket, key)
+    '''
+
+    try:
+        return utils.parse_s3_url(url)
+    except utils.InvalidTemplate:
+        raise UnresolvedReference("Cannot resolve nested stack's " \
+            "template URL: {}".format(url))
+
+def _lambda_code_objects(template):
+    '''
+    :return: Generator of pairs (bucket, key) of Lambda function packages
+    and Lambda layer packages
+    '''
+
+    code_props = {
+        'AWS::Lambda::Function': 'Code',
+        'AWS::Lambda::LayerVersion': 'Content',
+    }
+    for typ, props in _resources(template):
+        if typ not in code_props:
+            continue
+        if not isinstance(props, collections.Mapping):
+            raise UnresolvedReference("Cannot resolve properties of {}: {}".\
+                format(typ, json.dumps(props)))
+        code_node = props.get(code_props[typ], {})
+        ex = UnresolvedReference("Cannot resolve code of {}: {}".\
+            format(typ, json.dumps(code_node)))
+        if not isinstance(code_node, collections.Mapping) or \
+            any(_is_intrinsic(k) for k in code_node):
+            raise ex
+        if 'S3Bucket' not in code_node and 'S3Key' not in code_node:
+            # inline code or container image
+            continue
+        bucket = code_node.get('S3Bucket')
+        key = code_node.get('S3Key')
+        if not isinstance(bucket, utils.base_str) or \
+            not isinstance(key, utils.base_str):
+            raise ex
+        yield bucket, key
+
+def find_referenced_objects(stack_names, aws_region, max_workers=8):
+    '''
+    Find the S3 objects that are used by the given stacks or by their nested
+    stacks: Lambda packages and nested stacks' templates.
+
+    :param max_workers: Max number of templates to fetch concurrently.
+
+    :return: A set of (bucket, key) pairs.
+
+    :throw UnresolvedReference: If a template refers to an object in a way
+    that cannot be resolved, so the result would be incomplete.
+    '''
+
+    refed = set([])
+    for template in _fetch_templates(stack_names, aws_region, max_workers):
+        refed.update(_lambda_code_objects(template))
+        refed.update(_parse_template_url(url) \
+            for url in _template_urls(template))
+    return refed
+
+def _delete_versions(bucket_name, versions, aws_region):
+    '''
+    Delete object versions with as few requests as possible.
+
+    :param versions: A list of (key, version ID) pairs.
+    '''
+
+    s3 = utils.aws_client('s3', aws_region)
+    for i in range(0, len(versions), _MAX_KEYS_PER_DELETE):
+        batch = versions[i:i + _MAX_KEYS_PER_DELETE]
+        resp = s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={
+                'Objects': [{'Key': k, 'VersionId': v} for k, v in batch],
+                'Quiet': True,
+            },
+        )
+        errors = resp.get('Errors', [])
+        if len(errors) > 0:
+            raise DeletionFailed("Failed to delete s3://{}/{}: {}".format(\
+                bucket_name, errors[0]['Key'], errors[0]['Message']))
+
+def _purge(refed_keys, bucket_name, prefixes, aws_region, retain_days, \
+    dry_run, what):
+    '''
+    Delete all versions of objects under the given prefixes that are not in
+    refed_keys and that are older than retain_days.
+
+    :return: A list of (key, version ID) pairs that were deleted (or would
+    have been, if dry_run is True).
+    '''
+
+    from dateutil.tz import tzutc
+
+    cutoff = datetime.datetime.now(tzutc()) - \
+        datetime.timedelta(days=retain_days)
+
+    # list versions of unreferenced objects
+    s3 = utils.aws_client('s3', aws_region)
+    paginator = s3.get_paginator('list_object_versions')
+    unused = []
+    for prefix in prefixes:
+        if not prefix.endswith('/'):
+            prefix += '/'
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for v in page.get('Versions', []) + page.get('DeleteMarkers', []):
+                if v['Key'] in refed_keys:
+                    continue
+                if retain_days > 0 and v['LastModified'] > cutoff:
+                    continue
+                unused.append((v['Key'], v['VersionId']))
+
+    # delete them
+    verb = "Would delete" if dry_run else "Deleting"
+    for key in sorted(set(k for k, _ in unused)):
+        print("{} unused {} s3://{}/{}".format(verb, what, bucket_name, key))
+    if not dry_run:
+        _delete_versions(bucket_name, unused, aws_region)
+    return unused
+
+def delete_unreferenced_objects(stack_names, bucket_name, prefixes, \
+    aws_region, retain_days=1, max_workers=8, dry_run=False):
+    '''
+    Delete objects under the given prefixes that are not used by any of the
+    given stacks or their nested stacks.  This is meant for prefixes to which
+    this library uploads content-addressed objects --- i.e., the "S3Dest"
+    directories of "Aruba::Stack" resources and "Aruba::LambdaCode" tags.
+    All versions of these objects are deleted.
+
+    :param prefixes: A list of key prefixes (i.e., directories) in the bucket.
+    :param retain_days: Objects modified less than this many days ago are kept,
+    so that objects uploaded by a deploy that has not yet finished are not
+    deleted.
+    :param max_workers: Max number of templates to fetch concurrently.
+    :param dry_run: If True, nothing is deleted.
+
+    :return: A list of (key, version ID) pairs that were deleted (or would
+    have been, if dry_run is True).
+
+    :throw UnresolvedReference: If a template refers to an object in a way
+    that cannot be resolved; nothing is deleted.
+    :throw DeletionFailed: If S3 fails to delete an object version.
+    '''
+
+    refed = find_referenced_objects(stack_names, aws_region, max_workers)
+    refed_keys = set(k for b, k in refed if b == bucket_name)
+    return _purge(refed_keys, bucket_name, prefixes, aws_region, retain_days, \
+        dry_run, 'object')
+
+def delete_unused_lambda_code(stack_names, bucket_name, s3_code_prefix, \
+    aws_region, max_workers=8, dry_run=False):
+    '''
+    Delete Lambda packages in S3 that are not used by any of the given stacks
+    or their nested stacks.  All versions of these packages are deleted.
+
+    :param max_workers: Max number of templates to fetch concurrently.
+    :param dry_run: If True, nothing is deleted.
+
+    :return: A list of (key, version ID) pairs that were deleted (or would
+    have been, if dry_run is True).
+
+    :throw UnresolvedReference: If a template refers to a Lambda package in a
+    way that cannot be resolved; nothing is deleted.
+    :throw DeletionFailed: If S3 fails to delete an object version.
+    '''
+
+    # In order to support rollbacks, we need to keep Lambda functions' source
+    # in S3 (even though it isn't actually used when the functions run).
+    # Eventually function code gets replaced with new verions, so we need to
+    # delete old code that's no longer referenced by a stack.
+
+    refed_keys = set([])
+    for template in _fetch_templates(stack_names, aws_region, max_workers):
+        refed_keys.update(k for b, k in _lambda_code_objects(template) \
+            if b == bucket_name)
+    return _purge(refed_keys, bucket_name, [s3_code_prefix], aws_region, 0, \
+        dry_run, 'Lambda code')
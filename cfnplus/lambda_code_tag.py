@@ -34,9 +34,11 @@ import json
 import tempfile
 import struct
 import io
-import yaml
-import boto3
-from . import eval_cfn_expr, utils, s3_ops
+import re
+import sys
+import shutil
+import subprocess
+from . import eval_cfn_expr, utils, s3_ops, tracing, storage
 
 class _LambdaPkgMaker(object):
     '''
@@ -55,15 +57,56 @@ class _LambdaPkgMaker(object):
     #
     # with one record for each file in the zipfile.
 
-    def __init__(self):
-        self._entries = {} # package path -> abs path
+    #
+    # Dependencies installed from a requirements file are not hashed file by
+    # file.  They live in a cache directory whose name is already a hash of
+    # everything that determines its contents (cf. _install_requirements), so
+    # we add one record with that name instead.
+
+    def __init__(self, entries=None, deps_dir=None, deps_key=None):
+        self._entries = {} if entries is None else entries # package path -> abs path
+        self._deps_dir = deps_dir
+        self._deps_key = deps_key
 
     def add(self, local_path, pkg_path):
         self._entries[pkg_path] = local_path
 
+    def add_dependencies(self, deps_dir, deps_key):
+        self._deps_dir = deps_dir
+        self._deps_key = deps_key
+
+    def to_dict(self):
+        return {
+            'entries': self._entries,
+            'deps_dir': self._deps_dir,
+            'deps_key': self._deps_key,
+        }
+
+    def _all_entries(self):
+        entries = {}
+        if self._deps_dir is not None:
+            # the package's hash does not cover the installed files, so a
+            # missing directory must not yield a package without them
+            if not os.path.isdir(self._deps_dir):
+                raise utils.InvalidTemplate("Aruba::LambdaCode: installed " + \
+                    "requirements are missing: {}".format(self._deps_dir))
+            for parent, _, filenames in os.walk(self._deps_dir):
+                for fn in filenames:
+                    local_path = os.path.join(parent, fn)
+                    pkg_path = os.path.relpath(local_path, start=self._deps_dir)
+                    entries[pkg_path] = local_path
+
+        # the function's own files win over dependencies
+        entries.update(self._entries)
+        return entries
+
     @property
     def hash(self):
         h = hashlib.new(utils.FILE_HASH_ALG)
+        if self._deps_key is not None:
+            deps_key_encoded = self._deps_key.encode('utf-8')
+            h.update(struct.pack('>Q', len(deps_key_encoded)))
+            h.update(deps_key_encoded)
         for pkg_path, local_path in self._entries.items():
             pkg_path_encoded = pkg_path.encode('utf-8')
             h.update(struct.pack('>Q', len(pkg_path_encoded))) # path_in_zipfile_len
@@ -83,7 +126,7 @@ class _LambdaPkgMaker(object):
         f = tempfile.TemporaryFile() # will be deleted when closed
         try:
             with zipfile.ZipFile(f, 'w') as z:
-                for pkg_path, local_path in self._entries.items():
+                for pkg_path, local_path in self._all_entries().items():
                     z.write(local_path, arcname=pkg_path)
 
             f.seek(0)
@@ -92,6 +135,205 @@ class _LambdaPkgMaker(object):
             f.close()
             raise
 
+def _package_hash(package):
+    # for hashing packages in other processes
+    return _LambdaPkgMaker(**package).hash
+
+_DEFAULT_PLATFORMS = {
+    'x86_64': 'manylinux2014_x86_64',
+    'arm64': 'manylinux2014_aarch64',
+}
+
+def _get_runtime_and_platform(ctx):
+    '''
+    Look at the Lambda function's "Runtime" and "Architectures" properties to
+    figure out which Python version and platform dependencies must be
+    installed for.
+
+    :return: A pair (runtime, platform); either may be None.
+    '''
+
+    props = {}
+    if isinstance(ctx.resource_node, collections.Mapping):
+        props = ctx.resource_node.get('Properties', {})
+    if not isinstance(props, collections.Mapping):
+        return None, None
+
+    runtime = None
+    if 'Runtime' in props:
+        try:
+            runtime = eval_cfn_expr.eval_expr(props['Runtime'], ctx)
+        except utils.InvalidTemplate:
+            # it's okay; we just won't pin the Python version
+            pass
+
+    arch = 'x86_64'
+    archs = props.get('Architectures')
+    if isinstance(archs, collections.Sequence) and len(archs) == 1 and \
+        isinstance(archs[0], utils.base_str):
+        arch = archs[0]
+
+    return runtime, _DEFAULT_PLATFORMS.get(arch)
+
+def _install_requirements(req_path, wheelhouse_path, runtime, platform):
+    '''
+    Install the packages listed in a requirements file into a directory in
+    the local cache, using only the wheels in a local wheelhouse directory.
+
+    The cache directory is named after a hash of the requirements file, the
+    names and contents of the wheels in the wheelhouse, the runtime, and the
+    platform, so pip is run only when one of these changes (e.g., also when a
+    wheel is rebuilt without changing its version).
+
+    :return: A pair (abs path to dir containing the installed packages,
+    the dir's cache key).
+    '''
+
+    # compute cache key
+    h = hashlib.new(utils.FILE_HASH_ALG)
+    with io.open(req_path, 'rb') as f:
+        h.update(f.read())
+    for fn in sorted(os.listdir(wheelhouse_path)):
+        fn_encoded = fn.encode('utf-8')
+        h.update(struct.pack('>Q', len(fn_encoded)))
+        h.update(fn_encoded)
+        wheel_path = os.path.join(wheelhouse_path, fn)
+        if not os.path.isfile(wheel_path):
+            continue
+        h.update(struct.pack('>Q', os.path.getsize(wheel_path)))
+        with io.open(wheel_path, 'rb') as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if len(data) == 0:
+                    break
+                h.update(data)
+    h.update(b'\0')
+    h.update('{}/{}'.format(runtime, platform).encode('utf-8'))
+    deps_key = h.hexdigest()
+
+    deps_root = utils.cache_dir('lambda-deps')
+    deps_dir = os.path.join(deps_root, deps_key)
+    if os.path.isdir(deps_dir):
+        return deps_dir, deps_key
+
+    # install into temp dir, then move into place so that a failed install
+    # never leaves a half-populated cache entry
+    print("Installing Lambda dependencies from {}".format(req_path))
+    tmp_dir = tempfile.mkdtemp(dir=deps_root, prefix='tmp-')
+    try:
+        cmd = [sys.executable, '-m', 'pip', 'install', '--quiet', \
+            '--no-index', '--find-links', wheelhouse_path, \
+            '--requirement', req_path, '--target', tmp_dir]
+        match = re.match(r'^python(\d+\.\d+)$', runtime or '')
+        if match is not None:
+            cmd += ['--python-version', match.group(1), \
+                '--implementation', 'cp', '--only-binary', ':all:']
+            if platform is not None:
+                cmd += ['--platform', platform]
+        try:
+            subprocess.check_call(cmd)
+        except (subprocess.CalledProcessError, OSError) as e:
+            raise utils.InvalidTemplate("Aruba::LambdaCode: failed to " + \
+                "install requirements in {}: {}".format(req_path, e))
+
+        try:
+            os.rename(tmp_dir, deps_dir)
+        except OSError:
+            # another process beat us to it
+            if not os.path.isdir(deps_dir):
+                raise
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return deps_dir, deps_key
+
+# CloudFormation allows at most this many characters in "Code.ZipFile"
+MAX_INLINE_CODE_SIZE = 4096
+
+# runtime prefix -> extensions of source files that may be inlined
+_INLINE_RUNTIMES = {
+    'python': ('.py',),
+    'nodejs': ('.js',),
+}
+
+def _try_inline(abs_local_path, ctx):
+    '''
+    See if the function's code can be given directly in the template (via
+    "Code.ZipFile") instead of via a package in S3.  This is possible only if
+    the directory contains just one small source file for a Python or Node.js
+    runtime, and the function's handler is in that file.
+
+    CloudFormation saves inline code as "index.py" or "index.js", so if this
+    function returns something, it has also changed the function's "Handler"
+    property to point into "index".
+
+    :return: The source code as a string, or None.
+    '''
+
+    # get the one file
+    entries = os.listdir(abs_local_path)
+    if len(entries) != 1:
+        return None
+    file_path = os.path.join(abs_local_path, entries[0])
+    if not os.path.isfile(file_path) or \
+        os.path.getsize(file_path) > MAX_INLINE_CODE_SIZE:
+        return None
+    module_name, ext = os.path.splitext(entries[0])
+
+    # check runtime
+    props = {}
+    if isinstance(ctx.resource_node, collections.Mapping):
+        props = ctx.resource_node.get('Properties', {})
+    if not isinstance(props, collections.Mapping):
+        return None
+    runtime = props.get('Runtime')
+    if not isinstance(runtime, utils.base_str):
+        return None
+    exts = None
+    for prefix, prefix_exts in _INLINE_RUNTIMES.items():
+        if runtime.startswith(prefix):
+            exts = prefix_exts
+    if exts is None or ext not in exts:
+        return None
+
+    # check handler
+    handler = props.get('Handler')
+    if not isinstance(handler, utils.base_str) or \
+        not handler.startswith(module_name + '.'):
+        return None
+
+    # read code
+    try:
+        with io.open(file_path, 'r', encoding='utf-8') as f:
+            code = f.read()
+    except UnicodeDecodeError:
+        return None
+    if len(code) > MAX_INLINE_CODE_SIZE:
+        return None
+
+    props['Handler'] = 'index' + handler[len(module_name):]
+    return code
+
+def _describe_package_upload(aws_region, bucket_name, key, **_):
+    # the key ends with the package's hash
+    return utils.describe_s3_action(aws_region, bucket_name, key, \
+        digest=key.rsplit('/', 1)[-1])
+
+@utils.action_func('LambdaCodeUpload', describe=_describe_package_upload)
+def _upload_package(undoers, committers, aws_region, bucket_name, key, \
+    package):
+    # check if bucket exists
+    bucket = storage.get_storage(bucket_name, aws_region)
+    if not bucket.exists():
+        raise utils.InvalidTemplate("No such S3 bucket: {}".\
+            format(bucket_name))
+
+    with tracing.span('LambdaCode: zip', key=key):
+        f = _LambdaPkgMaker(**package).open()
+    with f:
+        s3_ops.upload_file(f, bucket, key, undoers, committers)
+
 def evaluate(arg_node, ctx):
     '''
     :return: Instance of Result.
@@ -106,6 +348,11 @@ def evaluate(arg_node, ctx):
         s3_dest_node = arg_node['S3Dest']
     except KeyError:
         raise ex
+    req_node = arg_node.get('Requirements')
+    wheelhouse_node = arg_node.get('Wheelhouse')
+    if (req_node is None) != (wheelhouse_node is None):
+        raise utils.InvalidTemplate("Aruba::LambdaCode: 'Requirements' " + \
+            "and 'Wheelhouse' must be used together")
 
     # eval nodes in arg
     local_path = eval_cfn_expr.eval_expr(local_path_node, ctx)
@@ -117,28 +364,62 @@ def evaluate(arg_node, ctx):
     if not os.path.isdir(abs_local_path):
         raise utils.InvalidTemplate("{} is not a directory".\
             format(abs_local_path))
+    ctx.add_input('dir', abs_local_path)
+
+    # inline code if possible
+    if arg_node.get('Inline', False) in (True, 'true', 'True') and \
+        req_node is None:
+        code = _try_inline(abs_local_path, ctx)
+        if code is not None:
+            return utils.Result(new_template=('Code', {'ZipFile': code}))
 
     # make package
     pkg_maker = _LambdaPkgMaker()
-    for parent, _, filenames in os.walk(abs_local_path):
-        for fn in filenames:
-            local_path = os.path.join(parent, fn)
-            pkg_path = os.path.relpath(local_path, start=abs_local_path)
-            pkg_maker.add(local_path, pkg_path)
-
-    # compute S3 key
-    s3_key = '{}/{}'.format(dir_key, pkg_maker.hash)
-
-    def action(undoers, committers):
-        # check if bucket exists
-        if not utils.bucket_exists(bucket_name, ctx.aws_region):
-            raise utils.InvalidTemplate("No such S3 bucket: {}".\
-                format(bucket_name))
-        bucket = boto3.resource('s3', region_name=ctx.aws_region).\
-            Bucket(bucket_name)
-
-        with pkg_maker.open() as f:
-            s3_ops.upload_file(f, bucket, s3_key, undoers, committers)
+    pkg_size = 0
+    with tracing.span('LambdaCode: walk', path=abs_local_path):
+        for parent, _, filenames in os.walk(abs_local_path):
+            for fn in filenames:
+                local_path = os.path.join(parent, fn)
+                pkg_path = os.path.relpath(local_path, start=abs_local_path)
+                pkg_maker.add(local_path, pkg_path)
+                pkg_size += os.path.getsize(local_path)
+    ctx.metrics.incr('cfnplus_lambda_packages')
+    ctx.metrics.incr('cfnplus_lambda_package_bytes', pkg_size)
+
+    # add dependencies
+    if req_node is not None:
+        req_path = ctx.abspath(eval_cfn_expr.eval_expr(req_node, ctx))
+        wheelhouse_path = ctx.abspath(eval_cfn_expr.eval_expr(wheelhouse_node, \
+            ctx))
+        if not os.path.isfile(req_path):
+            raise utils.InvalidTemplate("{} is not a file".format(req_path))
+        if not os.path.isdir(wheelhouse_path):
+            raise utils.InvalidTemplate("{} is not a directory".\
+                format(wheelhouse_path))
+        ctx.add_input('file', req_path)
+        ctx.add_input('dir', wheelhouse_path)
+        runtime, platform = _get_runtime_and_platform(ctx)
+        with tracing.span('LambdaCode: install requirements', path=req_path):
+            deps_dir, deps_key = _install_requirements(req_path, \
+                wheelhouse_path, runtime, platform)
+        ctx.add_input('dir', deps_dir)
+        pkg_maker.add_dependencies(deps_dir, deps_key)
+
+    # compute S3 key (the same package may be used by several functions)
+    @tracing.traced('LambdaCode: hash')
+    def compute_hash():
+        ctx.metrics.incr('cfnplus_bytes_hashed', pkg_size)
+        if ctx.hash_executor is None:
+            return pkg_maker.hash
+        return ctx.hash_executor.submit(_package_hash, \
+            pkg_maker.to_dict()).result()
+    memo_key = ('LambdaPackageHash', json.dumps(pkg_maker.to_dict(), \
+        sort_keys=True))
+    pkg_hash = ctx.memo.get(memo_key, compute_hash)
+    s3_key = '{}/{}'.format(dir_key, pkg_hash)
+
+    action = utils.Action('LambdaCodeUpload', aws_region=ctx.aws_region, \
+        bucket_name=bucket_name, key=s3_key, package=pkg_maker.to_dict())
 
     # make new tag
     new_tag_value = {
@@ -148,40 +429,3 @@ def evaluate(arg_node, ctx):
 
     return utils.Result(new_template=('Code', new_tag_value), \
         before_creation=[action])
-
-def delete_unused_lambda_code(stack_names, bucket_name, s3_code_prefix, \
-    aws_region):
-    # In order to support rollbacks, we need to keep Lambda functions' source
-    # in S3 (even though it isn't actually used when the functions run).
-    # Eventually function code gets replaced with new verions, so we need to
-    # delete old code that's no longer referenced by a stack.
-
-    cf = boto3.client('cloudformation', region_name=aws_region)
-
-    if not s3_code_prefix.endswith('/'):
-        s3_code_prefix += '/'
-
-    # make list of code files referenced by any stack
-    refed_code = set([])
-    for stack_name in stack_names:
-        resp = cf.get_template(StackName=stack_name, TemplateStage='Original')
-        template = yaml.load(resp['TemplateBody'])
-        for _, rsrc in template['Resources'].items():
-            if rsrc['Type'] != 'AWS::Lambda::Function':
-                continue
-            code_node = rsrc['Properties']['Code']
-            curr_bucket = code_node['S3Bucket']
-            curr_key = code_node['S3Key']
-            if curr_bucket != bucket_name or \
-                not curr_key.startswith(s3_code_prefix):
-                continue
-            refed_code.add(curr_key)
-
-    # delete unreferenced code files from S3
-    bucket = boto3.resource('s3', region_name=aws_region).Bucket(bucket_name)
-    for obj in bucket.objects.filter(Prefix=s3_code_prefix):
-        if obj.key in refed_code:
-            continue
-        print("Deleting unused Lambda code s3://{}/{}".\
-            format(bucket_name, obj.key))
-        obj.delete()
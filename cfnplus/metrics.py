@@ -0,0 +1,205 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Metrics about processing templates and doing actions --- e.g., bytes hashed
+and uploaded, cache hits, and API calls.
+
+Each Result has a Metrics object in its "metrics" attribute.  Processing
+fills it in through the context, and actions fill it in through the metrics
+that are active in the current thread (cf. active).
+'''
+
+import os
+import time
+import tempfile
+import threading
+import contextlib
+
+_HELP = {
+    'cfnplus_actions_coalesced': \
+        'Repeated actions removed because they would have no effect',
+    'cfnplus_api_calls': 'AWS API calls made',
+    'cfnplus_bytes_hashed': 'Bytes of local files hashed',
+    'cfnplus_bytes_uploaded': 'Bytes uploaded to S3',
+    'cfnplus_cache_evictions': \
+        'Entries evicted from in-memory caches of processing results',
+    'cfnplus_cache_requests': 'Lookups in caches of processing results',
+    'cfnplus_lambda_packages': 'Lambda packages made',
+    'cfnplus_lambda_package_bytes': \
+        'Total size of the files in Lambda packages',
+    'cfnplus_objects_deleted': 'S3 objects deleted',
+    'cfnplus_objects_unchanged': \
+        'S3 objects not uploaded because they were unchanged',
+    'cfnplus_objects_uploaded': 'S3 objects uploaded',
+    'cfnplus_phase_seconds': 'Time spent in each phase',
+    'cfnplus_s3_dirs_made': 'S3 directories made',
+    'cfnplus_sync_files': 'Local files considered by S3Sync actions',
+}
+
+_local = threading.local()
+
+class Metrics(object):
+    '''
+    A thread-safe set of counters.  Each counter has a name and optional
+    labels.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {} # (name, sorted label items) -> value
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def get(self, name, **labels):
+        '''
+        :return: The value of a counter (0 if it was never incremented).
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def total(self, name):
+        '''
+        :return: The sum of the values of a counter over all labels.
+        '''
+
+        with self._lock:
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def merge(self, other):
+        '''
+        Add another Metrics object's counters to this one's.
+        '''
+
+        with other._lock: # pylint: disable=protected-access
+            items = list(other._counters.items()) # pylint: disable=protected-access
+        with self._lock:
+            for key, value in items:
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        '''
+        Add the time taken by the body of a "with" statement to the
+        "cfnplus_phase_seconds" counter for the given phase.
+        '''
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.incr('cfnplus_phase_seconds', time.time() - start, \
+                phase=phase)
+
+    def to_openmetrics(self):
+        '''
+        :return: The counters in the OpenMetrics text format.
+        '''
+
+        with self._lock:
+            items = sorted(self._counters.items())
+
+        lines = []
+        prev_name = None
+        for (name, labels), value in items:
+            if name != prev_name:
+                if name in _HELP:
+                    lines.append('# HELP {} {}'.format(name, _HELP[name]))
+                lines.append('# TYPE {} counter'.format(name))
+                prev_name = name
+            label_str = ''
+            if len(labels) > 0:
+                label_str = '{' + ','.join('{}="{}"'.format(k, \
+                    _escape_label_value(v)) for k, v in labels) + '}'
+            lines.append('{}_total{} {}'.format(name, label_str, \
+                _format_value(value)))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_openmetrics(self, path):
+        '''
+        Write the counters in the OpenMetrics text format --- e.g., to a file
+        read by node_exporter's textfile collector.  The file is replaced
+        atomically, so a collector never sees a partly written file.
+        '''
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.to_openmetrics())
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').\
+        replace('\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+@contextlib.contextmanager
+def active(metrics):
+    '''
+    Make the given Metrics object the current one in this thread for the body
+    of a "with" statement.
+    '''
+
+    prev = current()
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = prev
+
+def current():
+    '''
+    :return: The Metrics object that is active in this thread, or None.
+    '''
+
+    return getattr(_local, 'metrics', None)
+
+def incr(name, value=1, **labels):
+    '''
+    Increment a counter in the Metrics object that is active in this thread,
+    if any.
+    '''
+
+    metrics = current()
+    if metrics is not None:
+        metrics.incr(name, value, **labels)
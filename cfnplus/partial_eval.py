@@ -0,0 +1,519 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Partial evaluation of templates: intrinsic functions whose arguments are all
+known when the template is processed are replaced by their values, and
+resources and outputs whose conditions are known to be false are removed.
+The result is smaller, and gives CloudFormation less to evaluate and diff.
+
+The values that are known are those of the template's parameters (except
+"NoEcho" parameters and those whose values are resolved by CloudFormation,
+like SSM parameters), "AWS::Region", and "AWS::StackName".  The functions
+that are folded are "Ref", "Fn::If" (and conditions), "Fn::FindInMap",
+"Fn::Join", "Fn::Select", "Fn::Split", and "Fn::Sub".  Everything else is
+left as it is.
+'''
+
+import re
+import copy
+import collections
+import numbers
+from . import utils
+
+_PSEUDO_PARAMS = ('AWS::Region', 'AWS::StackName')
+
+# matches "${Name}" and "${!Literal}"
+_SUB_VAR_REGEX = re.compile(r'\$\{(!?)([^}]*)\}')
+
+# functions whose arguments are names, not expressions, or that CloudFormation
+# evaluates specially
+_OPAQUE_FUNCS = ('Fn::GetAtt', 'Fn::Transform')
+
+# Returned when a node folds to "AWS::NoValue": the property or item that
+# contains it is removed
+_NO_VALUE = object()
+
+_UNKNOWN = object()
+
+def _is_known(node):
+    if isinstance(node, (utils.base_str, numbers.Number, bool)):
+        return True
+    if isinstance(node, list):
+        return all(_is_known(item) for item in node)
+    return False
+
+def _to_str(value):
+    if isinstance(value, utils.base_str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+def _is_list_param(param_type):
+    return param_type == 'CommaDelimitedList' or \
+        param_type.startswith('List<')
+
+class _Folder(object):
+    def __init__(self, template, ctx):
+        self._template = template
+        self._mappings = template.get('Mappings', {})
+        self._condition_nodes = template.get('Conditions', {})
+        self._conditions = {} # name -> True, False, or _UNKNOWN
+        self._values = self._known_values(template, ctx)
+
+    @staticmethod
+    def _known_values(template, ctx):
+        values = {}
+        params = template.get('Parameters', {})
+        if not isinstance(params, collections.Mapping):
+            params = {}
+        for name, decl in params.items():
+            if not isinstance(decl, collections.Mapping):
+                continue
+            if _to_str(decl.get('NoEcho', False)).lower() == 'true':
+                continue
+            param_type = _to_str(decl.get('Type', 'String'))
+            if param_type.startswith('AWS::SSM::Parameter::'):
+                continue
+            try:
+                value = ctx.resolve_var(name)
+            except KeyError:
+                continue
+            if not isinstance(value, utils.base_str):
+                continue
+            if _is_list_param(param_type):
+                value = [v.strip() for v in value.split(',')]
+            values[name] = value
+
+        if ctx.aws_region is not None:
+            values['AWS::Region'] = ctx.aws_region
+        if ctx.stack_name is not None:
+            values['AWS::StackName'] = ctx.stack_name
+        return values
+
+    #
+    # Conditions
+    #
+
+    def condition(self, name):
+        '''
+        :return: True, False, or _UNKNOWN.
+        '''
+
+        try:
+            return self._conditions[name]
+        except KeyError:
+            pass
+        # guard against cycles
+        self._conditions[name] = _UNKNOWN
+        node = self._condition_nodes.get(name) \
+            if isinstance(name, utils.base_str) else None
+        value = _UNKNOWN if node is None else self._eval_condition(node)
+        self._conditions[name] = value
+        return value
+
+    def _eval_condition(self, node):
+        if isinstance(node, bool):
+            return node
+        if not isinstance(node, collections.Mapping) or len(node) != 1:
+            return _UNKNOWN
+        func_name, arg = utils.dict_only_item(node)
+
+        if func_name == 'Condition':
+            return self.condition(arg)
+        if func_name == 'Fn::Equals':
+            if not isinstance(arg, list) or len(arg) != 2:
+                return _UNKNOWN
+            a, b = [self.fold(v) for v in arg]
+            if not _is_known(a) or not _is_known(b):
+                return _UNKNOWN
+            if isinstance(a, list) or isinstance(b, list):
+                if not isinstance(a, list) or not isinstance(b, list):
+                    return _UNKNOWN
+                return [_to_str(v) for v in a] == [_to_str(v) for v in b]
+            return _to_str(a) == _to_str(b)
+        if func_name == 'Fn::Not':
+            if not isinstance(arg, list) or len(arg) != 1:
+                return _UNKNOWN
+            value = self._eval_condition(arg[0])
+            return _UNKNOWN if value is _UNKNOWN else not value
+        if func_name in ('Fn::And', 'Fn::Or'):
+            if not isinstance(arg, list):
+                return _UNKNOWN
+            deciding = func_name == 'Fn::Or'
+            result = not deciding
+            for item in arg:
+                value = self._eval_condition(item)
+                if value is _UNKNOWN:
+                    result = _UNKNOWN
+                elif value == deciding:
+                    return deciding
+            return result
+        return _UNKNOWN
+
+    #
+    # Expressions
+    #
+
+    def fold(self, node):
+        '''
+        :return: The node, with the intrinsic functions in it that can be
+        evaluated replaced by their values, or _NO_VALUE.
+        '''
+
+        if isinstance(node, list):
+            new_list = []
+            for item in node:
+                item = self.fold(item)
+                if item is not _NO_VALUE:
+                    new_list.append(item)
+            return new_list
+        if not isinstance(node, collections.Mapping):
+            return node
+
+        if len(node) == 1:
+            func_name, arg = utils.dict_only_item(node)
+            if func_name in _OPAQUE_FUNCS:
+                return node
+            handler = _HANDLERS.get(func_name)
+            if handler is not None:
+                return handler(self, arg, node)
+
+        new_node = collections.OrderedDict() \
+            if isinstance(node, collections.OrderedDict) else {}
+        for key, value in node.items():
+            value = self.fold(value)
+            if value is not _NO_VALUE:
+                new_node[key] = value
+        return new_node
+
+    def _fold_ref(self, arg, node):
+        if isinstance(arg, utils.base_str) and arg in self._values:
+            return copy.deepcopy(self._values[arg])
+        return node
+
+    def _fold_if(self, arg, node):
+        if not isinstance(arg, list) or len(arg) != 3:
+            return node
+        value = self.condition(arg[0])
+        if value is _UNKNOWN:
+            branches = []
+            for branch in arg[1:]:
+                branch = self.fold(branch)
+                if branch is _NO_VALUE:
+                    branch = {'Ref': 'AWS::NoValue'}
+                branches.append(branch)
+            return {'Fn::If': [arg[0]] + branches}
+        chosen = arg[1] if value else arg[2]
+        if chosen == {'Ref': 'AWS::NoValue'}:
+            return _NO_VALUE
+        return self.fold(chosen)
+
+    def _fold_find_in_map(self, arg, node):
+        if not isinstance(arg, list) or len(arg) != 3:
+            return node
+        args = [self.fold(v) for v in arg]
+        if all(isinstance(v, utils.base_str) for v in args):
+            try:
+                value = self._mappings[args[0]][args[1]][args[2]]
+            except (KeyError, TypeError):
+                pass
+            else:
+                return copy.deepcopy(value)
+        return {'Fn::FindInMap': args}
+
+    def _fold_join(self, arg, node):
+        if not isinstance(arg, list) or len(arg) != 2:
+            return node
+        delim, items = [self.fold(v) for v in arg]
+        if isinstance(delim, utils.base_str) and isinstance(items, list) and \
+            all(isinstance(v, (utils.base_str, numbers.Number)) and \
+            not isinstance(v, bool) for v in items):
+            return delim.join(_to_str(v) for v in items)
+        return {'Fn::Join': [delim, items]}
+
+    def _fold_select(self, arg, node):
+        if not isinstance(arg, list) or len(arg) != 2:
+            return node
+        index, items = [self.fold(v) for v in arg]
+        if isinstance(items, list) and \
+            isinstance(index, (utils.base_str, numbers.Number)) and \
+            not isinstance(index, bool):
+            try:
+                i = int(index)
+            except ValueError:
+                i = -1
+            if 0 <= i < len(items):
+                return items[i]
+        return {'Fn::Select': [index, items]}
+
+    def _fold_split(self, arg, node):
+        if not isinstance(arg, list) or len(arg) != 2:
+            return node
+        delim, value = [self.fold(v) for v in arg]
+        if isinstance(delim, utils.base_str) and \
+            isinstance(value, utils.base_str) and len(delim) > 0:
+            return value.split(delim)
+        return {'Fn::Split': [delim, value]}
+
+    def _fold_sub(self, arg, node):
+        if isinstance(arg, utils.base_str):
+            format_str, local_vars = arg, {}
+        elif isinstance(arg, list) and len(arg) == 2 and \
+            isinstance(arg[0], utils.base_str) and \
+            isinstance(arg[1], collections.Mapping):
+            format_str = arg[0]
+            local_vars = dict((k, self.fold(v)) for k, v in arg[1].items())
+        else:
+            return node
+
+        def value_of(name):
+            if name in local_vars:
+                value = local_vars[name]
+            else:
+                value = self._values.get(name, _UNKNOWN)
+            if isinstance(value, (utils.base_str, numbers.Number)):
+                return _to_str(value)
+            return _UNKNOWN
+
+        # make the string as if all variables are known, and, in case they
+        # aren't, as a format string with the known ones substituted
+        full = []
+        partial = []
+        unknown_vars = set([])
+        pos = 0
+        for match in _SUB_VAR_REGEX.finditer(format_str):
+            literal = format_str[pos:match.start()]
+            full.append(literal)
+            partial.append(literal)
+            pos = match.end()
+            if match.group(1) == '!':
+                full.append('${' + match.group(2) + '}')
+                partial.append(match.group(0))
+                continue
+            value = value_of(match.group(2))
+            if value is _UNKNOWN:
+                unknown_vars.add(match.group(2))
+                partial.append(match.group(0))
+            else:
+                full.append(value)
+                partial.append(value.replace('${', '${!'))
+        full.append(format_str[pos:])
+        partial.append(format_str[pos:])
+
+        if len(unknown_vars) == 0:
+            return ''.join(full)
+        remaining = dict((k, v) for k, v in local_vars.items() \
+            if k in unknown_vars)
+        if len(remaining) == 0:
+            return {'Fn::Sub': ''.join(partial)}
+        return {'Fn::Sub': [''.join(partial), remaining]}
+
+_HANDLERS = {
+    'Ref': _Folder._fold_ref, # pylint: disable=protected-access
+    'Fn::If': _Folder._fold_if, # pylint: disable=protected-access
+    'Fn::FindInMap': _Folder._fold_find_in_map, # pylint: disable=protected-access
+    'Fn::Join': _Folder._fold_join, # pylint: disable=protected-access
+    'Fn::Select': _Folder._fold_select, # pylint: disable=protected-access
+    'Fn::Split': _Folder._fold_split, # pylint: disable=protected-access
+    'Fn::Sub': _Folder._fold_sub, # pylint: disable=protected-access
+}
+
+def _referenced_names(node, func_name):
+    '''
+    :return: A set of the first arguments of the given function in the node
+    (e.g., condition names for "Fn::If"), or None if some of them are not
+    literal names.
+    '''
+
+    names = set([])
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, collections.Mapping):
+            arg = node.get(func_name)
+            if isinstance(arg, list) and len(arg) > 0:
+                if not isinstance(arg[0], utils.base_str):
+                    return None
+                names.add(arg[0])
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return names
+
+def partially_evaluate(template, ctx):
+    '''
+    Partially evaluate a template (cf. the description of this module).
+
+    :param template: A parsed template.  It is not changed.
+    :param ctx: An instance of utils.Context, whose symbols are the template's
+    parameters.
+
+    :return: The new template.
+    '''
+
+    if not isinstance(template, collections.Mapping) or \
+        'Transform' in template:
+        # macros may depend on what we would fold
+        return template
+
+    folder = _Folder(template, ctx)
+    new_template = collections.OrderedDict() \
+        if isinstance(template, collections.OrderedDict) else {}
+    new_template.update(template)
+
+    # resources
+    pruned = set([])
+    resources = template.get('Resources')
+    if isinstance(resources, collections.Mapping):
+        new_resources = {}
+        for name, rsrc in resources.items():
+            if not isinstance(rsrc, collections.Mapping):
+                new_resources[name] = rsrc
+                continue
+            cond = rsrc.get('Condition')
+            if cond is not None:
+                value = folder.condition(cond)
+                if value is False:
+                    pruned.add(name)
+                    continue
+            new_rsrc = {}
+            for key, value in rsrc.items():
+                if key in ('Type', 'DependsOn'):
+                    new_rsrc[key] = value
+                elif key == 'Condition':
+                    if folder.condition(value) is not True:
+                        new_rsrc[key] = value
+                else:
+                    value = folder.fold(value)
+                    if value is not _NO_VALUE:
+                        new_rsrc[key] = value
+            new_resources[name] = new_rsrc
+
+        # don't depend on removed resources
+        for rsrc in new_resources.values():
+            if not isinstance(rsrc, collections.Mapping):
+                continue
+            depends_on = rsrc.get('DependsOn')
+            if isinstance(depends_on, utils.base_str) and depends_on in pruned:
+                del rsrc['DependsOn']
+            elif isinstance(depends_on, list):
+                depends_on = [d for d in depends_on if d not in pruned]
+                if len(depends_on) == 0:
+                    del rsrc['DependsOn']
+                else:
+                    rsrc['DependsOn'] = depends_on
+        new_template['Resources'] = new_resources
+
+    # outputs
+    outputs = template.get('Outputs')
+    if isinstance(outputs, collections.Mapping):
+        new_outputs = {}
+        for name, output in outputs.items():
+            if not isinstance(output, collections.Mapping):
+                new_outputs[name] = output
+                continue
+            cond = output.get('Condition')
+            if cond is not None and folder.condition(cond) is False:
+                continue
+            new_output = folder.fold(dict((k, v) for k, v in output.items() \
+                if k != 'Condition'))
+            if cond is not None and folder.condition(cond) is not True:
+                new_output['Condition'] = cond
+            new_outputs[name] = new_output
+        new_template['Outputs'] = new_outputs
+
+    # remove known conditions and mappings that are no longer used
+    rest = dict((k, v) for k, v in new_template.items() \
+        if k not in ('Conditions', 'Mappings'))
+    conditions = template.get('Conditions')
+    if isinstance(conditions, collections.Mapping):
+        used = _referenced_names(rest, 'Fn::If')
+        if used is not None:
+            used.update(_condition_attrs(new_template))
+            used.update(k for k in conditions \
+                if folder.condition(k) is _UNKNOWN)
+            used = _referenced_conditions(conditions, used)
+            new_conditions = dict((k, v) for k, v in conditions.items() \
+                if k in used)
+            if len(new_conditions) > 0:
+                new_template['Conditions'] = new_conditions
+            else:
+                del new_template['Conditions']
+    mappings = template.get('Mappings')
+    if isinstance(mappings, collections.Mapping):
+        used = _referenced_names([rest, new_template.get('Conditions')], \
+            'Fn::FindInMap')
+        if used is not None:
+            new_mappings = dict((k, v) for k, v in mappings.items() \
+                if k in used)
+            if len(new_mappings) > 0:
+                new_template['Mappings'] = new_mappings
+            else:
+                del new_template['Mappings']
+
+    return new_template
+
+def _condition_attrs(template):
+    names = set([])
+    for section in ('Resources', 'Outputs'):
+        items = template.get(section)
+        if not isinstance(items, collections.Mapping):
+            continue
+        for item in items.values():
+            if isinstance(item, collections.Mapping) and \
+                isinstance(item.get('Condition'), utils.base_str):
+                names.add(item['Condition'])
+    return names
+
+def _referenced_conditions(conditions, names):
+    '''
+    :return: The given condition names plus the names of the conditions they
+    refer to (recursively).
+    '''
+
+    result = set([])
+    stack = list(names)
+    while len(stack) > 0:
+        name = stack.pop()
+        if name in result:
+            continue
+        result.add(name)
+        node_stack = [conditions.get(name)]
+        while len(node_stack) > 0:
+            node = node_stack.pop()
+            if isinstance(node, collections.Mapping):
+                ref = node.get('Condition')
+                if isinstance(ref, utils.base_str):
+                    stack.append(ref)
+                node_stack.extend(node.values())
+            elif isinstance(node, list):
+                node_stack.extend(node)
+    return result
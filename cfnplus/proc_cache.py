@@ -0,0 +1,442 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+import os
+import io
+import re
+import json
+import datetime
+import hashlib
+import tempfile
+import threading
+import collections
+from . import utils, serialization
+
+# change this whenever the format of cache entries changes, or whenever a
+# change to this library would change the results of processing templates
+CACHE_FORMAT_VERSION = 1
+
+# max total size of the cached results; when it is exceeded, the least
+# recently used ones are removed
+RESULTS_MAX_BYTES = 256 * 1024 * 1024
+
+def _write_json_atomically(path, obj):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+def _read_json(path):
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _json_default(obj):
+    # YAML parsers turn unquoted dates into date objects; keep them distinct
+    # from strings
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return {'__date__': obj.isoformat()}
+    raise TypeError("{} is not JSON serializable".format(repr(obj)))
+
+def _canonical_json(obj):
+    return json.dumps(obj, sort_keys=True, default=_json_default)
+
+_SUB_VAR_REGEX = re.compile(r'\$\{([-.:_0-9a-zA-Z]*)\}')
+
+def _referenced_symbols(node):
+    '''
+    :return: A set of the names of the symbols that are referenced in the
+    given node by "Ref" or "Fn::Sub" expressions.
+    '''
+
+    names = set([])
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if isinstance(node, collections.Mapping):
+            ref = node.get('Ref')
+            if isinstance(ref, utils.base_str):
+                names.add(ref)
+            sub = node.get('Fn::Sub')
+            if isinstance(sub, collections.Sequence) and \
+                not isinstance(sub, utils.base_str) and len(sub) > 0:
+                sub = sub[0]
+            if isinstance(sub, utils.base_str):
+                names.update(_SUB_VAR_REGEX.findall(sub))
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return names
+
+class FileDigests(object):
+    '''
+    Computes digests of the contents of local files and directories.
+
+    A file is hashed again only if its size or modification time has changed
+    since it was last hashed.  If a path is given, the sizes, modification
+    times, and digests are kept in a JSON file at that path, so that they are
+    remembered across runs.
+    '''
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._digests = {} # abs path -> [size, mtime, digest]
+        if path is not None:
+            self._digests = _read_json(path) or {}
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._digests.get(path)
+        if entry is not None and entry[0] == stat.st_size and \
+            entry[1] == stat.st_mtime:
+            return entry[2]
+
+        h = hashlib.new(utils.FILE_HASH_ALG)
+        with io.open(path, 'rb') as f:
+            while True:
+                data = f.read(65536)
+                if len(data) == 0:
+                    break
+                h.update(data)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._digests[path] = [stat.st_size, stat.st_mtime, digest]
+            self._dirty = True
+        return digest
+
+    def dir_digest(self, path):
+        '''
+        :return: A digest of the relative paths and contents of all the files
+        in the directory (recursively).
+        '''
+
+        if not os.path.isdir(path):
+            raise OSError("{} is not a directory".format(path))
+
+        h = hashlib.new(utils.FILE_HASH_ALG)
+        for parent, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                file_path = os.path.join(parent, fn)
+                rel_path = os.path.relpath(file_path, start=path)
+                h.update(rel_path.encode('utf-8'))
+                h.update(b'\0')
+                h.update(self.file_digest(file_path).encode('utf-8'))
+                h.update(b'\0')
+        return h.hexdigest()
+
+    def save(self):
+        with self._lock:
+            if self._path is None or not self._dirty:
+                return
+            digests = dict(self._digests)
+            self._dirty = False
+        _write_json_atomically(self._path, digests)
+
+class ProcessingCache(object):
+    '''
+    A persistent cache of the results of processing templates.
+
+    An entry is stored under a key computed from the template and the context
+    (cf. make_key).  Since the result of processing a template also depends on
+    the inputs that were used --- local files and directories, and the values
+    of CloudFormation exports (cf. utils.Context.add_input) --- the entry also
+    contains digests of these inputs, and it is used only if the inputs still
+    have the same digests.
+
+    Actions are saved as descriptions (cf. utils.Action), so a result can be
+    cached only if all its actions are instances of utils.Action.
+
+    The entries take at most max_bytes; when they would take more, the least
+    recently used ones are removed.
+    '''
+
+    def __init__(self, directory, max_bytes=RESULTS_MAX_BYTES):
+        self._dir = os.path.join(directory, 'results')
+        try:
+            os.makedirs(self._dir)
+        except OSError:
+            if not os.path.isdir(self._dir):
+                raise
+        self.digests = FileDigests(os.path.join(directory, 'digests.json'))
+        self._max_bytes = max_bytes
+        self._size_lock = threading.Lock()
+        self._size = None # total size of the entries, once known
+
+    @staticmethod
+    def make_key(**parts):
+        parts['version'] = CACHE_FORMAT_VERSION
+        h = hashlib.new(utils.FILE_HASH_ALG)
+        h.update(json.dumps(parts, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def _input_digest(self, kind, value, ctx):
+        if kind == 'file':
+            return self.digests.file_digest(value)
+        elif kind == 'dir':
+            return self.digests.dir_digest(value)
+        elif kind == 'export':
+            return ctx.resolve_cfn_export(value)
+        else:
+            raise ValueError("Unknown kind of input: {}".format(kind))
+
+    def _entry_path(self, key):
+        return os.path.join(self._dir, key + '.json')
+
+    def _get_payload(self, key, ctx):
+        entry = _read_json(self._entry_path(key))
+        if entry is None:
+            return None
+
+        # check inputs
+        try:
+            for kind, value, digest in entry['inputs']:
+                if self._input_digest(kind, value, ctx) != digest:
+                    return None
+        except (OSError, IOError, utils.InvalidTemplate):
+            return None
+        finally:
+            self.digests.save()
+
+        # the modification time tells which entries were used last
+        try:
+            os.utime(self._entry_path(key), None)
+        except OSError:
+            pass
+        return entry
+
+    def _put_payload(self, key, inputs, payload, ctx):
+        actions = payload['before_creation'] + payload['after_creation']
+        if not all(isinstance(a, utils.Action) for a in actions):
+            return False
+
+        # compute digests of inputs
+        entry_inputs = []
+        seen = set([])
+        try:
+            for kind, value in inputs:
+                if (kind, value) in seen:
+                    continue
+                seen.add((kind, value))
+                digest = self._input_digest(kind, value, ctx)
+                entry_inputs.append([kind, value, digest])
+        except (OSError, IOError, utils.InvalidTemplate):
+            return False
+        finally:
+            self.digests.save()
+
+        entry = dict(payload)
+        entry['inputs'] = entry_inputs
+        entry['before_creation'] = [a.to_dict() for a in \
+            payload['before_creation']]
+        entry['after_creation'] = [a.to_dict() for a in \
+            payload['after_creation']]
+        path = self._entry_path(key)
+        _write_json_atomically(path, entry)
+        self._entry_written(path)
+        return True
+
+    def _entry_written(self, path):
+        with self._size_lock:
+            if self._size is None:
+                self._size = self._evict(self._max_bytes)
+                return
+            try:
+                self._size += os.path.getsize(path)
+            except OSError:
+                pass
+            if self._size > self._max_bytes:
+                # leave some room, so that the next entries do not each
+                # cause another eviction
+                self._size = self._evict(self._max_bytes * 3 // 4)
+
+    def _evict(self, max_bytes):
+        '''
+        Remove the least recently used entries until the entries take at most
+        max_bytes.
+
+        :return: The total size of the remaining entries.
+        '''
+
+        entries = [] # (mtime, size, path)
+        for fn in os.listdir(self._dir):
+            if not fn.endswith('.json'):
+                continue
+            path = os.path.join(self._dir, fn)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        return total
+
+    def get(self, key, ctx):
+        '''
+        :param ctx: Used to resolve CloudFormation exports.
+
+        :return: An instance of utils.Result, or None.
+        '''
+
+        found = self.get_with_inputs(key, ctx)
+        return None if found is None else found[0]
+
+    def get_with_inputs(self, key, ctx):
+        '''
+        Like get, but also return the inputs that were used to make the
+        result.
+
+        :return: A pair (instance of utils.Result, list of (kind, value)
+        pairs), or None.
+        '''
+
+        entry = self._get_payload(key, ctx)
+        if entry is None:
+            return None
+        result = utils.Result(
+            new_template=entry['new_template'],
+            before_creation=[utils.Action.from_dict(d) \
+                for d in entry['before_creation']],
+            after_creation=[utils.Action.from_dict(d) \
+                for d in entry['after_creation']],
+        )
+        inputs = [(kind, value) for kind, value, _ in entry['inputs']]
+        return result, inputs
+
+    def put(self, key, inputs, result, ctx):
+        '''
+        :param inputs: A list of (kind, value) pairs, as made by
+        utils.Context.record_inputs.
+        :param result: An instance of utils.Result whose new_template is a
+        string.
+        :param ctx: Used to resolve CloudFormation exports.
+
+        :return: True if the result was cached.
+        '''
+
+        return self._put_payload(key, inputs, {
+            'new_template': result.new_template,
+            'before_creation': result.before_creation,
+            'after_creation': result.after_creation,
+        }, ctx)
+
+    def eval_resource(self, phase, resources, rsrc_name, ctx, eval_func):
+        '''
+        Evaluate (part of) a resource, or reuse the result of an earlier
+        evaluation of the same resource.
+
+        The key consists of the resource's node, the symbols the evaluation
+        can see, and the parts of the context that matter; as with whole
+        templates, the inputs used by the evaluation must also be unchanged.
+        For the "tags" phase, only the symbols referenced in the node are
+        used, since tags cannot see anything else; for the "resource" phase
+        (i.e., "Aruba::Stack" resources), all symbols are used, since nested
+        templates can see all of them.
+
+        :param phase: "tags" or "resource"
+        :param eval_func: Function that takes the resources mapping, the
+        resource's name, and a context, and returns an instance of
+        utils.Result whose new_template is the new resource node (or None if
+        the resource should be removed).
+
+        :return: An instance of utils.Result.
+        '''
+
+        node = resources[rsrc_name]
+        if phase == 'tags':
+            symbols = {}
+            for name in _referenced_symbols(node):
+                try:
+                    symbols[name] = ctx.resolve_var(name)
+                except KeyError:
+                    symbols[name] = None
+        else:
+            symbols = ctx.symbols()
+        template_path = None if ctx.template_path is None \
+            else os.path.abspath(ctx.template_path)
+        key = self.make_key(
+            phase=phase,
+            node=_canonical_json(node),
+            resource_name=rsrc_name,
+            symbols=_canonical_json(symbols),
+            aws_region=ctx.aws_region,
+            template_path=template_path,
+            stack_name=ctx.stack_name,
+            template_is_imported=ctx.template_is_imported,
+            output_format=ctx.output_format,
+        )
+
+        # look in cache
+        entry = self._get_payload(key, ctx)
+        ctx.metrics.incr('cfnplus_cache_requests', cache='resource', \
+            result='miss' if entry is None else 'hit')
+        if entry is not None:
+            for kind, value, _ in entry['inputs']:
+                ctx.add_input(kind, value)
+            new_node = None
+            if entry['node'] is not None:
+                new_node = serialization.load_template(entry['node'])
+            return utils.Result(
+                new_template=new_node,
+                before_creation=[utils.Action.from_dict(d) \
+                    for d in entry['before_creation']],
+                after_creation=[utils.Action.from_dict(d) \
+                    for d in entry['after_creation']],
+            )
+
+        # evaluate
+        inputs = ctx.record_inputs()
+        result = eval_func(resources, rsrc_name, ctx)
+        self._put_payload(key, inputs, {
+            'node': None if result.new_template is None \
+                else serialization.dump_yaml(result.new_template),
+            'before_creation': result.before_creation,
+            'after_creation': result.after_creation,
+        }, ctx)
+        return result
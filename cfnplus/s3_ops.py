@@ -28,9 +28,12 @@
 
 import hashlib
 import base64
-import botocore
-from . import utils
+from . import utils, tracing, metrics, storage as storage_mod
 
+# The functions in this module take a Storage object (cf. storage) or a boto3
+# Bucket resource as "bucket".
+
+@tracing.traced('s3: upload_file')
 def upload_file(f, bucket, key, undoers, committers):
     # If there's no existing object:
     #    Do: upload file
@@ -48,55 +51,54 @@ def upload_file(f, bucket, key, undoers, committers):
     #    Commit: nop
 
     HASH_METADATA_KEY = '{}_sum'.format(utils.FILE_HASH_ALG)
+    storage = storage_mod.as_storage(bucket)
 
     # get file's hash
     h = hashlib.new(utils.FILE_HASH_ALG)
+    size = 0
     while True:
         buf = f.read(1024)
         if len(buf) == 0:
             break
         h.update(buf)
+        size += len(buf)
     hashvalue = str(base64.b64encode(h.digest()))
+    metrics.incr('cfnplus_bytes_hashed', size)
 
     # check if file was already uploaded
     previous_version = None
-    try:
-        prev_obj = bucket.Object(key)
-        previous_version = prev_obj.version_id
-        existing_hash = prev_obj.metadata.get(HASH_METADATA_KEY)
-    except botocore.exceptions.ClientError:
-        pass
-    else:
-        if existing_hash == hashvalue:
+    info = storage.head(key)
+    if info is not None:
+        previous_version = info.version_id
+        if info.metadata.get(HASH_METADATA_KEY) == hashvalue:
             # object already exists
+            metrics.incr('cfnplus_objects_unchanged')
             return
 
     # upload file
-    print("Uploading to s3://{}/{}".format(bucket.name, key))
+    print("Uploading to {}".format(storage.url(key)))
     f.seek(0)
-    obj = bucket.put_object(
-        Body=f,
-        Key=key,
-        Metadata={HASH_METADATA_KEY: hashvalue})
-    obj.wait_until_exists()
-    if obj.version_id is None:
-        obj.delete()
+    new_version = storage.put(key, f, {HASH_METADATA_KEY: hashvalue})
+    if new_version is None:
+        storage.delete(key)
         raise Exception("Bucket must have versioning enabled")
-    new_version = obj.version_id
+    metrics.incr('cfnplus_objects_uploaded')
+    metrics.incr('cfnplus_bytes_uploaded', size)
 
     # add undoer
+    @tracing.traced('s3: upload_file: undo')
     def undo():
-        obj.delete(VersionId=new_version)
-        obj.wait_until_not_exists(VersionId=new_version)
+        storage.delete(key, new_version)
     undoers.append(undo)
 
     # add committer
     if previous_version is not None:
+        @tracing.traced('s3: upload_file: commit')
         def commit():
-            obj.delete(VersionId=previous_version)
-            obj.wait_until_not_exists(VersionId=previous_version)
+            storage.delete(key, previous_version)
         committers.append(commit)
 
+@tracing.traced('s3: delete_object')
 def delete_object(bucket, key, undoers, committers):
     # If object exists:
     #   Do: insert delete marker for object
@@ -108,39 +110,38 @@ def delete_object(bucket, key, undoers, committers):
     #   Undo: nop
     #   Commit: nop
 
+    storage = storage_mod.as_storage(bucket)
+
     # check if object exists
-    obj = bucket.Object(key)
-    try:
-        obj.reload()
-    except botocore.exceptions.ClientError:
+    info = storage.head(key)
+    if info is None:
         # doesn't exist
         return
-    prev_version = obj.version_id
+    prev_version = info.version_id
     if prev_version is None:
         raise Exception("Bucket must have versioning enabled")
 
     # delete object (this inserts a delete marker version)
-    print("Deleting s3://{}/{}".format(bucket.name, key))
-    resp = obj.delete()
-    delete_marker_version = resp['VersionId']
-    obj.wait_until_not_exists()
+    print("Deleting {}".format(storage.url(key)))
+    delete_marker_version = storage.delete(key)
+    metrics.incr('cfnplus_objects_deleted')
 
     # add undoer
+    @tracing.traced('s3: delete_object: undo')
     def undo():
         # delete the delete marker
-        obj.delete(VersionId=delete_marker_version)
-        obj.wait_until_not_exists(VersionId=delete_marker_version)
+        storage.delete(key, delete_marker_version)
     undoers.append(undo)
 
     # add committer
+    @tracing.traced('s3: delete_object: commit')
     def commit():
         # delete all versions
-        obj.delete(VersionId=prev_version)
-        obj.wait_until_not_exists(VersionId=prev_version)
-        obj.delete(VersionId=delete_marker_version)
-        obj.wait_until_not_exists(VersionId=delete_marker_version)
+        storage.delete(key, prev_version)
+        storage.delete(key, delete_marker_version)
     committers.append(commit)
 
+@tracing.traced('s3: make_dir')
 def make_dir(bucket, key, undoers, committers):
     # If dir does not already exist:
     #   Do: make dir
@@ -152,24 +153,23 @@ def make_dir(bucket, key, undoers, committers):
     #   Undo: nop
     #   Commit: nop
 
+    storage = storage_mod.as_storage(bucket)
+
     # check if dir already exists
-    files = bucket.objects.filter(Prefix=key)
-    if len(list(files)) > 0:
+    for _ in storage.list(key):
         # already exists
         return
 
     # make dir
-    print("Making directory at s3://{}/{}".format(bucket.name, key))
-    obj = bucket.put_object(Key=key)
-    obj.wait_until_exists()
-    if obj.version_id is None:
-        obj.delete()
-        obj.wait_until_not_exists()
+    print("Making directory at {}".format(storage.url(key)))
+    new_version = storage.put(key, b'')
+    if new_version is None:
+        storage.delete(key)
         raise Exception("Bucket must have versioning enabled")
-    new_version = obj.version_id
+    metrics.incr('cfnplus_s3_dirs_made')
 
     # add undoer
+    @tracing.traced('s3: make_dir: undo')
     def undo():
-        obj.delete(VersionId=new_version)
-        obj.wait_until_not_exists(VersionId=new_version)
+        storage.delete(key, new_version)
     undoers.append(undo)
@@ -0,0 +1,141 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+import json
+import datetime
+import collections
+
+# output formats
+FORMAT_YAML = 'yaml'
+FORMAT_JSON = 'json'
+FORMAT_JSON_MINIFIED = 'json-minified'
+OUTPUT_FORMATS = (FORMAT_YAML, FORMAT_JSON, FORMAT_JSON_MINIFIED)
+
+_YamlImpl = collections.namedtuple('_YamlImpl', \
+    ['yaml', 'loader', 'dumper', 'have_libyaml'])
+_yaml_impl = None
+
+def _get_yaml():
+    '''
+    PyYAML is imported the first time it is needed, since importing it is a
+    noticeable part of the time taken to import this package, and JSON
+    templates do not need it.
+
+    :return: A _YamlImpl.
+    '''
+
+    global _yaml_impl # pylint: disable=global-statement
+    if _yaml_impl is not None:
+        return _yaml_impl
+
+    import yaml
+
+    # Use libyaml if PyYAML was built with it; it is many times faster than
+    # the pure-Python implementation.
+    try:
+        from yaml import CSafeLoader as base_loader, \
+            CSafeDumper as base_dumper
+        have_libyaml = True
+    except ImportError:
+        from yaml import SafeLoader as base_loader, SafeDumper as base_dumper
+        have_libyaml = False
+
+    class YamlDumper(base_dumper):
+        def ignore_aliases(self, data): # override
+            return True
+
+    _yaml_impl = _YamlImpl(yaml, base_loader, YamlDumper, have_libyaml)
+    return _yaml_impl
+
+def have_libyaml():
+    '''
+    :return: Whether PyYAML uses libyaml.
+    '''
+
+    return _get_yaml().have_libyaml
+
+def load_template(template_str):
+    '''
+    Parse a CloudFormation template in YAML or JSON.
+
+    YAML anchors are expanded: every alias refers to the same object as its
+    anchor.
+
+    :return: The parsed template.
+    '''
+
+    # JSON is (almost) a subset of YAML, but JSON parsers are much faster than
+    # YAML parsers
+    if template_str.lstrip().startswith('{'):
+        try:
+            return json.loads(template_str)
+        except ValueError:
+            pass
+    impl = _get_yaml()
+    return impl.yaml.load(template_str, Loader=impl.loader)
+
+def dump_yaml(template):
+    '''
+    Serialize a template to YAML.  YAML anchors are not preserved (i.e., every
+    alias is written out in full), since CloudFormation does not support them.
+    '''
+
+    impl = _get_yaml()
+    return impl.yaml.dump(template, Dumper=impl.dumper)
+
+def _json_default(obj):
+    # YAML parsers turn unquoted dates (e.g., "AWSTemplateFormatVersion:
+    # 2010-09-09") into date objects
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    raise TypeError("{} is not JSON serializable".format(repr(obj)))
+
+def dump_template(template, output_format=FORMAT_YAML):
+    '''
+    Serialize a template.
+
+    :param output_format: One of
+        - FORMAT_YAML: block-style YAML (cf. dump_yaml)
+        - FORMAT_JSON: JSON on one line
+        - FORMAT_JSON_MINIFIED: JSON without any optional whitespace; this is
+          the smallest and the fastest to make
+
+    :return: The serialized template, as a string.
+    :throw ValueError: If the output format is unknown.
+    '''
+
+    if output_format == FORMAT_YAML:
+        return dump_yaml(template)
+    elif output_format == FORMAT_JSON:
+        return json.dumps(template, default=_json_default)
+    elif output_format == FORMAT_JSON_MINIFIED:
+        return json.dumps(template, default=_json_default, \
+            separators=(',', ':'))
+    else:
+        raise ValueError("Unknown output format: {}".format(output_format))
@@ -0,0 +1,310 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+# pylint: disable=protected-access
+
+'''
+A long-running worker that processes templates for other processes (cf.
+client), which talk to it over a Unix socket.
+
+A process that calls process_template once and then exits pays, every time,
+for starting Python, importing boto3, making AWS clients, and filling caches.
+A worker pays for these only once: it keeps its AWS clients, its processing
+cache (including the digests of local files), and its thread pools for as
+long as it runs.  Start one with:
+
+    cfnplus serve --socket /path/to/cfnplus.sock
+
+Protocol: each request and each response is a JSON object on one line, and a
+connection can carry any number of requests, which are handled in order.
+The requests are:
+
+    {"op": "ping"}
+    {"op": "process", "jobs": [...], "output_format": ...}
+    {"op": "do_before_creation", "id": ...}
+    {"op": "do_after_creation", "id": ...}
+    {"op": "finish", "id": ..., "success": ...}
+    {"op": "shutdown"}
+
+"jobs" is as for process_templates.  The response to "process" contains a
+list "results", each of which has the ID of the result and its new template.
+Every response has "ok"; if it is false, the response also has "error",
+with the "type" and "message" of the exception.
+
+Actions are done by the worker, so the worker keeps each result until it is
+finished, which commits or undoes its actions as at the end of the "with"
+statement in which a result is used.  Results not finished when their
+connection is closed are undone.
+'''
+
+import os
+import json
+import socket
+import threading
+import itertools
+import time
+try:
+    import socketserver
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+from . import utils, serialization, _SharedState, _process_templates
+
+SOCKET_ENV_VAR = 'CFNPLUS_SOCKET'
+
+# seconds for which a worker reuses the lists of CloudFormation exports, by
+# default (cf. serve)
+DEFAULT_EXPORTS_TTL = 60
+
+def default_socket_path():
+    '''
+    :return: The path given by the CFNPLUS_SOCKET environment variable, or
+    else "worker.sock" in CloudFormation Plus's local cache (cf.
+    utils.cache_dir).
+    '''
+
+    path = os.environ.get(SOCKET_ENV_VAR)
+    if path:
+        return path
+    return os.path.join(utils.cache_dir(), 'worker.sock')
+
+def _describe_action(action):
+    if isinstance(action, utils.Action):
+        return action.describe()
+    return {'kind': repr(action)}
+
+class Worker(object):
+    '''
+    Handles requests.  A worker can be used by several threads at once.
+    '''
+
+    def __init__(self, cache_dir=None, max_workers=8, hash_processes=0, \
+        exports_ttl=None):
+        self._state = _SharedState(cache_dir, max_workers, hash_processes, \
+            exports_ttl)
+        self._lock = threading.Lock()
+        self._results = {} # ID -> utils.Result
+        self._ids = itertools.count(1)
+        self.started = time.time()
+        self.nbr_requests = 0
+
+    def handle(self, request, owned_ids):
+        '''
+        :param request: A request, parsed.
+        :param owned_ids: A set of the IDs of the results made on the
+        connection that the request came from; this is updated.
+
+        :return: The response.
+        '''
+
+        with self._lock:
+            self.nbr_requests += 1
+
+        try:
+            op = request.get('op')
+            if op == 'ping':
+                return {'ok': True, 'pid': os.getpid(), \
+                    'uptime': time.time() - self.started, \
+                    'requests': self.nbr_requests}
+            elif op == 'process':
+                return {'ok': True, 'results': self._process(request, \
+                    owned_ids)}
+            elif op == 'do_before_creation':
+                self._get_result(request).do_before_creation()
+                return {'ok': True}
+            elif op == 'do_after_creation':
+                self._get_result(request).do_after_creation()
+                return {'ok': True}
+            elif op == 'finish':
+                self.finish(request.get('id'), request.get('success', True))
+                owned_ids.discard(request.get('id'))
+                return {'ok': True}
+            elif op == 'shutdown':
+                return {'ok': True}
+            else:
+                raise ValueError("Unknown op: {}".format(op))
+        except Exception as e:
+            return {'ok': False, 'error': {'type': type(e).__name__, \
+                'message': str(e)}}
+
+    def _process(self, request, owned_ids):
+        output_format = request.get('output_format', \
+            serialization.FORMAT_YAML)
+        results = _process_templates(request['jobs'], output_format, \
+            self._state)
+
+        descs = []
+        with self._lock:
+            for result in results:
+                result_id = next(self._ids)
+                self._results[result_id] = result
+                owned_ids.add(result_id)
+                descs.append({
+                    'id': result_id,
+                    'new_template': result.new_template,
+                    'before_creation': [_describe_action(a) \
+                        for a in result.before_creation],
+                    'after_creation': [_describe_action(a) \
+                        for a in result.after_creation],
+                })
+        return descs
+
+    def _get_result(self, request):
+        with self._lock:
+            try:
+                return self._results[request.get('id')]
+            except KeyError:
+                raise ValueError("No result with ID {}".format(\
+                    request.get('id')))
+
+    def finish(self, result_id, success):
+        '''
+        Commit (if success is True) or undo the actions of a result, and then
+        forget it.
+        '''
+
+        with self._lock:
+            try:
+                result = self._results.pop(result_id)
+            except KeyError:
+                raise ValueError("No result with ID {}".format(result_id))
+        if success:
+            result.__exit__(None, None, None)
+        else:
+            exc = Exception("Client did not finish")
+            result.__exit__(type(exc), exc, None)
+
+    def close(self):
+        self._state.shutdown()
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        worker = self.server.worker
+        owned_ids = set([])
+        try:
+            while True:
+                line = self.rfile.readline()
+                if len(line) == 0:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError as e:
+                    request = {}
+                    response = {'ok': False, 'error': {'type': 'ValueError', \
+                        'message': "Invalid request: {}".format(e)}}
+                else:
+                    response = worker.handle(request, owned_ids)
+                self.wfile.write((json.dumps(response) + '\n').\
+                    encode('utf-8'))
+                self.wfile.flush()
+                if request.get('op') == 'shutdown':
+                    # shutdown waits for this handler's thread, so it can't be
+                    # called from it
+                    threading.Thread(target=self.server.shutdown).start()
+                    break
+        finally:
+            for result_id in owned_ids:
+                try:
+                    worker.finish(result_id, False)
+                except:
+                    pass
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    Serves a worker's requests on a Unix socket.  Each connection is handled
+    in its own thread.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, worker):
+        # remove the socket left by a worker that has exited, but not that of
+        # a worker that is still running
+        if os.path.exists(socket_path):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(socket_path)
+            except socket.error:
+                os.remove(socket_path)
+            else:
+                raise ValueError("A worker is already serving on {}".\
+                    format(socket_path))
+            finally:
+                sock.close()
+
+        socketserver.UnixStreamServer.__init__(self, socket_path, _Handler)
+        self.socket_path = socket_path
+        self.worker = worker
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+        self.worker.close()
+
+def serve(socket_path=None, cache_dir=None, max_workers=8, hash_processes=0, \
+    exports_ttl=DEFAULT_EXPORTS_TTL):
+    '''
+    Run a worker until it gets a "shutdown" request.
+
+    The worker makes all AWS calls (e.g., listing exports and doing the
+    actions' S3 operations) with its own credentials and region settings ---
+    i.e., those in its environment when it was started --- not the
+    clients'.  Clients that need other credentials must use another worker.
+
+    :param socket_path: (Optional) The path of the Unix socket on which to
+    listen (cf. default_socket_path).
+    :param cache_dir: (Optional) Cf. process_template.  By default,
+    CloudFormation Plus's local cache directory (cf. utils.cache_dir) is
+    used.
+    :param max_workers: Cf. process_templates.
+    :param hash_processes: Cf. process_template.
+    :param exports_ttl: Cf. process_template.  The worker also keeps the
+    index of CloudFormation exports in memory, so that requests made within
+    this many seconds of each other do not list the exports again.  With 0,
+    every request lists them again; with None, the exports are not kept in
+    the local cache either.  Default: DEFAULT_EXPORTS_TTL
+    '''
+
+    if socket_path is None:
+        socket_path = default_socket_path()
+    if cache_dir is None:
+        cache_dir = utils.cache_dir()
+
+    # keep AWS clients for as long as the worker runs
+    utils.reuse_aws_clients()
+
+    server = Server(socket_path, Worker(cache_dir, max_workers, \
+        hash_processes, exports_ttl))
+    print("Serving on {}".format(socket_path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
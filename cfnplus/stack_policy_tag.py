@@ -28,9 +28,20 @@
 
 import collections
 import json
-import boto3
 from . import utils
 
+def _describe_set_policy(aws_region, stack_name, **_):
+    return {'region': aws_region, 'stack': stack_name}
+
+@utils.action_func('SetStackPolicy', describe=_describe_set_policy)
+def _set_policy(undoers, committers, aws_region, stack_name, policy_body):
+    cfn = utils.aws_client('cloudformation', aws_region)
+    print("Setting policy for stack {}".format(stack_name))
+    cfn.set_stack_policy(
+        StackName=stack_name,
+        StackPolicyBody=policy_body,
+    )
+
 def evaluate(arg_node, ctx):
     '''
     :return: Instance of Result.
@@ -44,11 +55,7 @@ def evaluate(arg_node, ctx):
         raise utils.InvalidTemplate("{}: stack name is unknown".\
             format(tag_name))
 
-    def set_policy_action(undoers, committers):
-        cfn = boto3.client('cloudformation', region_name=ctx.aws_region)
-        print("Setting policy for stack {}".format(ctx.stack_name))
-        cfn.set_stack_policy(
-            StackName=ctx.stack_name,
-            StackPolicyBody=json.dumps(arg_node),
-        )
+    set_policy_action = utils.Action('SetStackPolicy', \
+        aws_region=ctx.aws_region, stack_name=ctx.stack_name, \
+        policy_body=json.dumps(arg_node))
     return utils.Result(after_creation=[set_policy_action])
@@ -30,8 +30,20 @@ import collections
 import hashlib
 import json
 import io
-import boto3
-from . import utils, eval_cfn_expr, s3_ops
+from . import utils, eval_cfn_expr, s3_ops, tracing, storage
+
+def _describe_template_upload(aws_region, bucket_name, key, **_):
+    # the key ends with the template's digest
+    return utils.describe_s3_action(aws_region, bucket_name, key, \
+        digest=key.rsplit('/', 1)[-1])
+
+@utils.action_func('TemplateUpload', describe=_describe_template_upload)
+def _upload_template(undoers, committers, aws_region, bucket_name, key, body):
+    buf = io.BytesIO()
+    buf.write(body.encode('utf-8'))
+    buf.seek(0)
+    bucket = storage.get_storage(bucket_name, aws_region)
+    s3_ops.upload_file(buf, bucket, key, undoers, committers)
 
 def evaluate(resource, ctx):
     '''
@@ -91,31 +103,21 @@ def evaluate(resource, ctx):
     template_abs_path = ctx.abspath(local_path)
     with open(template_abs_path) as f:
         imported_template_str = f.read()
+    ctx.add_input('file', template_abs_path)
     new_ctx.template_is_imported = True
     new_ctx.template_path = template_abs_path
     new_ctx.stack_name = None
-    new_template_str = ctx.proc_result_cache_get(imported_template_str, new_ctx)
-    if new_template_str is None:
-        result = ctx.process_template_func(imported_template_str, new_ctx)
-
-        # add to cache
-        ctx.proc_result_cache_put(imported_template_str, new_ctx, \
-            result.new_template)
-    else:
-        result = utils.Result(new_template=new_template_str)
+    with tracing.span('Aruba::Stack', resource=ctx.resource_name, \
+        template_path=template_abs_path):
+        result = ctx.process_template_cached(imported_template_str, new_ctx)
 
     # make S3 key
     h = hashlib.new(utils.FILE_HASH_ALG)
     h.update(result.new_template.encode('utf-8'))
     s3_key = '{}/{}'.format(s3_dir_key, h.hexdigest())
 
-    def upload_action(undoers, committers):
-        buf = io.BytesIO()
-        buf.write(result.new_template.encode('utf-8'))
-        buf.seek(0)
-        bucket = boto3.resource('s3', region_name=ctx.aws_region).\
-            Bucket(s3_bucket)
-        s3_ops.upload_file(buf, bucket, s3_key, undoers, committers)
+    upload_action = utils.Action('TemplateUpload', aws_region=ctx.aws_region, \
+        bucket_name=s3_bucket, key=s3_key, body=result.new_template)
 
     # make 'AWS::CloudFormation::Stack' resource
     s3_dest_uri = 'https://s3-{region}.amazonaws.com/{bucket}/{key}'\
@@ -0,0 +1,461 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Storage for artifacts (Lambda packages, templates, files) that actions put
+in S3.
+
+A Storage object is one versioned bucket.  S3Storage is backed by S3;
+LocalStorage and MemoryStorage keep versions on the local filesystem and in
+memory, so that actions --- including undoing and committing --- can be done
+without AWS (e.g., in CI or in benchmarks).
+
+Actions get their Storage objects from get_storage, which uses the backend
+set with set_backend, or else the one named by the CFNPLUS_STORAGE
+environment variable: "s3" (the default), "memory", or "local:<dir>".
+'''
+
+import os
+import io
+import json
+import uuid
+import threading
+try:
+    from urllib import quote, unquote
+except ImportError:
+    # Python 3
+    from urllib.parse import quote, unquote
+from . import utils
+
+STORAGE_ENV_VAR = 'CFNPLUS_STORAGE'
+
+class ObjectInfo(object):
+    def __init__(self, version_id, metadata):
+        self.version_id = version_id
+        self.metadata = metadata
+
+class Storage(object):
+    '''
+    Interface of versioned buckets.
+    '''
+
+    name = None
+
+    def url(self, key):
+        return 's3://{}/{}'.format(self.name, key)
+
+    def exists(self):
+        '''
+        :return: True if the bucket exists.
+        '''
+
+        raise NotImplementedError()
+
+    def head(self, key):
+        '''
+        :return: An ObjectInfo for the latest version of the object with the
+        given key, or None if there is no such object (or its latest version
+        is a delete marker).
+        '''
+
+        raise NotImplementedError()
+
+    def put(self, key, body, metadata=None):
+        '''
+        Add a new version of an object.
+
+        :param body: A bytestring or a binary file-like object.
+
+        :return: The new version's ID, or None if the bucket is not versioned.
+        '''
+
+        raise NotImplementedError()
+
+    def delete(self, key, version_id=None):
+        '''
+        Delete one version of an object, or, if version_id is None, add a
+        delete marker.
+
+        :return: The ID of the deleted version or of the delete marker.
+        '''
+
+        raise NotImplementedError()
+
+    def list(self, prefix=''):
+        '''
+        :return: An iterable of the keys, beginning with the given prefix, of
+        the objects whose latest versions are not delete markers.
+        '''
+
+        raise NotImplementedError()
+
+    def copy(self, src_key, dest_key):
+        '''
+        Add a new version of an object whose contents and metadata are those
+        of the latest version of another object.
+
+        :return: The new version's ID.
+        '''
+
+        raise NotImplementedError()
+
+class S3Storage(Storage):
+    def __init__(self, bucket, aws_region=None):
+        '''
+        :param bucket: A boto3 Bucket resource.
+        :param aws_region: The bucket's region (by default, that of the
+        resource's client).
+        '''
+
+        self.bucket = bucket
+        self.name = bucket.name
+        self._aws_region = aws_region
+
+    def exists(self):
+        aws_region = self._aws_region
+        if aws_region is None:
+            aws_region = self.bucket.meta.client.meta.region_name
+        return utils.bucket_exists(self.name, aws_region)
+
+    def head(self, key):
+        import botocore.exceptions
+
+        obj = self.bucket.Object(key)
+        try:
+            return ObjectInfo(obj.version_id, obj.metadata)
+        except botocore.exceptions.ClientError:
+            return None
+
+    def put(self, key, body, metadata=None):
+        obj = self.bucket.put_object(Body=body, Key=key, \
+            Metadata=metadata or {})
+        obj.wait_until_exists()
+        return obj.version_id
+
+    def delete(self, key, version_id=None):
+        obj = self.bucket.Object(key)
+        if version_id is None:
+            resp = obj.delete()
+            obj.wait_until_not_exists()
+            return resp.get('VersionId')
+        obj.delete(VersionId=version_id)
+        obj.wait_until_not_exists(VersionId=version_id)
+        return version_id
+
+    def list(self, prefix=''):
+        return (obj.key for obj in self.bucket.objects.filter(Prefix=prefix))
+
+    def copy(self, src_key, dest_key):
+        resp = self.bucket.Object(dest_key).copy_from(\
+            CopySource={'Bucket': self.name, 'Key': src_key})
+        return resp.get('VersionId')
+
+class _Version(object):
+    def __init__(self, version_id, metadata, is_delete_marker=False):
+        self.version_id = version_id
+        self.metadata = metadata
+        self.is_delete_marker = is_delete_marker
+
+    def to_dict(self):
+        return {
+            'version_id': self.version_id,
+            'metadata': self.metadata,
+            'is_delete_marker': self.is_delete_marker,
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return _Version(d['version_id'], d['metadata'], d['is_delete_marker'])
+
+class _VersionedStorage(Storage):
+    '''
+    Base class for storages that keep versions themselves.  Subclasses store
+    each object's version list and each version's contents.
+    '''
+
+    def __init__(self, name, lock):
+        self.name = name
+        self._lock = lock
+
+    def _versions(self, key):
+        raise NotImplementedError()
+
+    def _set_versions(self, key, versions):
+        raise NotImplementedError()
+
+    def _read(self, key, version_id):
+        raise NotImplementedError()
+
+    def _write(self, key, version_id, data):
+        raise NotImplementedError()
+
+    def _remove(self, key, version_id):
+        raise NotImplementedError()
+
+    def _keys(self):
+        raise NotImplementedError()
+
+    def head(self, key):
+        with self._lock:
+            versions = self._versions(key)
+        if len(versions) == 0 or versions[-1].is_delete_marker:
+            return None
+        return ObjectInfo(versions[-1].version_id, \
+            dict(versions[-1].metadata))
+
+    def put(self, key, body, metadata=None):
+        data = body if isinstance(body, bytes) else body.read()
+        version = _Version(uuid.uuid4().hex, dict(metadata or {}))
+        with self._lock:
+            self._write(key, version.version_id, data)
+            self._set_versions(key, self._versions(key) + [version])
+        return version.version_id
+
+    def delete(self, key, version_id=None):
+        with self._lock:
+            versions = self._versions(key)
+            if version_id is None:
+                version = _Version(uuid.uuid4().hex, {}, True)
+                self._set_versions(key, versions + [version])
+                return version.version_id
+            for version in versions:
+                if version.version_id == version_id:
+                    if not version.is_delete_marker:
+                        self._remove(key, version_id)
+                    break
+            self._set_versions(key, [v for v in versions \
+                if v.version_id != version_id])
+            return version_id
+
+    def list(self, prefix=''):
+        with self._lock:
+            keys = sorted(k for k in self._keys() if k.startswith(prefix))
+            return [k for k in keys if len(self._versions(k)) > 0 and \
+                not self._versions(k)[-1].is_delete_marker]
+
+    def copy(self, src_key, dest_key):
+        with self._lock:
+            versions = self._versions(src_key)
+            if len(versions) == 0 or versions[-1].is_delete_marker:
+                raise KeyError(src_key)
+            data = self._read(src_key, versions[-1].version_id)
+            metadata = versions[-1].metadata
+        return self.put(dest_key, data, metadata)
+
+    def get(self, key, version_id=None):
+        '''
+        :return: The contents of a version of an object (the latest version if
+        version_id is None), as a bytestring.
+        '''
+
+        with self._lock:
+            versions = self._versions(key)
+            if version_id is None:
+                if len(versions) == 0 or versions[-1].is_delete_marker:
+                    raise KeyError(key)
+                version_id = versions[-1].version_id
+            elif not any(v.version_id == version_id and \
+                not v.is_delete_marker for v in versions):
+                raise KeyError((key, version_id))
+            return self._read(key, version_id)
+
+class MemoryStorage(_VersionedStorage):
+    def __init__(self, name, lock=None):
+        super(MemoryStorage, self).__init__(name, lock or threading.Lock())
+        self._objects = {} # key -> list of _Version
+        self._data = {} # (key, version ID) -> bytestring
+
+    def exists(self):
+        return True
+
+    def _versions(self, key):
+        return list(self._objects.get(key, []))
+
+    def _set_versions(self, key, versions):
+        self._objects[key] = versions
+
+    def _read(self, key, version_id):
+        return self._data[(key, version_id)]
+
+    def _write(self, key, version_id, data):
+        self._data[(key, version_id)] = data
+
+    def _remove(self, key, version_id):
+        del self._data[(key, version_id)]
+
+    def _keys(self):
+        return list(self._objects.keys())
+
+class LocalStorage(_VersionedStorage):
+    '''
+    Keeps each object in a directory named after the (quoted) key, containing
+    one file per version and a "versions.json" file listing the versions,
+    oldest first.
+    '''
+
+    def __init__(self, name, root, lock=None):
+        super(LocalStorage, self).__init__(name, lock or threading.Lock())
+        self._dir = os.path.join(root, name)
+
+    def exists(self):
+        return os.path.isdir(self._dir)
+
+    def _obj_dir(self, key):
+        return os.path.join(self._dir, quote(key, safe=''))
+
+    def _versions(self, key):
+        path = os.path.join(self._obj_dir(key), 'versions.json')
+        try:
+            with io.open(path, 'r', encoding='utf-8') as f:
+                return [_Version.from_dict(d) for d in json.load(f)]
+        except (IOError, OSError):
+            return []
+
+    def _set_versions(self, key, versions):
+        obj_dir = self._obj_dir(key)
+        if not os.path.isdir(obj_dir):
+            os.makedirs(obj_dir)
+        path = os.path.join(obj_dir, 'versions.json')
+        tmp_path = path + '.tmp'
+        with io.open(tmp_path, 'wb') as f:
+            f.write(json.dumps([v.to_dict() for v in versions]).\
+                encode('utf-8'))
+        os.rename(tmp_path, path)
+
+    def _read(self, key, version_id):
+        with io.open(os.path.join(self._obj_dir(key), version_id), 'rb') as f:
+            return f.read()
+
+    def _write(self, key, version_id, data):
+        obj_dir = self._obj_dir(key)
+        if not os.path.isdir(obj_dir):
+            os.makedirs(obj_dir)
+        with io.open(os.path.join(obj_dir, version_id), 'wb') as f:
+            f.write(data)
+
+    def _remove(self, key, version_id):
+        os.remove(os.path.join(self._obj_dir(key), version_id))
+
+    def _keys(self):
+        if not os.path.isdir(self._dir):
+            return []
+        return [unquote(fn) for fn in os.listdir(self._dir)]
+
+class S3Backend(object):
+    def __call__(self, bucket_name, aws_region):
+        return S3Storage(utils.aws_resource('s3', aws_region).\
+            Bucket(bucket_name), aws_region)
+
+class MemoryBackend(object):
+    '''
+    Keeps buckets in memory.  Buckets exist as soon as they are used.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = {}
+
+    def __call__(self, bucket_name, aws_region):
+        with self._lock:
+            try:
+                return self.buckets[bucket_name]
+            except KeyError:
+                storage = MemoryStorage(bucket_name)
+                self.buckets[bucket_name] = storage
+                return storage
+
+class LocalBackend(object):
+    '''
+    Keeps buckets in subdirectories of a local directory.  If create_buckets
+    is False, only buckets whose directories exist already exist.
+    '''
+
+    def __init__(self, root, create_buckets=True):
+        self.root = root
+        self.create_buckets = create_buckets
+        self._lock = threading.Lock()
+
+    def __call__(self, bucket_name, aws_region):
+        storage = LocalStorage(bucket_name, self.root, self._lock)
+        if self.create_buckets and not storage.exists():
+            try:
+                os.makedirs(os.path.join(self.root, bucket_name))
+            except OSError:
+                pass
+        return storage
+
+_backend_lock = threading.Lock()
+_backend = None
+
+def _backend_from_env():
+    spec = os.environ.get(STORAGE_ENV_VAR, 's3')
+    if spec == 's3':
+        return S3Backend()
+    if spec == 'memory':
+        return MemoryBackend()
+    if spec.startswith('local:'):
+        return LocalBackend(spec[len('local:'):])
+    raise ValueError("Invalid value for {}: '{}'".format(STORAGE_ENV_VAR, \
+        spec))
+
+def set_backend(backend):
+    '''
+    Set the backend used by get_storage.
+
+    :param backend: A function that takes a bucket name and an AWS region and
+    returns a Storage object (e.g., an instance of S3Backend, MemoryBackend,
+    or LocalBackend), or None to use the one given by the CFNPLUS_STORAGE
+    environment variable.
+    '''
+
+    global _backend # pylint: disable=global-statement
+    with _backend_lock:
+        _backend = backend
+
+def get_storage(bucket_name, aws_region):
+    '''
+    :return: A Storage object for the given bucket.
+    '''
+
+    global _backend # pylint: disable=global-statement
+    with _backend_lock:
+        if _backend is None:
+            _backend = _backend_from_env()
+        backend = _backend
+    return backend(bucket_name, aws_region)
+
+def as_storage(bucket):
+    '''
+    :return: The given object if it is a Storage object, or else an
+    S3Storage object for it (which must be a boto3 Bucket resource).
+    '''
+
+    if isinstance(bucket, Storage):
+        return bucket
+    return S3Storage(bucket)
@@ -0,0 +1,201 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-many-locals
+# pylint: disable=unused-argument
+
+
+'''
+Tracing of template processing and of actions.
+
+Tracing is off unless a Tracer is active.  A tracer becomes active in the
+current thread when it is used in a "with" statement --- e.g.:
+
+    with cfnplus.tracing.Tracer() as tracer:
+        with cfnplus.process_template(...) as result:
+            result.do_before_creation()
+            ...
+            result.do_after_creation()
+    tracer.write_chrome_trace('trace.json')
+
+Spans record how long each part of the work took, and which part it was done
+for.  Work handed to other threads is traced if it is wrapped with wrap.
+'''
+
+import os
+import json
+import time
+import threading
+import itertools
+import contextlib
+import functools
+import cProfile
+
+_local = threading.local()
+
+def _current():
+    # :return: (active tracer or None, ID of the current span or None)
+    return getattr(_local, 'state', (None, None))
+
+class Span(object):
+    def __init__(self, span_id, parent_id, name, args, start, thread_id):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.args = args
+        self.start = start
+        self.end = None
+        self.thread_id = thread_id
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+class Tracer(object):
+    '''
+    Collects spans.  If profile is True, a cProfile profile is also made of
+    the thread in which the tracer is active (but not of other threads).
+    '''
+
+    def __init__(self, profile=False):
+        self.spans = []
+        self.profile = cProfile.Profile() if profile else None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._start = time.time()
+        self._prev_state = None
+
+    def __enter__(self):
+        self._prev_state = _current()
+        _local.state = (self, None)
+        if self.profile is not None:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.profile is not None:
+            self.profile.disable()
+        _local.state = self._prev_state
+
+    def _start_span(self, parent_id, name, args):
+        with self._lock:
+            span = Span(next(self._ids), parent_id, name, args, time.time(), \
+                threading.current_thread().ident)
+            self.spans.append(span)
+        return span
+
+    def to_chrome_trace(self):
+        '''
+        :return: The spans as a dict in Chrome's trace event format, which can
+        be viewed with chrome://tracing or https://ui.perfetto.dev.
+        '''
+
+        events = []
+        with self._lock:
+            spans = [s for s in self.spans if s.end is not None]
+        for span in spans:
+            args = dict(span.args)
+            args['span_id'] = span.span_id
+            if span.parent_id is not None:
+                args['parent_id'] = span.parent_id
+            events.append({
+                'name': span.name,
+                'ph': 'X',
+                'ts': int((span.start - self._start) * 1e6),
+                'dur': int(span.duration * 1e6),
+                'pid': os.getpid(),
+                'tid': span.thread_id,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def write_profile(self, path):
+        '''
+        Write the profile in the format used by the pstats module.
+        '''
+
+        if self.profile is None:
+            raise ValueError("Tracer was not made with profile=True")
+        self.profile.dump_stats(path)
+
+@contextlib.contextmanager
+def span(name, **args):
+    '''
+    Trace the body of a "with" statement as a span with the given name.
+    Keyword arguments are recorded with the span.  Does nothing if no tracer
+    is active.
+    '''
+
+    tracer, parent_id = _current()
+    if tracer is None:
+        yield
+        return
+
+    s = tracer._start_span(parent_id, name, args) # pylint: disable=protected-access
+    _local.state = (tracer, s.span_id)
+    try:
+        yield
+    finally:
+        s.end = time.time()
+        _local.state = (tracer, parent_id)
+
+def traced(name):
+    '''
+    Decorator that traces each call of a function as a span with the given
+    name.
+    '''
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def wrap(func):
+    '''
+    :return: A function that calls the given one with the current thread's
+    tracer and span active, so that spans made by the function --- e.g., in
+    another thread --- are children of the current span.
+    '''
+
+    state = _current()
+    if state[0] is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        prev_state = _current()
+        _local.state = state
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.state = prev_state
+    return wrapper
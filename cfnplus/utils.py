@@ -30,14 +30,20 @@
 
 import os
 import json
+import contextlib
 import io
+import threading
+import time
+import tempfile
+import hashlib
+import collections
+import importlib
 try:
     from urlparse import urlparse
 except ImportError:
     # Python 3
     from urllib.parse import urlparse
-import boto3
-import botocore
+from . import tracing, metrics, api_stats
 
 try:
     base_str = basestring
@@ -56,11 +62,55 @@ else:
 
 FILE_HASH_ALG = 'sha1'
 
+CACHE_DIR_ENV_VAR = 'CFNPLUS_CACHE_DIR'
+
+# boto3's default session is not safe to use from several threads at once
+_BOTO3_LOCK = threading.Lock()
+
+# When reuse is enabled (cf. reuse_aws_clients), clients are shared by all
+# threads, since they are thread-safe, but resources are kept per thread,
+# since they are not.
+_reused_clients = None # (service name, region) -> client
+_reuse_generation = 0 # incremented each time reuse is enabled or disabled
+_reused_resources = threading.local()
+
 class InvalidTemplate(Exception):
     pass
 
+# the memo of bucket checks active in each thread (cf. sharing_bucket_checks)
+_bucket_checks = threading.local()
+
+@contextlib.contextmanager
+def sharing_bucket_checks(memo):
+    '''
+    Remember in the given Memo whether buckets exist (cf. bucket_exists), in
+    this thread, for the body of a "with" statement.
+    '''
+
+    prev = getattr(_bucket_checks, 'memo', None)
+    _bucket_checks.memo = memo
+    try:
+        yield memo
+    finally:
+        _bucket_checks.memo = prev
+
 def bucket_exists(bucket_name, aws_region):
-    s3 = boto3.client('s3', region_name=aws_region)
+    '''
+    :return: Whether the given S3 bucket exists.  If a memo of bucket checks
+    is active in this thread (cf. sharing_bucket_checks), each bucket is
+    checked only once.
+    '''
+
+    memo = getattr(_bucket_checks, 'memo', None)
+    if memo is None:
+        return _head_bucket(bucket_name, aws_region)
+    return memo.get(('BucketExists', aws_region, bucket_name), \
+        lambda: _head_bucket(bucket_name, aws_region))
+
+def _head_bucket(bucket_name, aws_region):
+    import botocore.exceptions
+
+    s3 = aws_client('s3', aws_region)
     try:
         s3.head_bucket(Bucket=bucket_name)
     except botocore.exceptions.ClientError as e:
@@ -73,6 +123,78 @@ def bucket_exists(bucket_name, aws_region):
             raise e
     return True
 
+def aws_client(service_name, aws_region):
+    '''
+    :return: A boto3 client.  The API calls it makes are counted in the
+    metrics that are active in the calling thread (cf. metrics.active), and
+    in the active ApiStats objects (cf. api_stats).
+    '''
+
+    # boto3 is imported here rather than at the top of the module since
+    # importing it is slow, and it is not needed when templates are processed
+    # without doing any AWS API calls
+    import boto3
+
+    key = (service_name, aws_region)
+    with _BOTO3_LOCK:
+        if _reused_clients is not None and key in _reused_clients:
+            return _reused_clients[key]
+        client = boto3.client(service_name, region_name=aws_region)
+        if _reused_clients is not None:
+            _reused_clients[key] = client
+    _instrument_client(client)
+    return client
+
+def aws_resource(service_name, aws_region):
+    '''
+    :return: A boto3 service resource, whose API calls are counted like those
+    of clients made by aws_client.
+    '''
+
+    import boto3
+
+    key = (service_name, aws_region)
+    with _BOTO3_LOCK:
+        reuse = _reused_clients is not None
+        generation = _reuse_generation
+    resources = None
+    if reuse:
+        if getattr(_reused_resources, 'generation', None) != generation:
+            _reused_resources.generation = generation
+            _reused_resources.resources = {}
+        resources = _reused_resources.resources
+        if key in resources:
+            return resources[key]
+
+    with _BOTO3_LOCK:
+        resource = boto3.resource(service_name, region_name=aws_region)
+    _instrument_client(resource.meta.client)
+    if resources is not None:
+        resources[key] = resource
+    return resource
+
+def reuse_aws_clients(enabled=True):
+    '''
+    Make aws_client and aws_resource return the same object each time they
+    are called with the same arguments (in the same thread, for resources),
+    rather than making a new one.  This is meant for long-running processes
+    (cf. server), where making clients is a noticeable part of the time taken
+    to process a template.
+    '''
+
+    global _reused_clients, _reuse_generation # pylint: disable=global-statement
+    with _BOTO3_LOCK:
+        _reused_clients = {} if enabled else None
+        _reuse_generation += 1
+
+def _instrument_client(client):
+    client.meta.events.register('before-parameter-build', _count_api_call)
+    api_stats.instrument_client(client)
+
+def _count_api_call(model, **kwargs):
+    metrics.incr('cfnplus_api_calls', \
+        service=model.service_model.service_name, operation=model.name)
+
 def parse_s3_uri(uri):
     '''
     :return: A pair (bucket, key)
@@ -87,6 +209,57 @@ def parse_s3_uri(uri):
         key = key[1:]
     return (bucket, key)
 
+def cache_dir(*parts):
+    '''
+    :return: The absolute path of a directory in CloudFormation Plus's local
+    cache, made if it does not exist yet.  The cache's root is given by the
+    CFNPLUS_CACHE_DIR environment variable, and is ~/.cache/cfnplus by default.
+    '''
+
+    root = os.environ.get(CACHE_DIR_ENV_VAR)
+    if not root:
+        root = os.path.join(os.path.expanduser('~'), '.cache', 'cfnplus')
+    path = os.path.join(root, *parts)
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    return path
+
+def parse_s3_url(url):
+    '''
+    Parse an HTTPS URL for an S3 object, in either path style
+    ("https://s3-REGION.amazonaws.com/BUCKET/KEY") or virtual-hosted style
+    ("https://BUCKET.s3.REGION.amazonaws.com/KEY").
+
+    :return: A pair (bucket, key)
+    '''
+
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    path = parsed.path.lstrip('/')
+    if parsed.scheme not in ('https', 'http') or \
+        not host.endswith('.amazonaws.com'):
+        raise InvalidTemplate("Invalid S3 URL: '{}'".format(url))
+
+    # find the "s3" or "s3-REGION" label; anything before it is the bucket
+    labels = host[:-len('.amazonaws.com')].split('.')
+    s3_idx = [i for i, l in enumerate(labels) \
+        if l == 's3' or l.startswith('s3-')]
+    if len(s3_idx) == 0:
+        raise InvalidTemplate("Invalid S3 URL: '{}'".format(url))
+    if s3_idx[-1] == 0:
+        # path style
+        bucket, _, key = path.partition('/')
+    else:
+        # virtual-hosted style
+        bucket = '.'.join(labels[:s3_idx[-1]])
+        key = path
+    if len(bucket) == 0 or len(key) == 0:
+        raise InvalidTemplate("Invalid S3 URL: '{}'".format(url))
+    return (bucket, key)
+
 def dict_only_item(d):
     try:
         # Python 2
@@ -96,33 +269,563 @@ def dict_only_item(d):
         key = next(iter(d.keys()))
     return key, d[key]
 
+_ACTION_FUNCS = {} # kind -> function
+_ACTION_DESCRIBERS = {} # kind -> function
+
+# kind -> module that defines it; modules are imported only when needed, so
+# actions remade from cached results (cf. proc_cache) can be used even if no
+# template has used the modules yet
+_ACTION_MODULES = {
+    'S3Mkdir': 'action_tags',
+    'S3Sync': 'action_tags',
+    'S3Upload': 'action_tags',
+    'TemplateUpload': 'stack_resource',
+    'LambdaCodeUpload': 'lambda_code_tag',
+    'SetStackPolicy': 'stack_policy_tag',
+}
+
+def _load_action_kind(kind):
+    if kind not in _ACTION_FUNCS and kind in _ACTION_MODULES:
+        importlib.import_module('.' + _ACTION_MODULES[kind], __package__)
+
+def action_func(kind, describe=None):
+    '''
+    Decorator for functions that perform actions of the given kind (cf.
+    Action).  The function must take the arguments "undoers" and "committers",
+    followed by the action's arguments as keyword arguments.
+
+    :param describe: (Optional) A function that takes an action's arguments as
+    keyword arguments and returns the rest of its description (cf.
+    Action.describe).
+    '''
+
+    def decorator(func):
+        _ACTION_FUNCS[kind] = func
+        if describe is not None:
+            _ACTION_DESCRIBERS[kind] = describe
+        return func
+    return decorator
+
+class Action(object):
+    '''
+    An action that should be done before or after a stack is made or updated.
+
+    Like a plain action function, an instance of this class is called with
+    lists of undoers and committers.  Unlike a function, it is described
+    entirely by its kind and its arguments, which must be JSON-serializable,
+    so it can be saved and remade later (cf. proc_cache).
+    '''
+
+    def __init__(self, kind, **args):
+        self.kind = kind
+        self.args = args
+
+    def __call__(self, undoers, committers):
+        _load_action_kind(self.kind)
+        with tracing.span(self.kind):
+            _ACTION_FUNCS[self.kind](undoers, committers, **self.args)
+
+    def __repr__(self):
+        return 'Action({})'.format(self.kind)
+
+    def to_dict(self):
+        return {'kind': self.kind, 'args': self.args}
+
+    def describe(self):
+        '''
+        :return: A dict describing what this action changes.  It contains
+        "kind", and, for actions on S3 objects:
+            - "region", "bucket", and "key"
+            - "prefix": True if the action replaces all the objects whose keys
+              begin with "key" (e.g., S3Sync), rather than just the object
+              with that key
+            - "digest": The digest of the content written, if the key
+              already determines it (e.g., the templates of Aruba::Stack
+              resources).
+        '''
+
+        _load_action_kind(self.kind)
+        desc = {'kind': self.kind}
+        describer = _ACTION_DESCRIBERS.get(self.kind)
+        if describer is not None:
+            desc.update(describer(**self.args))
+        return desc
+
+    @staticmethod
+    def from_dict(d):
+        return Action(d['kind'], **d['args'])
+
+def describe_s3_action(aws_region, bucket_name, key, prefix=False, \
+    digest=None, **_):
+    '''
+    A describer (cf. action_func) for actions on S3 objects.
+    '''
+
+    desc = {'region': aws_region, 'bucket': bucket_name, 'key': key}
+    if prefix:
+        desc['prefix'] = True
+    if digest is not None:
+        desc['digest'] = digest
+    return desc
+
+def _describe(action):
+    if isinstance(action, Action):
+        return action.describe()
+    return None
+
+def _action_key_matches(desc, key):
+    if desc.get('prefix', False):
+        return key.startswith(desc['key'])
+    return key == desc['key']
+
+def _actions_overlap(desc_1, desc_2):
+    '''
+    :return: Whether the two actions may change the same thing.
+    '''
+
+    if desc_1 is None or desc_2 is None:
+        # we don't know what plain functions do
+        return True
+    if 'bucket' not in desc_1 or 'bucket' not in desc_2:
+        return desc_1['kind'] == desc_2['kind']
+    if (desc_1['region'], desc_1['bucket']) != \
+        (desc_2['region'], desc_2['bucket']):
+        return False
+    return _action_key_matches(desc_1, desc_2['key']) or \
+        _action_key_matches(desc_2, desc_1['key'])
+
+def _action_identity(action):
+    # Only actions with the same arguments are the same, since they have the
+    # same effects and the same undoers and committers
+    return json.dumps(action.to_dict(), sort_keys=True)
+
+def coalesce_actions(actions):
+    '''
+    Remove actions that would have no effect when a list of actions is done
+    in order: repeats of earlier actions (i.e., of the same kind and with the
+    same arguments), unless an action in between may change the same thing
+    (e.g., the same Lambda package uploaded for two functions).  Other
+    actions are kept, even if a later one may replace their effects (e.g.,
+    an S3Mkdir in the destination of a later S3Sync, which may upload
+    nothing).
+
+    :param actions: A list of actions (cf. Result).  Those that are not
+    instances of Action are kept.
+
+    :return: A new list of actions.
+    '''
+
+    descs = [_describe(a) for a in actions]
+    keep = [True] * len(actions)
+
+    last_index = {} # identity -> index of last kept action
+    for i, desc in enumerate(descs):
+        if desc is None:
+            continue
+        identity = _action_identity(actions[i])
+        j = last_index.get(identity)
+        if j is not None and not any(keep[k] and \
+            _actions_overlap(descs[k], desc) for k in range(j + 1, i)):
+            keep[i] = False
+        else:
+            last_index[identity] = i
+
+    return [a for a, k in zip(actions, keep) if k]
+
+class Memo(object):
+    '''
+    A thread-safe memo of the results of computations.  If several threads
+    ask for the same key at once, the computation is done only once, and the
+    others wait for it.  Exceptions are not remembered.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._pending = {} # key -> threading.Event
+
+    def get(self, key, func):
+        '''
+        :return: The value for the given key, computed by calling func (with
+        no arguments) if it is not known yet.
+        '''
+
+        while True:
+            with self._lock:
+                try:
+                    return self._lookup(key)
+                except KeyError:
+                    pass
+                event = self._pending.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._pending[key] = event
+                    break
+            event.wait()
+
+        try:
+            value = func()
+            with self._lock:
+                self._store(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    # The following are called with the lock held.
+
+    def _lookup(self, key):
+        return self._values[key]
+
+    def _store(self, key, value):
+        self._values[key] = value
+
+class LruMemo(Memo):
+    '''
+    A Memo that keeps values whose total size is at most max_bytes,
+    forgetting the least recently used ones first.  It also counts hits,
+    misses, and evictions.
+    '''
+
+    def __init__(self, max_bytes, sizeof):
+        '''
+        :param sizeof: A function that takes a key and a value and returns
+        their approximate size in bytes.
+        '''
+
+        super(LruMemo, self).__init__()
+        self._values = collections.OrderedDict() # key -> (value, size)
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._nbr_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _lookup(self, key):
+        value, size = self._values.pop(key)
+        self._values[key] = (value, size)
+        self._hits += 1
+        return value
+
+    def _store(self, key, value):
+        self._misses += 1
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        self._values[key] = (value, size)
+        self._nbr_bytes += size
+        while self._nbr_bytes > self.max_bytes:
+            _, (_, old_size) = self._values.popitem(last=False)
+            self._nbr_bytes -= old_size
+            self._evictions += 1
+            metrics.incr('cfnplus_cache_evictions', cache='nested_template')
+
+    def stats(self):
+        '''
+        :return: A dict with the numbers of "hits", "misses", "evictions",
+        and "entries", and the total size of the entries ("bytes").
+        '''
+
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(self._values),
+                'bytes': self._nbr_bytes,
+            }
+
+class ExportIndex(object):
+    '''
+    An index of the CloudFormation exports in each region.  A region's
+    exports are all listed the first time one of them is looked up, and after
+    that, lookups are done in the index.  Lookups of names that are not in
+    the index make it be loaded again, unless it was loaded by this object
+    (i.e., it was not loaded from the local cache) less than min_refresh
+    seconds ago.
+
+    If ttl is not None, the index is also kept in CloudFormation Plus's local
+    cache (cf. cache_dir), and the index in the cache is used if it was
+    loaded less than ttl seconds ago.
+    '''
+
+    def __init__(self, ttl=None, min_refresh=60):
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self._lock = threading.Lock()
+        self._regions = {} # region -> [exports dict, time loaded, from cache]
+
+    def _cache_path(self, aws_region):
+        return os.path.join(cache_dir('exports'), \
+            '{}.json'.format(aws_region))
+
+    def _load_from_cache(self, aws_region):
+        try:
+            with io.open(self._cache_path(aws_region), 'r', \
+                encoding='utf-8') as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if time.time() - entry['loaded_at'] >= self.ttl:
+            return None
+        return [entry['exports'], entry['loaded_at'], True]
+
+    def _load_from_aws(self, aws_region):
+        cf = aws_client('cloudformation', aws_region)
+        exports = {}
+        args = {}
+        while True:
+            result = cf.list_exports(**args)
+            for export in result['Exports']:
+                exports[export['Name']] = export['Value']
+            try:
+                args['NextToken'] = result['NextToken']
+            except KeyError:
+                break
+        loaded_at = time.time()
+
+        if self.ttl is not None:
+            path = self._cache_path(aws_region)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), \
+                prefix='tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'loaded_at': loaded_at, 'exports': exports}, f)
+            os.rename(tmp_path, path)
+
+        return [exports, loaded_at, False]
+
+    def get(self, aws_region, name):
+        '''
+        :return: The value of the export with the given name.
+        :throw KeyError: If there is no such export.
+        '''
+
+        # The lock is held while the index is loaded, so that it is loaded
+        # only once even if several threads need it at the same time
+        with self._lock:
+            entry = self._regions.get(aws_region)
+            now = time.time()
+            if entry is not None and self.ttl is not None and \
+                now - entry[1] >= self.ttl:
+                entry = None
+            hit = entry is not None
+            if entry is None and self.ttl is not None:
+                entry = self._load_from_cache(aws_region)
+            if entry is None:
+                entry = self._load_from_aws(aws_region)
+            elif name not in entry[0] and \
+                (entry[2] or now - entry[1] >= self.min_refresh):
+                entry = self._load_from_aws(aws_region)
+            self._regions[aws_region] = entry
+        metrics.incr('cfnplus_cache_requests', cache='exports', \
+            result='hit' if hit else 'miss')
+        return entry[0][name]
+
+# max total size of the results of processing nested templates that are kept
+# in memory (cf. Context.process_template_cached)
+NESTED_TEMPLATE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def _template_digest(template_str):
+    '''
+    :return: A digest of the given template.  This is not remembered, since
+    hashing a template is much cheaper than processing it, and remembering
+    the templates would take more memory than the results cache they key.
+    '''
+
+    h = hashlib.new(FILE_HASH_ALG)
+    h.update(template_str if isinstance(template_str, bytes) \
+        else template_str.encode('utf-8'))
+    return h.hexdigest()
+
+def _proc_result_size(key, value):
+    result, inputs = value
+    size = len(key) + len(result.new_template or '')
+    size += 256 * (len(result.before_creation) + len(result.after_creation))
+    size += sum(len(v) for _, v in inputs)
+    return size
+
+class _Scope(object):
+    '''
+    A layer of symbols, on top of the layers of an enclosing scope.  A layer
+    may be changed only while it is used by just one context (cf.
+    Context.set_var), so a context can be copied in constant time by sharing
+    its layers.
+    '''
+
+    __slots__ = ('symbols', 'parent', 'depth', 'expr_memo')
+
+    # scopes deeper than this are flattened into one layer
+    MAX_DEPTH = 16
+
+    def __init__(self, symbols, parent=None):
+        if parent is not None and parent.depth >= self.MAX_DEPTH:
+            flat = parent.to_dict()
+            flat.update(symbols)
+            symbols = flat
+            parent = None
+        self.symbols = symbols
+        self.parent = parent
+        self.depth = 1 if parent is None else parent.depth + 1
+
+        # values of expressions that depend only on symbols (cf.
+        # eval_cfn_expr.eval_expr)
+        self.expr_memo = {}
+
+    def lookup(self, symbol):
+        scope = self
+        while scope is not None:
+            try:
+                return scope.symbols[symbol]
+            except KeyError:
+                scope = scope.parent
+        raise KeyError(symbol)
+
+    def to_dict(self):
+        layers = []
+        scope = self
+        while scope is not None:
+            layers.append(scope.symbols)
+            scope = scope.parent
+        d = {}
+        for layer in reversed(layers):
+            d.update(layer)
+        return d
+
 class Context(object):
+    __slots__ = (
+        '_scope',
+        '_scope_is_shared',
+        '_aws_region',
+        'template_path',
+        '_stack_name',
+        'template_is_imported',
+        'process_template_func',
+        'resource_name',
+        'resource_node',
+        'output_format',
+        'partial_eval',
+        '_proc_result_cache',
+        '_input_recorders',
+        'memo',
+        'metrics',
+        'proc_cache',
+        'executor',
+        'tag_executor',
+        'hash_executor',
+        'export_index',
+    )
+
     def __init__(self, symbols, aws_region=None, \
         template_path=None, stack_name=None, template_is_imported=False, \
-        process_template_func=None, resource_name=None, resource_node=None):
-        self._symbols = dict(**symbols)
-        self.aws_region = aws_region
+        process_template_func=None, resource_name=None, resource_node=None, \
+        output_format='yaml', partial_eval=False):
+        self._scope = _Scope(dict(**symbols))
+        self._scope_is_shared = False
+        self._aws_region = aws_region
         self.template_path = template_path
-        self.stack_name = stack_name
+        self._stack_name = stack_name
         self.template_is_imported = template_is_imported
         self.process_template_func = process_template_func
         self.resource_name = resource_name
         self.resource_node = resource_node
-        self._proc_result_cache = {}
+        self.output_format = output_format
+        self.partial_eval = partial_eval
+        self._proc_result_cache = LruMemo(NESTED_TEMPLATE_CACHE_MAX_BYTES, \
+            _proc_result_size)
+        self._input_recorders = ()
+        self.memo = Memo()
+        self.metrics = metrics.Metrics()
+        self.proc_cache = None
+        self.executor = None
+        self.tag_executor = None
+        self.hash_executor = None
+        self.export_index = ExportIndex()
 
     def copy(self):
-        ctx = Context(
-            self._symbols,
-            aws_region=self.aws_region,
-            template_path=self.template_path,
-            stack_name=self.stack_name,
-            template_is_imported=self.template_is_imported,
-            process_template_func=self.process_template_func,
-            resource_name=self.resource_name,
-            resource_node=self.resource_node)
-        ctx._proc_result_cache = self._proc_result_cache # pylint: disable=protected-access
+        '''
+        :return: A context with the same symbols and attributes as this one,
+        and sharing its caches, executors, and metrics.  Setting symbols in
+        either context afterwards does not affect the other.  This takes
+        constant time.
+        '''
+
+        ctx = Context.__new__(Context)
+        for attr in Context.__slots__:
+            setattr(ctx, attr, getattr(self, attr))
+        ctx._scope_is_shared = True # pylint: disable=protected-access
+        self._scope_is_shared = True
         return ctx
 
+    def share_state(self, other):
+        '''
+        Make this context use the same caches and executors as another one
+        --- e.g., when several templates are processed together.
+        '''
+
+        self._proc_result_cache = other._proc_result_cache # pylint: disable=protected-access
+        self.memo = other.memo
+        self.proc_cache = other.proc_cache
+        self.executor = other.executor
+        self.tag_executor = other.tag_executor
+        self.hash_executor = other.hash_executor
+        self.export_index = other.export_index
+
+    def record_inputs(self):
+        '''
+        Start recording the inputs (cf. add_input) used when processing
+        templates with this context and with copies made from it from now on.
+
+        :return: A list to which the inputs will be added, as (kind, value)
+        pairs.
+        '''
+
+        inputs = []
+        self._input_recorders = self._input_recorders + (inputs,)
+        return inputs
+
+    def add_input(self, kind, value):
+        '''
+        Note that the result of processing the template depends on something
+        other than the template and the context --- for example, a local
+        file.
+
+        :param kind: "file" (value is an abs path to a file), "dir" (value is
+        an abs path to a directory), or "export" (value is the name of a
+        CloudFormation export).
+        '''
+
+        for inputs in self._input_recorders:
+            inputs.append((kind, value))
+
+    @property
+    def aws_region(self):
+        return self._aws_region
+
+    @aws_region.setter
+    def aws_region(self, value):
+        self._aws_region = value
+        self._reset_expr_memo()
+
+    @property
+    def stack_name(self):
+        return self._stack_name
+
+    @stack_name.setter
+    def stack_name(self, value):
+        self._stack_name = value
+        self._reset_expr_memo()
+
+    def _reset_expr_memo(self):
+        # Expressions may refer to built-in vars, so values remembered with
+        # other ones must not be used.  The memo may be shared with copies.
+        if self._scope_is_shared:
+            self._scope = _Scope({}, self._scope)
+            self._scope_is_shared = False
+        else:
+            self._scope.expr_memo = {}
+
     @property
     def _built_in_vars(self):
         var_map = {}
@@ -132,29 +835,46 @@ class Context(object):
             var_map['AWS::StackName'] = self.stack_name
         return var_map
 
+    def symbols(self):
+        '''
+        :return: A dict containing all the symbols defined in this context
+        (but not the built-in ones).
+        '''
+
+        return self._scope.to_dict()
+
     def resolve_var(self, symbol):
         try:
-            return self._symbols[symbol]
+            return self._scope.lookup(symbol)
         except KeyError:
             return self._built_in_vars[symbol]
 
     def set_var(self, symbol, value):
-        self._symbols[symbol] = value
+        if self._scope_is_shared:
+            # copy on write
+            self._scope = _Scope({symbol: value}, self._scope)
+            self._scope_is_shared = False
+        else:
+            self._scope.symbols[symbol] = value
+            self._scope.expr_memo = {}
 
-    def resolve_cfn_export(self, var_name):
-        cf = boto3.client('cloudformation', region_name=self.aws_region)
-        args = {}
-        while True:
-            result = cf.list_exports(**args)
-            for export in result['Exports']:
-                if export['Name'] == var_name:
-                    return export['Value']
+    @property
+    def expr_memo(self):
+        '''
+        A dict in which eval_cfn_expr remembers the values of expressions
+        that depend only on symbols and built-in vars.  It is shared by copies
+        of this context until a symbol or built-in var is set.
+        '''
 
-            try:
-                args['NextToken'] = result['NextToken']
-            except KeyError:
-                raise InvalidTemplate("No such CloudFormation export: {}".\
-                    format(var_name))
+        return self._scope.expr_memo
+
+    def resolve_cfn_export(self, var_name):
+        self.add_input('export', var_name)
+        try:
+            return self.export_index.get(self.aws_region, var_name)
+        except KeyError:
+            raise InvalidTemplate("No such CloudFormation export: {}".\
+                format(var_name))
 
     def abspath(self, rel_path):
         template_dir = os.path.dirname(self.template_path)
@@ -162,35 +882,81 @@ class Context(object):
 
     @staticmethod
     def _proc_result_cache_make_key(template_str, ctx):
-        attrs = ['_symbols', 'aws_region', 'template_path', 'stack_name', \
-            'template_is_imported']
-        d = {'template_str': template_str}
+        attrs = ['aws_region', 'template_path', 'stack_name', \
+            'template_is_imported', 'output_format', 'partial_eval']
+        d = {'template': _template_digest(template_str), \
+            'symbols': ctx.symbols()}
         for attr in attrs:
             d[attr] = getattr(ctx, attr)
-        return json.dumps(d)
+        h = hashlib.new(FILE_HASH_ALG)
+        h.update(json.dumps(d, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
 
-    def proc_result_cache_get(self, template_str, ctx):
+    def process_template_cached(self, template_str, ctx):
         '''
+        Process a template with the given context, using process_template_func.
+
         It is possible that a template is processed multiple times, so we'd like
         to keep a cache of results.  Since template processing is a function
         of both templates and contexts, we need to include the context in
         the cache key along with the template.  So we need a way to serialize
         or hash the context (or at least the parts of the context that are
-        relevant to template processing).
+        relevant to template processing).  The key is a digest of the
+        template and of these parts.
 
-        :return: The processed template as a string, or None.
-        '''
+        The cache is shared by all copies of this context and by contexts
+        sharing its state (cf. share_state), and a template is processed only
+        once even if several threads ask for it at the same time.  The inputs
+        that were used to process the template (cf. add_input) are added to
+        this context even if the result comes from the cache.  The cache
+        keeps at most NESTED_TEMPLATE_CACHE_MAX_BYTES of results in memory
+        (cf. nested_template_cache_stats); if this context has a
+        ProcessingCache (cf. proc_cache), results are also kept there, so
+        that they survive across runs.
 
+        :return: Instance of Result.
+        '''
 
         key = self._proc_result_cache_make_key(template_str, ctx)
-        try:
-            return self._proc_result_cache[key]
-        except KeyError:
-            return None
+        computed = []
+        def process():
+            computed.append(True)
 
-    def proc_result_cache_put(self, template_str, ctx, new_template_str):
-        key = self._proc_result_cache_make_key(template_str, ctx)
-        self._proc_result_cache[key] = new_template_str
+            # look in persistent cache
+            persistent_key = None
+            if self.proc_cache is not None:
+                persistent_key = self.proc_cache.make_key(\
+                    nested_template=key)
+                found = self.proc_cache.get_with_inputs(persistent_key, ctx)
+                self.metrics.incr('cfnplus_cache_requests', \
+                    cache='nested_template_persistent', \
+                    result='miss' if found is None else 'hit')
+                if found is not None:
+                    for kind, value in found[1]:
+                        ctx.add_input(kind, value)
+                    return found
+
+            inputs = ctx.record_inputs()
+            result = self.process_template_func(template_str, ctx)
+            if persistent_key is not None:
+                self.proc_cache.put(persistent_key, inputs, result, ctx)
+            return result, inputs
+
+        result, inputs = self._proc_result_cache.get(key, process)
+        if len(computed) == 0:
+            for kind, value in inputs:
+                self.add_input(kind, value)
+        self.metrics.incr('cfnplus_cache_requests', cache='nested_template', \
+            result='miss' if len(computed) > 0 else 'hit')
+        return result
+
+    def nested_template_cache_stats(self):
+        '''
+        :return: Statistics about the in-memory cache of the results of
+        processing nested templates (cf. LruMemo.stats).
+        '''
+
+        return self._proc_result_cache.stats()
 
 class Result(object):
     '''
@@ -208,6 +974,40 @@ class Result(object):
         self.after_creation = [] if after_creation is None else after_creation
         self._undoers = []
         self._committers = []
+        self.metrics = metrics.Metrics()
+
+        # whether buckets exist, for this result's actions (shared by the
+        # results of a batch; cf. process_templates)
+        self.bucket_checks = Memo()
+
+    def coalesce(self):
+        '''
+        Remove repeated actions that would have no effect (cf.
+        coalesce_actions).
+
+        :return: The number of actions removed.
+        '''
+
+        n = len(self.before_creation) + len(self.after_creation)
+        self.before_creation = coalesce_actions(self.before_creation)
+        self.after_creation = coalesce_actions(self.after_creation)
+        return n - len(self.before_creation) - len(self.after_creation)
+
+    def plan(self):
+        '''
+        :return: A dict containing "before_creation" and "after_creation":
+        lists of descriptions (cf. Action.describe) of the actions that will
+        be done, in order.  Actions that are not instances of Action are
+        described only by their "kind", which is their repr.
+        '''
+
+        def describe(action):
+            desc = _describe(action)
+            return {'kind': repr(action)} if desc is None else desc
+        return {
+            'before_creation': [describe(a) for a in self.before_creation],
+            'after_creation': [describe(a) for a in self.after_creation],
+        }
 
     def __enter__(self):
         return self
@@ -215,14 +1015,18 @@ class Result(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
             if exc_type is None:
-                for action in self._committers:
-                    action()
+                with tracing.span('commit'), metrics.active(self.metrics), \
+                    self.metrics.timer('commit'):
+                    for action in self._committers:
+                        action()
                 self._committers = []
             else:
                 print("Undoing CloudFormation Plus actions")
-                while len(self._undoers) > 0:
-                    action = self._undoers.pop()
-                    action()
+                with tracing.span('undo'), metrics.active(self.metrics), \
+                    self.metrics.timer('undo'):
+                    while len(self._undoers) > 0:
+                        action = self._undoers.pop()
+                        action()
         except:
             pass
 
@@ -233,8 +1037,12 @@ class Result(object):
         '''
 
         # do before-creation actions
-        for action in self.before_creation:
-            action(self._undoers, self._committers)
+        with tracing.span('do_before_creation'), \
+            metrics.active(self.metrics), \
+            sharing_bucket_checks(self.bucket_checks), \
+            self.metrics.timer('before_creation'):
+            for action in self.before_creation:
+                action(self._undoers, self._committers)
 
     def do_after_creation(self):
         '''
@@ -243,11 +1051,17 @@ class Result(object):
         '''
 
         # commit the before-creation actions
-        for action in self._committers:
-            action()
+        with tracing.span('commit'), metrics.active(self.metrics), \
+            self.metrics.timer('commit'):
+            for action in self._committers:
+                action()
         self._committers = []
         self._undoers = []
 
         # do after-creation actions
-        for action in self.after_creation:
-            action(self._undoers, self._committers)
+        with tracing.span('do_after_creation'), \
+            metrics.active(self.metrics), \
+            sharing_bucket_checks(self.bucket_checks), \
+            self.metrics.timer('after_creation'):
+            for action in self.after_creation:
+                action(self._undoers, self._committers)
@@ -17,9 +17,15 @@ setup(
     author_email='charles.shearer@hpe.com',
     license='Apache License 2.0',
     packages=['cfnplus'],
+    entry_points={
+        'console_scripts': [
+            'cfnplus = cfnplus.__main__:main',
+        ],
+    },
     install_requires=[
         'boto3>=1.9,<2',
         'pyyaml',
+        'futures; python_version < "3"',
     ],
     tests_require=[
         'pytest',
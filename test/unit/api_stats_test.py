@@ -0,0 +1,87 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+from botocore.stub import Stubber
+from botocore.awsrequest import AWSResponse
+from cfnplus import api_stats, utils
+
+class ApiStatsTest(unittest.TestCase):
+    def testCallsAreRecorded(self):
+        #
+        # Set up
+        #
+        s3 = utils.aws_client('s3', 'us-west-2')
+        model = s3.meta.service_model.operation_model('HeadBucket')
+
+        #
+        # Call
+        #
+        with api_stats.ApiStats(print_summary=False) as stats, \
+            Stubber(s3) as stubber:
+            stubber.add_response('head_bucket', {}, {'Bucket': 'b'})
+            stubber.add_client_error('head_bucket', http_status_code=404)
+            s3.head_bucket(Bucket='b')
+            try:
+                s3.head_bucket(Bucket='b')
+            except s3.exceptions.ClientError:
+                pass
+            s3.meta.events.emit('needs-retry.s3.HeadBucket', \
+                response=(AWSResponse('https://b', 503, {}, None), \
+                    {'Error': {'Code': 'SlowDown'}}), \
+                endpoint=None, operation=model, attempts=1, \
+                caught_exception=None, request_dict={'context': {}})
+
+        #
+        # Test
+        #
+        ops = dict(stats.operations())
+        op_stats = ops[('s3', 'HeadBucket')]
+        self.assertEqual(2, op_stats.calls)
+        self.assertEqual(1, op_stats.errors)
+        self.assertEqual(1, op_stats.throttles)
+        self.assertEqual(2, sum(op_stats.latency_counts))
+        self.assertIn('s3.HeadBucket', stats.summary())
+
+    def testInactive(self):
+        #
+        # Set up
+        #
+        s3 = utils.aws_client('s3', 'us-west-2')
+        stats = api_stats.ApiStats(print_summary=False)
+
+        #
+        # Call
+        #
+        with Stubber(s3) as stubber:
+            stubber.add_response('head_bucket', {}, {'Bucket': 'b'})
+            s3.head_bucket(Bucket='b')
+
+        #
+        # Test
+        #
+        self.assertEqual([], stats.operations())
@@ -0,0 +1,153 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+from cfnplus.utils import Action, Result, coalesce_actions
+
+def _mkdir(key):
+    return Action('S3Mkdir', aws_region='us-west-2', bucket_name='bucket', \
+        key=key)
+
+def _sync(dir_key):
+    return Action('S3Sync', aws_region='us-west-2', abs_local_path='/tmp', \
+        bucket_name='bucket', dir_key=dir_key)
+
+def _upload(key):
+    return Action('S3Upload', aws_region='us-west-2', \
+        abs_local_path='/tmp/f', bucket_name='bucket', key=key)
+
+def _package(path):
+    return Action('LambdaCodeUpload', aws_region='us-west-2', \
+        bucket_name='bucket', key='lambda/abc123', \
+        package={'local_path': path})
+
+class CoalesceActionsTest(unittest.TestCase):
+    def testDuplicatesAreRemoved(self):
+        #
+        # Set up
+        #
+        actions = [_package('/a/func'), _upload('x'), _package('/a/func'), \
+            _upload('x'), _mkdir('dir/')]
+
+        #
+        # Call
+        #
+        new_actions = coalesce_actions(actions)
+
+        #
+        # Test
+        #
+        self.assertEqual([actions[0], actions[1], actions[4]], new_actions)
+
+    def testActionsCoveredBySyncAreKept(self):
+        #
+        # Set up
+        #
+        # the sync may upload nothing, so the directories must still be made
+        actions = [_mkdir('site/'), _mkdir('site/img/'), \
+            _upload('site/index.html'), _sync('site/'), _mkdir('site/')]
+
+        #
+        # Call
+        #
+        new_actions = coalesce_actions(actions)
+
+        #
+        # Test
+        #
+        self.assertEqual(actions, new_actions)
+
+    def testRepeatAfterOverlappingActionIsKept(self):
+        #
+        # Set up
+        #
+        other_upload = Action('S3Upload', aws_region='us-west-2', \
+            abs_local_path='/tmp/g', bucket_name='bucket', key='x')
+        actions = [_upload('x'), other_upload, _upload('x'), _upload('y'), \
+            lambda undoers, committers: None, _upload('y')]
+
+        #
+        # Call
+        #
+        new_actions = coalesce_actions(actions)
+
+        #
+        # Test
+        #
+        self.assertEqual(actions, new_actions)
+
+    def testDifferentEffectsAreNotMerged(self):
+        #
+        # Set up
+        #
+        def template_upload(body):
+            return Action('TemplateUpload', aws_region='us-west-2', \
+                bucket_name='bucket', key='templates/abc123', body=body)
+        other_upload = Action('S3Upload', aws_region='us-west-2', \
+            abs_local_path='/tmp/g', bucket_name='bucket', key='x')
+        actions = [template_upload('a'), template_upload('b'), _upload('x'), \
+            other_upload]
+
+        #
+        # Call
+        #
+        new_actions = coalesce_actions(actions)
+
+        #
+        # Test
+        #
+        self.assertEqual(actions, new_actions)
+
+    def testPlan(self):
+        #
+        # Set up
+        #
+        result = Result(before_creation=[_mkdir('site/'), _sync('site/'), \
+            _package('/a/func'), _package('/a/func')])
+
+        #
+        # Call
+        #
+        n_removed = result.coalesce()
+        plan = result.plan()
+
+        #
+        # Test
+        #
+        self.assertEqual(1, n_removed)
+        self.assertEqual({
+            'before_creation': [
+                {'kind': 'S3Mkdir', 'region': 'us-west-2', 'bucket': 'bucket', \
+                    'key': 'site/'},
+                {'kind': 'S3Sync', 'region': 'us-west-2', 'bucket': 'bucket', \
+                    'key': 'site/', 'prefix': True},
+                {'kind': 'LambdaCodeUpload', 'region': 'us-west-2', \
+                    'bucket': 'bucket', 'key': 'lambda/abc123', \
+                    'digest': 'abc123'},
+            ],
+            'after_creation': [],
+        }, plan)
@@ -0,0 +1,215 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import timeit
+import shutil
+import tempfile
+from cfnplus.utils import Context, LruMemo, Result, InvalidTemplate
+from cfnplus.eval_cfn_expr import eval_expr
+from cfnplus.proc_cache import ProcessingCache
+
+class ContextTest(unittest.TestCase):
+    def testCopiesAreIndependent(self):
+        #
+        # Set up
+        #
+        ctx = Context({'A': '1', 'B': '2'}, aws_region='us-west-2')
+
+        #
+        # Call
+        #
+        child = ctx.copy()
+        child.set_var('A', 'child')
+        child.set_var('C', '3')
+        grandchild = child.copy()
+        ctx.set_var('B', 'parent')
+        grandchild.set_var('C', 'grandchild')
+
+        #
+        # Test
+        #
+        self.assertEqual({'A': '1', 'B': 'parent'}, ctx.symbols())
+        self.assertEqual({'A': 'child', 'B': '2', 'C': '3'}, child.symbols())
+        self.assertEqual({'A': 'child', 'B': '2', 'C': 'grandchild'}, \
+            grandchild.symbols())
+        self.assertEqual('us-west-2', grandchild.aws_region)
+
+    def testBuiltInVars(self):
+        #
+        # Set up
+        #
+        ctx = Context({}, aws_region='us-west-2', stack_name='MyStack')
+
+        #
+        # Call
+        #
+        child = ctx.copy()
+        child.set_var('AWS::StackName', 'Shadowed')
+
+        #
+        # Test
+        #
+        self.assertEqual('us-west-2', child.resolve_var('AWS::Region'))
+        self.assertEqual('Shadowed', child.resolve_var('AWS::StackName'))
+        self.assertEqual('MyStack', ctx.resolve_var('AWS::StackName'))
+        self.assertRaises(KeyError, child.resolve_var, 'Nope')
+        self.assertEqual({}, ctx.symbols())
+
+    def testBuiltInVarsInCopiesAreNotMemoized(self):
+        #
+        # Set up
+        #
+        exp = {'Fn::Sub': '${AWS::Region}/${AWS::StackName}'}
+        ctx = Context({}, aws_region='us-west-2', stack_name='MyStack')
+        eval_expr(exp, ctx)
+
+        #
+        # Call
+        #
+        child = ctx.copy()
+        child.aws_region = 'eu-west-1'
+        child_value = eval_expr(exp, child)
+        nameless = ctx.copy()
+        nameless.stack_name = None
+
+        #
+        # Test
+        #
+        self.assertEqual('eu-west-1/MyStack', child_value)
+        self.assertEqual('us-west-2/MyStack', eval_expr(exp, ctx))
+        self.assertRaises(InvalidTemplate, eval_expr, exp, nameless)
+
+    def testDeepScopes(self):
+        #
+        # Set up
+        #
+        ctx = Context({'X': 0})
+
+        #
+        # Call
+        #
+        contexts = [ctx]
+        for i in range(100):
+            ctx = ctx.copy()
+            ctx.set_var('X', i + 1)
+            ctx.set_var('Y{}'.format(i), i)
+            contexts.append(ctx)
+
+        #
+        # Test
+        #
+        for i, c in enumerate(contexts):
+            self.assertEqual(i, c.resolve_var('X'))
+            self.assertEqual(i + 1, len(c.symbols()))
+        self.assertEqual(0, ctx.resolve_var('Y0'))
+
+    def testCopyTakesConstantTime(self):
+        #
+        # Set up
+        #
+        small = Context(dict(('P{}'.format(i), 'v') for i in range(10)))
+        big = Context(dict(('P{}'.format(i), 'v') for i in range(10000)))
+
+        #
+        # Call
+        #
+        small_secs = min(timeit.repeat(small.copy, number=1000, repeat=3))
+        big_secs = min(timeit.repeat(big.copy, number=1000, repeat=3))
+
+        #
+        # Test
+        #
+        # copying 10,000 symbols would take orders of magnitude longer
+        self.assertLess(big_secs, small_secs * 10)
+        self.assertEqual('v', big.copy().resolve_var('P9999'))
+
+    def testNestedTemplateResultsAreCached(self):
+        #
+        # Set up
+        #
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        calls = []
+        def process_template(template_str, ctx):
+            calls.append(template_str)
+            return Result(new_template=template_str.upper())
+
+        def make_context():
+            ctx = Context({'A': '1'}, aws_region='us-west-2', \
+                process_template_func=process_template)
+            ctx.proc_cache = ProcessingCache(cache_dir)
+            return ctx
+
+        #
+        # Call
+        #
+        ctx = make_context()
+        results = [ctx.process_template_cached('t1', ctx.copy()) \
+            for _ in range(3)]
+        stats = ctx.nested_template_cache_stats()
+
+        # as if in another run
+        ctx = make_context()
+        result = ctx.process_template_cached('t1', ctx.copy())
+
+        #
+        # Test
+        #
+        self.assertEqual(['T1'] * 3, [r.new_template for r in results])
+        self.assertEqual('T1', result.new_template)
+        self.assertEqual(['t1'], calls)
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+class LruMemoTest(unittest.TestCase):
+    def testEviction(self):
+        #
+        # Set up
+        #
+        memo = LruMemo(max_bytes=30, sizeof=lambda k, v: len(v))
+
+        #
+        # Call
+        #
+        memo.get('a', lambda: 'a' * 10)
+        memo.get('b', lambda: 'b' * 10)
+        memo.get('a', lambda: 'x')
+        memo.get('c', lambda: 'c' * 15) # evicts 'b'
+        memo.get('huge', lambda: 'h' * 100) # not kept
+
+        #
+        # Test
+        #
+        self.assertEqual('a' * 10, memo.get('a', lambda: 'x'))
+        self.assertEqual('c' * 15, memo.get('c', lambda: 'x'))
+        self.assertEqual('x', memo.get('b', lambda: 'x'))
+        stats = memo.stats()
+        self.assertEqual(1, stats['evictions'])
+        self.assertLessEqual(stats['bytes'], 30)
+        self.assertEqual(3, stats['hits'])
+        self.assertEqual(5, stats['misses'])
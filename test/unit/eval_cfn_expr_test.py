@@ -26,9 +26,17 @@
 # pylint: disable=too-few-public-methods
 # pylint: disable=unused-argument
 import unittest
+from cfnplus import eval_cfn_expr
 from cfnplus.eval_cfn_expr import eval_expr
 from cfnplus.utils import Context
 
+class _TestContext(Context):
+    '''
+    A context whose methods can be replaced.
+    '''
+
+    pass
+
 class EvalCfnExprTest(unittest.TestCase):
     def testSubWithString(self):
         cases = [
@@ -137,7 +145,7 @@ class EvalCfnExprTest(unittest.TestCase):
         exp = {
             'Fn::ImportValue': {'Fn::Sub': 'Tc-${DeployId}-BucketName'}
         }
-        ctx = Context({'DeployId': '1'})
+        ctx = _TestContext({'DeployId': '1'})
         ctx.resolve_cfn_export = lambda k: 'woobie' if k == 'Tc-1-BucketName' \
             else None
 
@@ -182,3 +190,104 @@ class EvalCfnExprTest(unittest.TestCase):
         # Test
         #
         self.assertEqual('us-west-2', result)
+
+    def testSubIsMemoized(self):
+        #
+        # Set up
+        #
+        exp = {'Fn::Sub': ['${Prefix}-${Name}', {'Name': {'Ref': 'Thing'}}]}
+        ctx = _TestContext({'Prefix': 'a', 'Thing': 'b'})
+        lookups = []
+        resolve_var = ctx.resolve_var
+        def counting_resolve_var(symbol):
+            lookups.append(symbol)
+            return resolve_var(symbol)
+        ctx.resolve_var = counting_resolve_var
+
+        #
+        # Call
+        #
+        results = [eval_expr(exp, ctx) for _ in range(3)]
+        nbr_lookups = len(lookups)
+        ctx.set_var('Prefix', 'c')
+        new_result = eval_expr(exp, ctx)
+
+        #
+        # Test
+        #
+        self.assertEqual(['a-b'] * 3, results)
+        self.assertEqual(2, nbr_lookups)
+        self.assertEqual('c-b', new_result)
+
+    def testImportIsNotMemoized(self):
+        #
+        # Set up
+        #
+        exp = {'Fn::Sub': ['${Value}', {'Value': {'Fn::ImportValue': 'x'}}]}
+        ctx = _TestContext({})
+        imports = []
+        def resolve_cfn_export(name):
+            imports.append(name)
+            return 'v'
+        ctx.resolve_cfn_export = resolve_cfn_export
+
+        #
+        # Call
+        #
+        results = [eval_expr(exp, ctx) for _ in range(2)]
+
+        #
+        # Test
+        #
+        self.assertEqual(['v', 'v'], results)
+        self.assertEqual(['x', 'x'], imports)
+
+    def testSubFormatIsCompiledOnce(self):
+        #
+        # Set up
+        #
+        format_str = 'arn:aws:s3:::${Bucket}/${AWS::Region}/*'
+        exp = {'Fn::Sub': format_str}
+        eval_cfn_expr._compiled_subs.clear() # pylint: disable=protected-access
+
+        #
+        # Call
+        #
+        result_1 = eval_expr(exp, Context({'Bucket': 'a'}, \
+            aws_region='us-west-2'))
+        parts = eval_cfn_expr._compiled_subs[format_str] # pylint: disable=protected-access
+        result_2 = eval_expr(exp, Context({'Bucket': 'b'}, \
+            aws_region='eu-west-1'))
+
+        #
+        # Test
+        #
+        self.assertEqual('arn:aws:s3:::a/us-west-2/*', result_1)
+        self.assertEqual('arn:aws:s3:::b/eu-west-1/*', result_2)
+        self.assertIs(parts, eval_cfn_expr._compiled_subs[format_str]) # pylint: disable=protected-access
+
+    def testSubMemoIsKeyedByRegionAndStack(self):
+        #
+        # Set up
+        #
+        exp = {'Fn::Sub': '${AWS::StackName}-${AWS::Region}-${Name}'}
+        ctx = Context({'Name': 'x'}, aws_region='us-west-2', \
+            stack_name='MyStack')
+
+        #
+        # Call
+        #
+        result_1 = eval_expr(exp, ctx)
+        keys = list(ctx.expr_memo)
+        ctx.aws_region = 'eu-west-1'
+        result_2 = eval_expr(exp, ctx)
+
+        #
+        # Test
+        #
+        self.assertEqual('MyStack-us-west-2-x', result_1)
+        self.assertEqual('MyStack-eu-west-1-x', result_2)
+        self.assertEqual(1, len(keys))
+        self.assertEqual(('us-west-2', 'MyStack'), keys[0][:2])
+        self.assertEqual([('eu-west-1', 'MyStack')], \
+            [k[:2] for k in ctx.expr_memo])
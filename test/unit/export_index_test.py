@@ -0,0 +1,151 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import shutil
+import tempfile
+import cfnplus.utils as utils
+
+class _FakeCloudFormation(object):
+    def __init__(self, exports, page_size):
+        self.exports = exports
+        self.page_size = page_size
+        self.nbr_calls = 0
+
+    def list_exports(self, NextToken=None):
+        self.nbr_calls += 1
+        start = 0 if NextToken is None else int(NextToken)
+        names = sorted(self.exports)[start:start + self.page_size]
+        result = {'Exports': [{'Name': n, 'Value': self.exports[n]} \
+            for n in names]}
+        if start + self.page_size < len(self.exports):
+            result['NextToken'] = str(start + self.page_size)
+        return result
+
+class ExportIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._old_cache_dir = os.environ.get(utils.CACHE_DIR_ENV_VAR)
+        os.environ[utils.CACHE_DIR_ENV_VAR] = self._dir
+
+        exports = dict(('export-{}'.format(i), 'value-{}'.format(i)) \
+            for i in range(250))
+        self._cfn = _FakeCloudFormation(exports, page_size=100)
+        self._old_aws_client = utils.aws_client
+        utils.aws_client = lambda service_name, aws_region: self._cfn
+
+    def tearDown(self):
+        utils.aws_client = self._old_aws_client
+        if self._old_cache_dir is None:
+            del os.environ[utils.CACHE_DIR_ENV_VAR]
+        else:
+            os.environ[utils.CACHE_DIR_ENV_VAR] = self._old_cache_dir
+        shutil.rmtree(self._dir)
+
+    def testLoadedOnceForAllCopies(self):
+        #
+        # Set up
+        #
+        ctx = utils.Context({}, aws_region='us-west-2')
+
+        #
+        # Call
+        #
+        values = []
+        for i in range(40):
+            c = ctx.copy() if i % 2 == 0 else ctx
+            values.append(c.resolve_cfn_export('export-{}'.format(i * 5)))
+
+        #
+        # Test
+        #
+        self.assertEqual(['value-{}'.format(i * 5) for i in range(40)], \
+            values)
+        self.assertEqual(3, self._cfn.nbr_calls)
+
+    def testMissingExport(self):
+        #
+        # Set up
+        #
+        ctx = utils.Context({}, aws_region='us-west-2')
+        ctx.resolve_cfn_export('export-0')
+
+        #
+        # Call
+        #
+        def resolve():
+            ctx.resolve_cfn_export('no-such-export')
+
+        #
+        # Test
+        #
+        self.assertRaises(utils.InvalidTemplate, resolve)
+        self.assertEqual(3, self._cfn.nbr_calls)
+
+    def testPersistedWithTtl(self):
+        #
+        # Set up
+        #
+        utils.ExportIndex(ttl=3600).get('us-west-2', 'export-0')
+        self._cfn.exports['new-export'] = 'new-value'
+        self._cfn.nbr_calls = 0
+
+        #
+        # Call
+        #
+        index = utils.ExportIndex(ttl=3600)
+        old_value = index.get('us-west-2', 'export-1')
+        calls_for_old = self._cfn.nbr_calls
+        new_value = index.get('us-west-2', 'new-export')
+
+        #
+        # Test
+        #
+        self.assertEqual('value-1', old_value)
+        self.assertEqual(0, calls_for_old)
+
+        # the export was not in the persisted index, so it was loaded again
+        self.assertEqual('new-value', new_value)
+        self.assertEqual(3, self._cfn.nbr_calls)
+
+    def testExpired(self):
+        #
+        # Set up
+        #
+        utils.ExportIndex(ttl=3600).get('us-west-2', 'export-0')
+        self._cfn.nbr_calls = 0
+
+        #
+        # Call
+        #
+        utils.ExportIndex(ttl=0).get('us-west-2', 'export-0')
+
+        #
+        # Test
+        #
+        self.assertEqual(3, self._cfn.nbr_calls)
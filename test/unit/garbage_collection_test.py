@@ -0,0 +1,195 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import io
+import json
+import datetime
+from dateutil.tz import tzutc
+import cfnplus.utils as utils
+from cfnplus import garbage_collection
+from cfnplus.garbage_collection import UnresolvedReference, DeletionFailed
+
+class _FakeAws(object):
+    '''
+    Just enough CloudFormation and S3 for garbage collection.
+    '''
+
+    def __init__(self):
+        self.stack_templates = {} # stack name -> template
+        self.objects = {} # (bucket, key) -> body
+        self.deleted = []
+        self.delete_errors = []
+
+    def client(self, service_name, aws_region):
+        return self
+
+    def get_template(self, StackName, TemplateStage):
+        return {'TemplateBody': self.stack_templates[StackName]}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)].\
+            encode('utf-8'))}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        old = datetime.datetime(2000, 1, 1, tzinfo=tzutc())
+        yield {'Versions': [{'Key': k, 'VersionId': 'v1', \
+            'LastModified': old} for b, k in sorted(self.objects) \
+            if b == Bucket and k.startswith(Prefix)]}
+
+    def delete_objects(self, Bucket, Delete):
+        if len(self.delete_errors) > 0:
+            return {'Errors': self.delete_errors}
+        self.deleted.extend(o['Key'] for o in Delete['Objects'])
+        return {}
+
+def _function(code):
+    return {'Type': 'AWS::Lambda::Function', 'Properties': {'Code': code}}
+
+def _stack(template_url):
+    return {'Type': 'AWS::CloudFormation::Stack', \
+        'Properties': {'TemplateURL': template_url}}
+
+_NESTED_URL = 'https://s3-us-west-2.amazonaws.com/bucket/templates/nested'
+
+class GarbageCollectionTest(unittest.TestCase):
+    def setUp(self):
+        self._aws = _FakeAws()
+        self._aws.objects[('bucket', 'lambda/used')] = 'x'
+        self._aws.objects[('bucket', 'lambda/unused')] = 'x'
+        self._old_aws_client = utils.aws_client
+        utils.aws_client = self._aws.client
+
+    def tearDown(self):
+        utils.aws_client = self._old_aws_client
+
+    def _delete_lambda_code(self, resources):
+        self._aws.stack_templates['Stack'] = json.dumps({
+            'Resources': resources,
+        })
+        return garbage_collection.delete_unused_lambda_code(['Stack'], \
+            'bucket', 'lambda', 'us-west-2', max_workers=1)
+
+    def testUnusedLambdaCodeIsDeleted(self):
+        #
+        # Call
+        #
+        self._delete_lambda_code({
+            'Func': _function({'S3Bucket': 'bucket', 'S3Key': 'lambda/used'}),
+            'Inline': _function({'ZipFile': 'def f(e, c): pass'}),
+        })
+
+        #
+        # Test
+        #
+        self.assertEqual(['lambda/unused'], self._aws.deleted)
+
+    def testUnresolvedLambdaCodeDeletesNothing(self):
+        #
+        # Set up
+        #
+        cases = [
+            {'Fn::If': ['Cond', {'S3Bucket': 'bucket', \
+                'S3Key': 'lambda/used'}, {'Ref': 'AWS::NoValue'}]},
+            {'S3Bucket': {'Ref': 'Bucket'}, 'S3Key': 'lambda/used'},
+            {'S3Bucket': 'bucket', \
+                'S3Key': {'Fn::Sub': 'lambda/${Hash}'}},
+            {'S3Bucket': 'bucket'},
+        ]
+
+        for code in cases:
+            #
+            # Call/Test
+            #
+            self.assertRaises(UnresolvedReference, self._delete_lambda_code, \
+                {'Func': _function(code)})
+            self.assertEqual([], self._aws.deleted)
+
+    def _delete_objects(self, resources):
+        self._aws.stack_templates['Stack'] = json.dumps({
+            'Resources': resources,
+        })
+        return garbage_collection.delete_unreferenced_objects(['Stack'], \
+            'bucket', ['lambda', 'templates'], 'us-west-2', retain_days=0, \
+            max_workers=1)
+
+    def testNestedStacksAreFollowed(self):
+        #
+        # Set up
+        #
+        self._aws.objects[('bucket', 'templates/nested')] = json.dumps({
+            'Resources': {
+                'Func': _function({'S3Bucket': 'bucket', \
+                    'S3Key': 'lambda/used'}),
+            },
+        })
+        self._aws.objects[('bucket', 'templates/old')] = '{}'
+
+        #
+        # Call
+        #
+        self._delete_objects({'Nested': _stack(_NESTED_URL)})
+
+        #
+        # Test
+        #
+        self.assertEqual(['lambda/unused', 'templates/old'], \
+            sorted(self._aws.deleted))
+
+    def testUnresolvedTemplateUrlDeletesNothing(self):
+        #
+        # Set up
+        #
+        cases = [
+            {'Nested': _stack({'Fn::Sub': _NESTED_URL})},
+            {'Nested': _stack('not a URL')},
+            {'Nested': {'Type': 'AWS::CloudFormation::Stack'}},
+            {'Nested': 'oops'},
+        ]
+
+        for resources in cases:
+            #
+            # Call/Test
+            #
+            self.assertRaises(UnresolvedReference, self._delete_objects, \
+                resources)
+            self.assertEqual([], self._aws.deleted)
+
+    def testDeletionFailed(self):
+        #
+        # Set up
+        #
+        self._aws.delete_errors = [{'Key': 'lambda/unused', \
+            'Message': 'Access Denied'}]
+
+        #
+        # Call/Test
+        #
+        self.assertRaises(DeletionFailed, self._delete_objects, {})
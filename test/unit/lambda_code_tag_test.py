@@ -0,0 +1,297 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import io
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from cfnplus import lambda_code_tag, utils
+from cfnplus.utils import Context
+
+class LambdaCodeInlineTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'func'))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, rel_path, contents):
+        with io.open(os.path.join(self._dir, rel_path), 'w') as f:
+            f.write(contents)
+
+    def _make_ctx(self, rsrc_node):
+        ctx = Context({}, aws_region='us-west-2', \
+            template_path=os.path.join(self._dir, 'template.yml'))
+        ctx.resource_name = 'MyFunction'
+        ctx.resource_node = rsrc_node
+        return ctx
+
+    def testInlineSmallFile(self):
+        #
+        # Set up
+        #
+        code = u'def go(event, context):\n    return 1\n'
+        self._write('func/my_func.py', code)
+        rsrc_node = {
+            'Type': 'AWS::Lambda::Function',
+            'Properties': {'Handler': 'my_func.go', 'Runtime': 'python3.6'},
+        }
+        arg_node = {
+            'LocalPath': 'func',
+            'S3Dest': 's3://my-bucket/lambda',
+            'Inline': True,
+        }
+
+        #
+        # Call
+        #
+        result = lambda_code_tag.evaluate(arg_node, self._make_ctx(rsrc_node))
+
+        #
+        # Test
+        #
+        self.assertEqual(('Code', {'ZipFile': code}), result.new_template)
+        self.assertEqual([], result.before_creation)
+        self.assertEqual('index.go', rsrc_node['Properties']['Handler'])
+
+    def testFallBackIfTooBig(self):
+        #
+        # Set up
+        #
+        code = u'#' * (lambda_code_tag.MAX_INLINE_CODE_SIZE + 1)
+        self._write('func/my_func.py', code)
+        rsrc_node = {
+            'Type': 'AWS::Lambda::Function',
+            'Properties': {'Handler': 'my_func.go', 'Runtime': 'python3.6'},
+        }
+        arg_node = {
+            'LocalPath': 'func',
+            'S3Dest': 's3://my-bucket/lambda',
+            'Inline': True,
+        }
+
+        #
+        # Call
+        #
+        result = lambda_code_tag.evaluate(arg_node, self._make_ctx(rsrc_node))
+
+        #
+        # Test
+        #
+        tag_name, tag_value = result.new_template
+        self.assertEqual('Code', tag_name)
+        self.assertEqual('my-bucket', tag_value['S3Bucket'])
+        self.assertEqual(1, len(result.before_creation))
+        self.assertEqual('my_func.go', rsrc_node['Properties']['Handler'])
+
+    def testFallBackIfManyFiles(self):
+        #
+        # Set up
+        #
+        self._write('func/my_func.py', u'import util\n')
+        self._write('func/util.py', u'X = 1\n')
+        rsrc_node = {
+            'Type': 'AWS::Lambda::Function',
+            'Properties': {'Handler': 'my_func.go', 'Runtime': 'python3.6'},
+        }
+        arg_node = {
+            'LocalPath': 'func',
+            'S3Dest': 's3://my-bucket/lambda',
+            'Inline': True,
+        }
+
+        #
+        # Call
+        #
+        result = lambda_code_tag.evaluate(arg_node, self._make_ctx(rsrc_node))
+
+        #
+        # Test
+        #
+        self.assertIn('S3Key', result.new_template[1])
+        self.assertEqual(1, len(result.before_creation))
+
+def _make_wheel(wheelhouse_path, value):
+    '''
+    Make a wheel for a package "tinydep" (always version 1.0.0) containing a
+    module that defines VALUE.
+    '''
+
+    dist_info = 'tinydep-1.0.0.dist-info'
+    files = {
+        'tinydep.py': 'VALUE = {!r}\n'.format(value),
+        dist_info + '/METADATA': \
+            'Metadata-Version: 2.1\nName: tinydep\nVersion: 1.0.0\n',
+        dist_info + '/WHEEL': 'Wheel-Version: 1.0\nGenerator: test\n' \
+            'Root-Is-Purelib: true\nTag: py2.py3-none-any\n',
+    }
+    files[dist_info + '/RECORD'] = ''.join('{},,\n'.format(fn) \
+        for fn in list(files) + [dist_info + '/RECORD'])
+    wheel_path = os.path.join(wheelhouse_path, \
+        'tinydep-1.0.0-py2.py3-none-any.whl')
+    with zipfile.ZipFile(wheel_path, 'w') as z:
+        for fn, contents in files.items():
+            z.writestr(fn, contents)
+
+class LambdaCodeRequirementsTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'func'))
+        os.mkdir(os.path.join(self._dir, 'wheels'))
+        with io.open(os.path.join(self._dir, 'func', 'f.py'), 'w') as f:
+            f.write(u'import tinydep\n')
+        with io.open(os.path.join(self._dir, 'requirements.txt'), 'w') as f:
+            f.write(u'tinydep\n')
+
+        self._old_cache_dir = os.environ.get(utils.CACHE_DIR_ENV_VAR)
+        os.environ[utils.CACHE_DIR_ENV_VAR] = os.path.join(self._dir, 'cache')
+
+        # count pip runs
+        self._pip_runs = 0
+        self._old_check_call = subprocess.check_call
+        def check_call(*args, **kwargs):
+            self._pip_runs += 1
+            return self._old_check_call(*args, **kwargs)
+        subprocess.check_call = check_call
+
+    def tearDown(self):
+        subprocess.check_call = self._old_check_call
+        if self._old_cache_dir is None:
+            del os.environ[utils.CACHE_DIR_ENV_VAR]
+        else:
+            os.environ[utils.CACHE_DIR_ENV_VAR] = self._old_cache_dir
+        shutil.rmtree(self._dir)
+
+    def _evaluate(self, ctx=None):
+        '''
+        :return: The package made by Aruba::LambdaCode, as a dict.
+        '''
+
+        if ctx is None:
+            ctx = Context({}, aws_region='us-west-2', \
+                template_path=os.path.join(self._dir, 'template.yml'))
+        ctx.resource_name = 'MyFunction'
+        ctx.resource_node = {
+            'Type': 'AWS::Lambda::Function',
+            'Properties': {'Handler': 'f.go'},
+        }
+        arg_node = {
+            'LocalPath': 'func',
+            'S3Dest': 's3://my-bucket/lambda',
+            'Requirements': 'requirements.txt',
+            'Wheelhouse': 'wheels',
+        }
+        result = lambda_code_tag.evaluate(arg_node, ctx)
+        return result.before_creation[0].args['package']
+
+    def _package_files(self):
+        '''
+        :return: A dict mapping the paths of the files in the function's
+        package to their contents.
+        '''
+
+        package = self._evaluate()
+        with lambda_code_tag._LambdaPkgMaker(**package).open() as f: # pylint: disable=protected-access
+            with zipfile.ZipFile(f) as z:
+                return dict((n, z.read(n)) for n in z.namelist())
+
+    def testRequirementsAreInstalledOnce(self):
+        #
+        # Set up
+        #
+        _make_wheel(os.path.join(self._dir, 'wheels'), 'a')
+
+        #
+        # Call
+        #
+        files_1 = self._package_files()
+        files_2 = self._package_files()
+
+        #
+        # Test
+        #
+        self.assertEqual(b'import tinydep\n', files_1['f.py'])
+        self.assertEqual(b"VALUE = 'a'\n", files_1['tinydep.py'])
+        self.assertEqual(files_1, files_2)
+        self.assertEqual(1, self._pip_runs)
+
+    def testRebuiltWheelIsInstalled(self):
+        #
+        # Set up
+        #
+        _make_wheel(os.path.join(self._dir, 'wheels'), 'a')
+        self._package_files()
+
+        #
+        # Call
+        #
+        # same name and version, different contents
+        _make_wheel(os.path.join(self._dir, 'wheels'), 'b')
+        files = self._package_files()
+
+        #
+        # Test
+        #
+        self.assertEqual(b"VALUE = 'b'\n", files['tinydep.py'])
+        self.assertEqual(2, self._pip_runs)
+
+    def testInstalledRequirementsAreAnInput(self):
+        #
+        # Set up
+        #
+        _make_wheel(os.path.join(self._dir, 'wheels'), 'a')
+        ctx = Context({}, aws_region='us-west-2', \
+            template_path=os.path.join(self._dir, 'template.yml'))
+        inputs = ctx.record_inputs()
+
+        #
+        # Call
+        #
+        package = self._evaluate(ctx)
+
+        #
+        # Test
+        #
+        self.assertIn(('dir', package['deps_dir']), inputs)
+
+    def testMissingInstalledRequirementsAreAnError(self):
+        #
+        # Set up
+        #
+        _make_wheel(os.path.join(self._dir, 'wheels'), 'a')
+        package = self._evaluate()
+        shutil.rmtree(package['deps_dir'])
+        pkg_maker = lambda_code_tag._LambdaPkgMaker(**package) # pylint: disable=protected-access
+
+        #
+        # Test
+        #
+        self.assertRaises(utils.InvalidTemplate, pkg_maker.open)
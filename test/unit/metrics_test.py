@@ -0,0 +1,132 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import shutil
+import tempfile
+from botocore.stub import Stubber
+import cfnplus
+from cfnplus import metrics, utils
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'func'))
+        with open(os.path.join(self._dir, 'func', 'f.py'), 'w') as f:
+            f.write('def go(e, c):\n    return 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def testProcessingMetrics(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Resources:',
+            '  Func:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties:',
+            '      Handler: f.go',
+            '      Aruba::LambdaCode:',
+            '        LocalPath: func',
+            '        S3Dest: s3://my-bucket/lambda',
+        ])
+
+        def process():
+            return cfnplus.process_template(template_str, [], 'us-west-2', \
+                template_path=os.path.join(self._dir, 'template.yml'), \
+                cache_dir=os.path.join(self._dir, 'cache'))
+
+        #
+        # Call
+        #
+        result_1 = process()
+        result_2 = process()
+
+        #
+        # Test
+        #
+        pkg_size = len('def go(e, c):\n    return 1\n')
+        m = result_1.metrics
+        self.assertEqual(1, m.get('cfnplus_lambda_packages'))
+        self.assertEqual(pkg_size, m.get('cfnplus_lambda_package_bytes'))
+        self.assertEqual(pkg_size, m.get('cfnplus_bytes_hashed'))
+        self.assertEqual(1, m.get('cfnplus_cache_requests', \
+            cache='template', result='miss'))
+        self.assertEqual(1, result_2.metrics.get('cfnplus_cache_requests', \
+            cache='template', result='hit'))
+        self.assertEqual(0, result_2.metrics.get('cfnplus_lambda_packages'))
+        self.assertGreater(m.get('cfnplus_phase_seconds', phase='process'), 0)
+
+    def testApiCallsAreCounted(self):
+        #
+        # Set up
+        #
+        s3 = utils.aws_client('s3', 'us-west-2')
+        m = metrics.Metrics()
+
+        #
+        # Call
+        #
+        with Stubber(s3) as stubber, metrics.active(m):
+            stubber.add_response('head_bucket', {}, {'Bucket': 'b'})
+            stubber.add_response('head_bucket', {}, {'Bucket': 'b'})
+            s3.head_bucket(Bucket='b')
+            s3.head_bucket(Bucket='b')
+
+        #
+        # Test
+        #
+        self.assertEqual(2, m.get('cfnplus_api_calls', service='s3', \
+            operation='HeadBucket'))
+
+    def testOpenMetrics(self):
+        #
+        # Set up
+        #
+        m = metrics.Metrics()
+        m.incr('cfnplus_objects_uploaded', 3)
+        m.incr('cfnplus_api_calls', service='s3', operation='PutObject')
+        path = os.path.join(self._dir, 'cfnplus.prom')
+
+        #
+        # Call
+        #
+        m.write_openmetrics(path)
+
+        #
+        # Test
+        #
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE cfnplus_objects_uploaded counter', lines)
+        self.assertIn('cfnplus_objects_uploaded_total 3', lines)
+        self.assertIn('cfnplus_api_calls_total{operation="PutObject",' + \
+            'service="s3"} 1', lines)
+        self.assertEqual('# EOF', lines[-1])
@@ -0,0 +1,206 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import yaml
+from cfnplus import _process_template
+from cfnplus.partial_eval import partially_evaluate
+from cfnplus.utils import Context
+
+_TEMPLATE = '''
+Parameters:
+  Env: {Type: String}
+  Subnets: {Type: CommaDelimitedList}
+  Password: {Type: String, NoEcho: true}
+  AmiId: {Type: 'AWS::SSM::Parameter::Value<String>'}
+Mappings:
+  EnvMap:
+    prod: {Size: large}
+    dev: {Size: small}
+  Unused:
+    a: {b: c}
+Conditions:
+  IsProd: {'Fn::Equals': [{Ref: Env}, prod]}
+  IsDev: {'Fn::Not': [{Condition: IsProd}]}
+  HasPassword: {'Fn::Not': [{'Fn::Equals': [{Ref: Password}, '']}]}
+Resources:
+  Bucket:
+    Type: AWS::S3::Bucket
+    Properties:
+      BucketName: {'Fn::Sub': '${Env}-${AWS::Region}-bucket'}
+      Size: {'Fn::FindInMap': [EnvMap, {Ref: Env}, Size]}
+      Tags:
+        - {'Fn::If': [IsProd, {Key: prod}, {Ref: 'AWS::NoValue'}]}
+        - Key: subnet
+          Value: {'Fn::Select': [1, {Ref: Subnets}]}
+  ProdOnly:
+    Type: AWS::SNS::Topic
+    Condition: IsProd
+  DevOnly:
+    Type: AWS::SNS::Topic
+    Condition: IsDev
+    DependsOn: [Bucket, ProdOnly]
+  Secret:
+    Type: Custom::Secret
+    Condition: HasPassword
+    Properties:
+      Password: {Ref: Password}
+      Ami: {Ref: AmiId}
+      Arn: {'Fn::GetAtt': [Bucket, Arn]}
+      Name: {'Fn::Sub': '${Env}-${Bucket}-${!Literal}'}
+      List: {'Fn::Join': [',', [{Ref: Env}, {Ref: Bucket}]]}
+Outputs:
+  ProdTopic:
+    Condition: IsProd
+    Value: {Ref: ProdOnly}
+  Name:
+    Value: {'Fn::Join': ['-', {'Fn::Split': [',', 'a,b']}]}
+'''
+
+class PartialEvalTest(unittest.TestCase):
+    def _evaluate(self, template_str):
+        ctx = Context({'Env': 'dev', 'Subnets': 'subnet-1, subnet-2', \
+            'Password': 'secret', 'AmiId': '/ami/latest'}, \
+            aws_region='us-west-2')
+        return partially_evaluate(yaml.safe_load(template_str), ctx)
+
+    def testKnownExpressionsAreFolded(self):
+        #
+        # Call
+        #
+        template = self._evaluate(_TEMPLATE)
+
+        #
+        # Test
+        #
+        bucket = template['Resources']['Bucket']
+        self.assertEqual({
+            'BucketName': 'dev-us-west-2-bucket',
+            'Size': 'small',
+            'Tags': [{'Key': 'subnet', 'Value': 'subnet-2'}],
+        }, bucket['Properties'])
+        self.assertEqual({'Value': 'a-b'}, template['Outputs']['Name'])
+
+    def testFalseConditionsArePruned(self):
+        #
+        # Call
+        #
+        template = self._evaluate(_TEMPLATE)
+
+        #
+        # Test
+        #
+        resources = template['Resources']
+        self.assertNotIn('ProdOnly', resources)
+        self.assertEqual({'Type': 'AWS::SNS::Topic', 'DependsOn': ['Bucket']}, \
+            resources['DevOnly'])
+        self.assertNotIn('ProdTopic', template['Outputs'])
+        self.assertEqual(['HasPassword'], list(template['Conditions']))
+        self.assertNotIn('Mappings', template)
+
+    def testUnknownValuesAreKept(self):
+        #
+        # Call
+        #
+        template = self._evaluate(_TEMPLATE)
+
+        #
+        # Test
+        #
+        secret = template['Resources']['Secret']
+        self.assertEqual('HasPassword', secret['Condition'])
+        self.assertEqual({
+            'Password': {'Ref': 'Password'},
+            'Ami': {'Ref': 'AmiId'},
+            'Arn': {'Fn::GetAtt': ['Bucket', 'Arn']},
+            'Name': {'Fn::Sub': 'dev-${Bucket}-${!Literal}'},
+            'List': {'Fn::Join': [',', ['dev', {'Ref': 'Bucket'}]]},
+        }, secret['Properties'])
+
+    def testSubEscapesSubstitutedValues(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Parameters:',
+            '  Env: {Type: String}',
+            'Resources:',
+            '  Thing:',
+            '    Type: Custom::Thing',
+            '    Properties:',
+            "      A: {'Fn::Sub': ['${Env}-${X}', {X: {Ref: Thing2}}]}",
+            "      B: {'Fn::Sub': ['${Env}-${!Y}', {}]}",
+        ])
+        ctx = Context({'Env': '${Oops}'}, aws_region='us-west-2')
+
+        #
+        # Call
+        #
+        template = partially_evaluate(yaml.safe_load(template_str), ctx)
+
+        #
+        # Test
+        #
+        props = template['Resources']['Thing']['Properties']
+        self.assertEqual({'Fn::Sub': ['${!Oops}-${X}', \
+            {'X': {'Ref': 'Thing2'}}]}, props['A'])
+        self.assertEqual('${Oops}-${Y}', props['B'])
+
+    def testOnlyWhenEnabled(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Parameters:',
+            '  Env: {Type: String}',
+            'Resources:',
+            '  Topic:',
+            '    Type: AWS::SNS::Topic',
+            '    Properties:',
+            '      TopicName: {Ref: Env}',
+        ])
+
+        def process(partial_eval):
+            ctx = Context({'Env': 'dev'}, aws_region='us-west-2', \
+                process_template_func=_process_template, \
+                partial_eval=partial_eval)
+            result = _process_template(template_str, ctx)
+            return yaml.safe_load(result.new_template)
+
+        #
+        # Call
+        #
+        template_1 = process(False)
+        template_2 = process(True)
+
+        #
+        # Test
+        #
+        props_1 = template_1['Resources']['Topic']['Properties']
+        self.assertEqual({'Ref': 'Env'}, props_1['TopicName'])
+        props_2 = template_2['Resources']['Topic']['Properties']
+        self.assertEqual('dev', props_2['TopicName'])
@@ -0,0 +1,188 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import shutil
+import tempfile
+import cfnplus
+from cfnplus import proc_cache, utils
+
+TEMPLATE = '''
+Metadata:
+  Aruba::BeforeCreation:
+    - S3Upload:
+        LocalFile: data.txt
+        S3Dest: {'Fn::Sub': 's3://${Bucket}/data.txt'}
+Resources:
+  Func:
+    Type: AWS::Lambda::Function
+    Properties:
+      Handler: f.go
+      Aruba::LambdaCode:
+        LocalPath: func
+        S3Dest: {'Fn::Sub': 's3://${Bucket}/lambda'}
+'''
+
+class ProcessingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._cache_dir = os.path.join(self._dir, 'cache')
+        os.mkdir(os.path.join(self._dir, 'func'))
+        self._write('func/f.py', 'def go(e, c):\n    return 1\n')
+        self._write('data.txt', 'hello')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, rel_path, contents):
+        with open(os.path.join(self._dir, rel_path), 'w') as f:
+            f.write(contents)
+
+    def _process(self):
+        return cfnplus.process_template(
+            TEMPLATE,
+            [{'ParameterKey': 'Bucket', 'ParameterValue': 'my-bucket'}],
+            'us-west-2',
+            template_path=os.path.join(self._dir, 'template.yml'),
+            cache_dir=self._cache_dir,
+        )
+
+    def testHit(self):
+        #
+        # Set up
+        #
+        result_1 = self._process()
+
+        #
+        # Call
+        #
+        result_2 = self._process()
+
+        #
+        # Test
+        #
+        self.assertEqual(result_1.new_template, result_2.new_template)
+        self.assertEqual(
+            [a.to_dict() for a in result_1.before_creation],
+            [a.to_dict() for a in result_2.before_creation],
+        )
+        self.assertEqual(2, len(result_2.before_creation))
+
+    def testMissWhenLambdaCodeChanges(self):
+        #
+        # Set up
+        #
+        result_1 = self._process()
+        self._write('func/f.py', 'def go(e, c):\n    return 22\n')
+
+        #
+        # Call
+        #
+        result_2 = self._process()
+
+        #
+        # Test
+        #
+        self.assertNotEqual(result_1.new_template, result_2.new_template)
+
+    def testResourceResultIsReused(self):
+        #
+        # Set up
+        #
+        self._process()
+        results_dir = os.path.join(self._cache_dir, 'results')
+        num_entries = len(os.listdir(results_dir))
+        template = TEMPLATE + '''
+  Topic:
+    Type: AWS::SNS::Topic
+'''
+
+        #
+        # Call
+        #
+        result = cfnplus.process_template(
+            template,
+            [{'ParameterKey': 'Bucket', 'ParameterValue': 'my-bucket'}],
+            'us-west-2',
+            template_path=os.path.join(self._dir, 'template.yml'),
+            cache_dir=self._cache_dir,
+        )
+
+        #
+        # Test
+        #
+
+        # only an entry for the whole template should have been added
+        self.assertEqual(num_entries + 1, len(os.listdir(results_dir)))
+        self.assertIn('Topic', result.new_template)
+        self.assertIn('S3Key', result.new_template)
+        self.assertEqual(2, len(result.before_creation))
+
+    def testHitDoesNotRewriteDigests(self):
+        #
+        # Set up
+        #
+        self._process()
+        digests_path = os.path.join(self._cache_dir, 'digests.json')
+        os.utime(digests_path, (1000, 1000))
+
+        #
+        # Call
+        #
+        self._process()
+
+        #
+        # Test
+        #
+        self.assertEqual(1000, os.stat(digests_path).st_mtime)
+
+    def testLeastRecentlyUsedResultsAreRemoved(self):
+        #
+        # Set up
+        #
+        results_dir = os.path.join(self._cache_dir, 'results')
+        cache = proc_cache.ProcessingCache(self._cache_dir, max_bytes=29000)
+        def put(key):
+            cache.put(key, [], utils.Result(new_template='x' * 10000), None)
+        put('a')
+        os.utime(os.path.join(results_dir, 'a.json'), (1000, 1000))
+        put('b')
+        os.utime(os.path.join(results_dir, 'b.json'), (2000, 2000))
+        cache.get('a', None)
+
+        #
+        # Call
+        #
+        put('c')
+
+        #
+        # Test
+        #
+        self.assertEqual(['a.json', 'c.json'], sorted(os.listdir(results_dir)))
+        self.assertIsNone(cache.get('b', None))
+        self.assertEqual('x' * 10000, cache.get('a', None).new_template)
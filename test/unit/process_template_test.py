@@ -0,0 +1,408 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
+import yaml
+import cfnplus
+from cfnplus import _process_template, utils
+from cfnplus.utils import Context, InvalidTemplate
+
+class ProcessTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'func'))
+        with open(os.path.join(self._dir, 'func', 'f.py'), 'w') as f:
+            f.write('def go(e, c):\n    return 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _process(self, template_str):
+        ctx = Context({'Bucket': 'my-bucket'}, aws_region='us-west-2', \
+            template_path=os.path.join(self._dir, 'template.yml'), \
+            process_template_func=_process_template)
+        result = _process_template(template_str, ctx)
+        return result, yaml.safe_load(result.new_template)
+
+    def testTagInSequence(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Resources:',
+            '  Thing:',
+            '    Type: Custom::Thing',
+            '    Properties:',
+            '      Functions:',
+            '        - Aruba::LambdaCode:',
+            '            LocalPath: func',
+            "            S3Dest: {'Fn::Sub': 's3://${Bucket}/lambda'}",
+        ])
+
+        #
+        # Call
+        #
+        result, template = self._process(template_str)
+
+        #
+        # Test
+        #
+        funcs = template['Resources']['Thing']['Properties']['Functions']
+        self.assertEqual('my-bucket', funcs[0]['Code']['S3Bucket'])
+        self.assertEqual(1, len(result.before_creation))
+
+    def testSharedNodeIsEvaluatedOnce(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Resources:',
+            '  Func1:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties: &props',
+            '      Handler: f.go',
+            '      Aruba::LambdaCode:',
+            '        LocalPath: func',
+            '        S3Dest: s3://my-bucket/lambda',
+            '  Func2:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties: *props',
+        ])
+
+        #
+        # Call
+        #
+        result, template = self._process(template_str)
+
+        #
+        # Test
+        #
+        rsrcs = template['Resources']
+        self.assertEqual(rsrcs['Func1']['Properties'], \
+            rsrcs['Func2']['Properties'])
+        self.assertIn('Code', rsrcs['Func2']['Properties'])
+        self.assertEqual(1, len(result.before_creation))
+
+    def testNestedStacksInParallel(self):
+        #
+        # Set up
+        #
+        lines = ['Resources:']
+        for i in range(6):
+            nested_path = os.path.join(self._dir, 'nested{}.yml'.format(i))
+            with open(nested_path, 'w') as f:
+                f.write('\n'.join([
+                    'Resources:',
+                    '  Func:',
+                    '    Type: AWS::Lambda::Function',
+                    '    Properties:',
+                    '      Handler: f.go{}'.format(i),
+                    '      Aruba::LambdaCode:',
+                    '        LocalPath: func',
+                    '        S3Dest: s3://my-bucket/lambda',
+                ]))
+            lines += [
+                '  Stack{}:'.format(i),
+                '    Type: Aruba::Stack',
+                '    Properties:',
+                '      Template:',
+                '        LocalPath: nested{}.yml'.format(i),
+                '        S3Dest: s3://my-bucket/templates',
+            ]
+        template_str = '\n'.join(lines)
+
+        def process(max_workers):
+            return cfnplus.process_template(template_str, [], 'us-west-2', \
+                template_path=os.path.join(self._dir, 'template.yml'), \
+                max_workers=max_workers)
+
+        #
+        # Call
+        #
+        serial_result = process(1)
+        parallel_result = process(4)
+
+        #
+        # Test
+        #
+        self.assertEqual(serial_result.new_template, \
+            parallel_result.new_template)
+        self.assertEqual(
+            [a.to_dict() for a in serial_result.before_creation],
+            [a.to_dict() for a in parallel_result.before_creation],
+        )
+        # six templates, and the Lambda package they share
+        self.assertEqual(7, len(parallel_result.before_creation))
+
+    def testNestedStacksInNestedTemplatesDoNotHang(self):
+        #
+        # Set up
+        #
+        def stack_lines(name, template_fn):
+            return [
+                '  {}:'.format(name),
+                '    Type: Aruba::Stack',
+                '    Properties:',
+                '      Template:',
+                '        LocalPath: {}'.format(template_fn),
+                '        S3Dest: s3://my-bucket/templates',
+            ]
+        for i in range(2):
+            with open(os.path.join(self._dir, 'nested{}.yml'.format(i)), \
+                'w') as f:
+                f.write('\n'.join(['Resources:'] + \
+                    stack_lines('A', 'leaf.yml') + \
+                    stack_lines('B', 'leaf.yml')))
+        with open(os.path.join(self._dir, 'leaf.yml'), 'w') as f:
+            f.write('Resources: {}\n')
+        template_str = '\n'.join(['Resources:'] + \
+            stack_lines('Stack0', 'nested0.yml') + \
+            stack_lines('Stack1', 'nested1.yml'))
+
+        errors = []
+        def process():
+            try:
+                cfnplus.process_template(template_str, [], 'us-west-2', \
+                    template_path=os.path.join(self._dir, 'template.yml'), \
+                    max_workers=2)
+            except Exception as e:
+                errors.append(e)
+
+        #
+        # Call
+        #
+        thread = threading.Thread(target=process)
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+
+        #
+        # Test
+        #
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, len(errors))
+        self.assertIsInstance(errors[0], InvalidTemplate)
+
+    def testNestedStackDoesNotUseParentStackName(self):
+        #
+        # Set up
+        #
+        func_lines = [
+            '  Func:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties:',
+            '      Handler: f.go',
+            '      Aruba::LambdaCode:',
+            '        LocalPath: func',
+            "        S3Dest: {'Fn::Sub': 's3://my-bucket/${AWS::StackName}'}",
+        ]
+        with open(os.path.join(self._dir, 'nested.yml'), 'w') as f:
+            f.write('\n'.join(['Resources:'] + func_lines))
+        template_str = '\n'.join(['Resources:'] + func_lines + [
+            '  Stack:',
+            '    Type: Aruba::Stack',
+            '    Properties:',
+            '      Template:',
+            '        LocalPath: nested.yml',
+            '        S3Dest: s3://my-bucket/templates',
+        ])
+        ctx = Context({}, aws_region='us-west-2', stack_name='Parent', \
+            template_path=os.path.join(self._dir, 'template.yml'), \
+            process_template_func=_process_template)
+
+        #
+        # Call/Test
+        #
+        # nested stacks' names are not known
+        self.assertRaises(InvalidTemplate, _process_template, template_str, \
+            ctx)
+
+    def testTagsInParallel(self):
+        #
+        # Set up
+        #
+        lines = ['Resources:']
+        for i in range(6):
+            func_dir = os.path.join(self._dir, 'func{}'.format(i))
+            os.mkdir(func_dir)
+            with open(os.path.join(func_dir, 'f.py'), 'w') as f:
+                f.write('def go(e, c):\n    return {}\n'.format(i))
+            lines += [
+                '  Func{}:'.format(i),
+                '    Type: AWS::Lambda::Function',
+                '    Properties:',
+                '      Handler: f.go',
+                '      Aruba::LambdaCode:',
+                '        LocalPath: func{}'.format(i),
+                '        S3Dest: s3://my-bucket/lambda',
+            ]
+        template_str = '\n'.join(lines)
+
+        def process(max_workers, hash_processes):
+            return cfnplus.process_template(template_str, [], 'us-west-2', \
+                template_path=os.path.join(self._dir, 'template.yml'), \
+                max_workers=max_workers, hash_processes=hash_processes)
+
+        #
+        # Call
+        #
+        serial_result = process(1, 0)
+        parallel_result = process(4, 2)
+
+        #
+        # Test
+        #
+        self.assertEqual(serial_result.new_template, \
+            parallel_result.new_template)
+        self.assertEqual(
+            [a.to_dict() for a in serial_result.before_creation],
+            [a.to_dict() for a in parallel_result.before_creation],
+        )
+        self.assertEqual(6, len(parallel_result.before_creation))
+
+    def testProcessTemplates(self):
+        #
+        # Set up
+        #
+        with open(os.path.join(self._dir, 'nested.yml'), 'w') as f:
+            f.write('\n'.join([
+                'Resources:',
+                '  Func:',
+                '    Type: AWS::Lambda::Function',
+                '    Properties:',
+                '      Handler: f.go',
+                '      Aruba::LambdaCode:',
+                '        LocalPath: func',
+                "        S3Dest: {'Fn::Sub': 's3://${Bucket}/lambda'}",
+            ]))
+        template_str = '\n'.join([
+            'Resources:',
+            '  Stack:',
+            '    Type: Aruba::Stack',
+            '    Properties:',
+            '      Template:',
+            '        LocalPath: nested.yml',
+            "        S3Dest: {'Fn::Sub': 's3://${Bucket}/templates'}",
+            '      Parameters:',
+            "        Bucket: {'Ref': 'Bucket'}",
+        ])
+        jobs = []
+        for region in ['us-west-2', 'us-east-1', 'us-west-2']:
+            jobs.append({
+                'template_str': template_str,
+                'template_params': [{'ParameterKey': 'Bucket', \
+                    'ParameterValue': 'bucket-' + region}],
+                'aws_region': region,
+                'template_path': os.path.join(self._dir, 'template.yml'),
+            })
+
+        #
+        # Call
+        #
+        results = cfnplus.process_templates(jobs, max_workers=4)
+
+        #
+        # Test
+        #
+        self.assertEqual(3, len(results))
+        for job, result in zip(jobs, results):
+            expected = cfnplus.process_template(job['template_str'], \
+                job['template_params'], job['aws_region'], \
+                template_path=job['template_path'], max_workers=1)
+            self.assertEqual(expected.new_template, result.new_template)
+            self.assertEqual(
+                [a.to_dict() for a in expected.before_creation],
+                [a.to_dict() for a in result.before_creation],
+            )
+            self.assertEqual(2, len(result.before_creation))
+
+    def testBucketIsCheckedOncePerBatch(self):
+        #
+        # Set up
+        #
+        from botocore.stub import Stubber
+        jobs = [{
+            'template_str': 'Resources: {}',
+            'template_params': [],
+            'aws_region': region,
+        } for region in ['us-west-2', 'us-east-1']]
+        results = cfnplus.process_templates(jobs)
+        checks = []
+        def check_bucket(undoers, committers):
+            checks.append(utils.bucket_exists('my-bucket', 'us-west-2'))
+        for result in results:
+            result.before_creation.append(check_bucket)
+        utils.reuse_aws_clients()
+        self.addCleanup(utils.reuse_aws_clients, False)
+        s3 = utils.aws_client('s3', 'us-west-2')
+
+        #
+        # Call
+        #
+        with Stubber(s3) as stubber:
+            stubber.add_response('head_bucket', {}, {'Bucket': 'my-bucket'})
+            for result in results:
+                result.do_before_creation()
+
+        #
+        # Test
+        #
+        self.assertEqual([True, True], checks)
+        stubber.assert_no_pending_responses()
+
+    def testBoto3NotImportedWithoutActions(self):
+        #
+        # Set up
+        #
+        script = '\n'.join([
+            'import sys',
+            'import cfnplus',
+            "template = 'Resources: {Topic: {Type: AWS::SNS::Topic}}'",
+            "cfnplus.process_template(template, [], 'us-west-2')",
+            "print(','.join(sorted(m for m in ('boto3', 'botocore') " + \
+                "if m in sys.modules)))",
+        ])
+        root = os.path.join(os.path.dirname(__file__), '..', '..')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+
+        #
+        # Call
+        #
+        output = subprocess.check_output([sys.executable, '-c', script], \
+            env=env)
+
+        #
+        # Test
+        #
+        self.assertEqual(b'', output.strip())
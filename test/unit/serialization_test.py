@@ -0,0 +1,112 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+from cfnplus import serialization
+
+class SerializationTest(unittest.TestCase):
+    def testAnchorsAreExpanded(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Metadata:',
+            '  Policy: &policy {Version: 1}',
+            'Resources:',
+            '  Role:',
+            '    Properties: {PolicyDocument: *policy}',
+        ])
+
+        #
+        # Call
+        #
+        template = serialization.load_template(template_str)
+        result = serialization.dump_yaml(template)
+
+        #
+        # Test
+        #
+        self.assertNotIn('&', result)
+        self.assertNotIn('*', result)
+        self.assertEqual(template, serialization.load_template(result))
+        self.assertEqual({'Version': 1}, \
+            template['Resources']['Role']['Properties']['PolicyDocument'])
+
+    def testJsonAndYamlGiveSameResult(self):
+        #
+        # Set up
+        #
+        json_str = '{"Resources": {"Bucket": {"Type": "AWS::S3::Bucket", ' + \
+            '"Properties": {"Tags": [{"Key": "n", "Value": 2}]}}}}'
+        yaml_str = '\n'.join([
+            'Resources:',
+            '  Bucket:',
+            '    Type: AWS::S3::Bucket',
+            '    Properties:',
+            '      Tags:',
+            '        - {Key: n, Value: 2}',
+        ])
+
+        #
+        # Call
+        #
+        from_json = serialization.load_template(json_str)
+        from_yaml = serialization.load_template(yaml_str)
+
+        #
+        # Test
+        #
+        self.assertEqual(from_yaml, from_json)
+
+    def testOutputFormats(self):
+        #
+        # Set up
+        #
+        template = serialization.load_template('\n'.join([
+            'AWSTemplateFormatVersion: 2010-09-09',
+            'Resources:',
+            '  Bucket: {Type: AWS::S3::Bucket}',
+        ]))
+
+        for output_format in serialization.OUTPUT_FORMATS:
+            #
+            # Call
+            #
+            result = serialization.dump_template(template, output_format)
+
+            #
+            # Test
+            #
+            parsed = serialization.load_template(result)
+            self.assertEqual('AWS::S3::Bucket', \
+                parsed['Resources']['Bucket']['Type'])
+            self.assertEqual('2010-09-09', \
+                str(parsed['AWSTemplateFormatVersion']))
+
+        minified = serialization.dump_template(template, \
+            serialization.FORMAT_JSON_MINIFIED)
+        self.assertNotIn(' ', minified)
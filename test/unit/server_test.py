@@ -0,0 +1,159 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import cfnplus
+from cfnplus import server, client, storage
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'func'))
+        with open(os.path.join(self._dir, 'func', 'f.py'), 'w') as f:
+            f.write('def go(e, c):\n    return 1\n')
+        self._template_str = '\n'.join([
+            'Resources:',
+            '  Func:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties:',
+            '      Handler: f.go',
+            '      Aruba::LambdaCode:',
+            '        LocalPath: func',
+            "        S3Dest: {'Fn::Sub': 's3://${Bucket}/lambda'}",
+        ])
+
+        self._backend = storage.MemoryBackend()
+        storage.set_backend(self._backend)
+
+        socket_path = os.path.join(self._dir, 'worker.sock')
+        self._server = server.Server(socket_path, server.Worker(\
+            os.path.join(self._dir, 'cache'), max_workers=2))
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        self._client = client.Client(socket_path)
+
+    def tearDown(self):
+        self._client.close()
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
+        storage.set_backend(None)
+        shutil.rmtree(self._dir)
+
+    def _process(self, cl):
+        return cl.process_template(self._template_str, \
+            [{'ParameterKey': 'Bucket', 'ParameterValue': 'my-bucket'}], \
+            'us-west-2', template_path=os.path.join(self._dir, 'template.yml'))
+
+    def _uploaded_keys(self):
+        bucket = self._backend.buckets.get('my-bucket')
+        return [] if bucket is None else bucket.list('lambda/')
+
+    def testProcessAndDoActions(self):
+        #
+        # Call
+        #
+        with self._process(self._client) as result:
+            result.do_before_creation()
+            result.do_after_creation()
+
+        #
+        # Test
+        #
+        expected = cfnplus.process_template(self._template_str, \
+            [{'ParameterKey': 'Bucket', 'ParameterValue': 'my-bucket'}], \
+            'us-west-2', template_path=os.path.join(self._dir, 'template.yml'))
+        self.assertEqual(expected.new_template, result.new_template)
+        self.assertEqual(1, len(result.before_creation))
+        self.assertEqual('LambdaCodeUpload', result.before_creation[0]['kind'])
+        self.assertEqual(1, len(self._uploaded_keys()))
+
+    def testActionsAreUndoneOnError(self):
+        #
+        # Call
+        #
+        try:
+            with self._process(self._client) as result:
+                result.do_before_creation()
+                uploaded = self._uploaded_keys()
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        #
+        # Test
+        #
+        self.assertEqual(1, len(uploaded))
+        self.assertEqual([], self._uploaded_keys())
+
+    def testUnfinishedResultsAreUndoneOnDisconnect(self):
+        #
+        # Set up
+        #
+        other_client = client.Client(self._server.socket_path)
+        result = self._process(other_client)
+        result.do_before_creation()
+        uploaded = self._uploaded_keys()
+
+        #
+        # Call
+        #
+        other_client.close()
+
+        # wait for the worker to notice
+        for _ in range(100):
+            if len(self._uploaded_keys()) == 0:
+                break
+            time.sleep(0.05)
+
+        #
+        # Test
+        #
+        self.assertEqual(1, len(uploaded))
+        self.assertEqual([], self._uploaded_keys())
+
+    def testErrors(self):
+        #
+        # Call
+        #
+        def process_invalid():
+            self._client.process_template('Resources: {Thing: ' \
+                '{Type: Custom::Thing, Properties: {Aruba::LambdaCode: 1}}}', \
+                [], 'us-west-2')
+
+        #
+        # Test
+        #
+        self.assertRaises(cfnplus.InvalidTemplate, process_invalid)
+        self.assertRaises(ValueError, self._client.request, \
+            'do_before_creation', id=1234)
+        self.assertEqual(3, self._client.ping()['requests'])
@@ -0,0 +1,271 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import io
+import shutil
+import tempfile
+import cfnplus.s3_ops as s3_ops
+import cfnplus.storage as storage
+
+class _StorageTestMixin(object):
+    def _make_storage(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self._storage = self._make_storage()
+
+    def assertObjectExists(self, key, contents):
+        self.assertIsNotNone(self._storage.head(key))
+        self.assertEqual(contents, self._storage.get(key))
+
+    def assertObjectDoesNotExist(self, key):
+        self.assertIsNone(self._storage.head(key))
+        self.assertRaises(KeyError, self._storage.get, key)
+
+    def testUploadFile_noExisting(self):
+        #
+        # Set up
+        #
+
+        key = 'my_file'
+        file_contents = b"Hello world"
+
+        #
+        # Call
+        #
+        results = {}
+        for outcome in ['commit', 'undo']:
+            committers = []
+            undoers = []
+            s3_ops.upload_file(io.BytesIO(file_contents), self._storage, \
+                key, committers=committers, undoers=undoers)
+            for f in (committers if outcome == 'commit' else undoers):
+                f()
+            results[outcome] = self._storage.head(key) is not None
+            if outcome == 'commit':
+                results['contents'] = self._storage.get(key)
+                self._storage.delete(key, self._storage.head(key).version_id)
+
+        #
+        # Test
+        #
+        self.assertTrue(results['commit'])
+        self.assertEqual(file_contents, results['contents'])
+        self.assertFalse(results['undo'])
+
+    def testUploadFile_existing_success(self):
+        #
+        # Set up
+        #
+
+        key = 'my_file'
+        old_contents = b"Hello world"
+        new_contents = old_contents + b" again"
+        old_version = self._storage.put(key, old_contents)
+
+        #
+        # Call
+        #
+        committers = []
+        undoers = []
+        s3_ops.upload_file(io.BytesIO(new_contents), self._storage, key, \
+            committers=committers, undoers=undoers)
+        for f in committers:
+            f()
+
+        #
+        # Test
+        #
+        self.assertObjectExists(key, new_contents)
+        self.assertRaises(KeyError, self._storage.get, key, old_version)
+
+    def testUploadFile_existing_failure(self):
+        #
+        # Set up
+        #
+
+        key = 'my_file'
+        old_contents = b"Hello world"
+        self._storage.put(key, old_contents)
+
+        #
+        # Call
+        #
+        committers = []
+        undoers = []
+        s3_ops.upload_file(io.BytesIO(old_contents + b" again"), \
+            self._storage, key, committers=committers, undoers=undoers)
+        for f in undoers:
+            f()
+
+        #
+        # Test
+        #
+        self.assertObjectExists(key, old_contents)
+
+    def testUploadFile_same(self):
+        #
+        # Set up
+        #
+
+        key = 'my_file'
+        contents = b"Hello world"
+        committers = []
+        undoers = []
+        s3_ops.upload_file(io.BytesIO(contents), self._storage, key, \
+            committers=committers, undoers=undoers)
+        version = self._storage.head(key).version_id
+
+        #
+        # Call
+        #
+        committers = []
+        undoers = []
+        s3_ops.upload_file(io.BytesIO(contents), self._storage, key, \
+            committers=committers, undoers=undoers)
+
+        #
+        # Test
+        #
+        self.assertEqual([], committers)
+        self.assertEqual([], undoers)
+        self.assertEqual(version, self._storage.head(key).version_id)
+
+    def testDeleteObject(self):
+        #
+        # Set up
+        #
+
+        key = 'my_file'
+        contents = b"Hello world"
+
+        #
+        # Call
+        #
+        self._storage.put(key, contents)
+        committers = []
+        undoers = []
+        s3_ops.delete_object(self._storage, key, committers=committers, \
+            undoers=undoers)
+        deleted = self._storage.head(key) is None
+        for f in undoers:
+            f()
+        restored = self._storage.head(key) is not None
+
+        committers = []
+        undoers = []
+        s3_ops.delete_object(self._storage, key, committers=committers, \
+            undoers=undoers)
+        for f in committers:
+            f()
+
+        #
+        # Test
+        #
+        self.assertTrue(deleted)
+        self.assertTrue(restored)
+        self.assertObjectDoesNotExist(key)
+        self.assertEqual([], self._storage.list(key))
+
+    def testMakeDir(self):
+        #
+        # Set up
+        #
+
+        key = 'my_dir/'
+        self._storage.put('other_dir/file', b'x')
+
+        #
+        # Call
+        #
+        committers = []
+        undoers = []
+        s3_ops.make_dir(self._storage, key, committers=committers, \
+            undoers=undoers)
+        made = self._storage.list(key)
+        s3_ops.make_dir(self._storage, key, committers=[], undoers=[])
+        for f in undoers:
+            f()
+
+        #
+        # Test
+        #
+        self.assertEqual([key], made)
+        self.assertEqual([], self._storage.list(key))
+        self.assertEqual(['other_dir/file'], self._storage.list())
+
+class MemoryStorageTest(_StorageTestMixin, unittest.TestCase):
+    def _make_storage(self):
+        return storage.MemoryStorage('test-bucket')
+
+class LocalStorageTest(_StorageTestMixin, unittest.TestCase):
+    def _make_storage(self):
+        self._root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._root)
+        return storage.LocalStorage('test-bucket', self._root)
+
+    def testObjectsArePersistent(self):
+        #
+        # Set up
+        #
+        self._storage.put('a/b c', b"Hello world")
+
+        #
+        # Call
+        #
+        other = storage.LocalStorage('test-bucket', self._root)
+
+        #
+        # Test
+        #
+        self.assertEqual(['a/b c'], other.list())
+        self.assertEqual(b"Hello world", other.get('a/b c'))
+
+class GetStorageTest(unittest.TestCase):
+    def tearDown(self):
+        storage.set_backend(None)
+
+    def testBackendIsUsed(self):
+        #
+        # Set up
+        #
+        backend = storage.MemoryBackend()
+        storage.set_backend(backend)
+
+        #
+        # Call
+        #
+        bucket1 = storage.get_storage('my-bucket', 'us-west-2')
+        bucket2 = storage.get_storage('my-bucket', 'us-west-2')
+
+        #
+        # Test
+        #
+        self.assertIs(bucket1, bucket2)
+        self.assertTrue(bucket1.exists())
+        self.assertIs(bucket1, backend.buckets['my-bucket'])
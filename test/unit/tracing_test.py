@@ -0,0 +1,104 @@
+# (C) Copyright 2018 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# and in the "LICENSE.txt" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# pylint: disable=superfluous-parens
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+# pylint: disable=global-statement
+# pylint: disable=broad-except
+# pylint: disable=bare-except
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-statements
+# pylint: disable=too-many-return-statements
+# pylint: disable=import-error
+# pylint: disable=no-else-return
+# pylint: disable=len-as-condition
+# pylint: disable=too-few-public-methods
+# pylint: disable=unused-argument
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import cfnplus
+from cfnplus import tracing
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'func'))
+        with open(os.path.join(self._dir, 'func', 'f.py'), 'w') as f:
+            f.write('def go(e, c):\n    return 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def testSpans(self):
+        #
+        # Set up
+        #
+        template_str = '\n'.join([
+            'Resources:',
+            '  Func1:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties:',
+            '      Handler: f.go',
+            '      Aruba::LambdaCode:',
+            '        LocalPath: func',
+            '        S3Dest: s3://my-bucket/lambda1',
+            '  Func2:',
+            '    Type: AWS::Lambda::Function',
+            '    Properties:',
+            '      Handler: f.go',
+            '      Aruba::LambdaCode:',
+            '        LocalPath: func',
+            '        S3Dest: s3://my-bucket/lambda2',
+        ])
+
+        #
+        # Call
+        #
+        with tracing.Tracer() as tracer:
+            cfnplus.process_template(template_str, [], 'us-west-2', \
+                template_path=os.path.join(self._dir, 'template.yml'), \
+                max_workers=4)
+
+        #
+        # Test
+        #
+        spans = {s.span_id: s for s in tracer.spans}
+        tag_spans = [s for s in tracer.spans if s.name == 'Aruba::LambdaCode']
+        self.assertEqual(['Func1', 'Func2'], \
+            sorted(s.args['resource'] for s in tag_spans))
+
+        # tags are evaluated in other threads, but their spans are still
+        # children of the template's span
+        for s in tag_spans:
+            while s.parent_id is not None:
+                s = spans[s.parent_id]
+            self.assertEqual('process_template', s.name)
+
+        trace = json.loads(json.dumps(tracer.to_chrome_trace()))
+        self.assertEqual(len(tracer.spans), len(trace['traceEvents']))
+
+    def testNoTracer(self):
+        #
+        # Call
+        #
+        with tracing.span('nothing'):
+            pass
+
+        #
+        # Test
+        #
+        self.assertEqual((None, None), tracing._current()) # pylint: disable=protected-access